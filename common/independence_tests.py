@@ -13,11 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from warnings import warn
+from collections import OrderedDict
 import math
+import threading
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import special, stats
 
 
 class CITest(object):
@@ -414,6 +415,205 @@ class CITest(object):
         return power_divergence(data, x, y, z, lambda_='cressie-read')
 
 
+class GaussCITester(object):
+    """
+    Fisher-z conditional independence test for Gaussian data, with state.
+
+    Equivalent to ``CITest.gauss`` but meant for the many queries that a
+    constraint-based search issues on the same data: the correlation matrix
+    is computed once and the inverse correlation matrix of every
+    conditioning set is cached, so a query only costs a few dot products.
+    The partial correlation of x and y given z is read from the Schur
+    complement ``C[ab] - C[az] inv(C[zz]) C[zb]``.
+
+    Parameters
+    ----------
+    data : ndarray
+        The dataset on which to test the independence conditions.
+    max_cache_size : int, default None
+        maximum number of cached conditioning sets, the least recently used
+        ones are evicted first. None means unbounded.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> np.random.seed(23)
+    >>> data = np.random.rand(2500, 4)
+    >>> tester = GaussCITester(data)
+    >>> _, _, p_value = tester(data, 0, 1, [2, 3])
+    >>> p_values = tester.batch([0, 0, 1], [1, 2, 2], z=[3])
+    """
+
+    def __init__(self, data, max_cache_size=None):
+        data = np.asarray(data, dtype=float)
+        self.n_samples = data.shape[0]
+        self.corr = np.corrcoef(data.T)
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        # the cache is shared by the threads of a parallel search
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _projection(self, z):
+        """``C[:, z] inv(C[z, z])`` and ``C[:, z]`` of the conditioning set"""
+
+        key = tuple(sorted(z))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        index = list(key)
+        cross = self.corr[:, index]
+        try:
+            precision = np.linalg.inv(self.corr[np.ix_(index, index)])
+        except np.linalg.LinAlgError:
+            precision = np.linalg.pinv(self.corr[np.ix_(index, index)])
+        value = (cross.dot(precision), cross)
+        with self._lock:
+            value = self._cache.setdefault(key, value)
+            self._cache.move_to_end(key)
+            if (self.max_cache_size is not None
+                    and len(self._cache) > self.max_cache_size):
+                self._cache.popitem(last=False)
+
+        return value
+
+    def partial_corr(self, x, y, z=()):
+        """
+        Partial correlations of the pairs (x[i], y[i]) given the same set z.
+
+        Parameters
+        ----------
+        x : int or array-like of int
+        y : int or array-like of int
+        z : List, default ()
+            conditioning set shared by all pairs.
+
+        Returns
+        -------
+        r : ndarray
+            partial correlations, clipped to (-1, 1).
+        """
+
+        x = np.atleast_1d(np.asarray(x, dtype=int))
+        y = np.atleast_1d(np.asarray(y, dtype=int))
+        r = self.corr[x, y]
+        if len(z) > 0:
+            proj, cross = self._projection(z)
+            r_xy = r - np.einsum('ij,ij->i', proj[x], cross[y])
+            r_xx = self.corr[x, x] - np.einsum('ij,ij->i', proj[x], cross[x])
+            r_yy = self.corr[y, y] - np.einsum('ij,ij->i', proj[y], cross[y])
+            r = r_xy / np.sqrt(np.abs(r_xx * r_yy))
+        cut_at = 0.99999
+
+        return np.clip(r, -cut_at, cut_at)
+
+    def batch(self, x, y, z=()):
+        """
+        p-values of x[i] _|_ y[i] | z for a batch of pairs sharing z.
+
+        Returns
+        -------
+        p_value : ndarray
+        """
+
+        r = self.partial_corr(x, y, z)
+        # Fisher’s z-transform
+        res = np.sqrt(self.n_samples - len(z) - 3) * .5 * np.log1p((2 * r) / (1 - r))
+
+        return 2 * stats.norm.sf(np.abs(res))
+
+    def batch_queries(self, queries):
+        """
+        p-values of arbitrary queries, grouped by conditioning set so that
+        each group is answered by one vectorized ``batch`` call.
+
+        Parameters
+        ----------
+        queries : iterable of (x, y, z)
+
+        Returns
+        -------
+        p_value : ndarray
+            in the order of ``queries``.
+        """
+
+        groups = {}
+        queries = list(queries)
+        for i, (x, y, z) in enumerate(queries):
+            groups.setdefault(tuple(sorted(z)), []).append((i, x, y))
+        p_value = np.empty(len(queries))
+        for z, group in groups.items():
+            index, x, y = zip(*group)
+            p_value[list(index)] = self.batch(x, y, z)
+
+        return p_value
+
+    def __call__(self, data, x, y, z):
+        """Same interface as ``CITest.gauss``, ``data`` is ignored."""
+
+        return None, None, float(self.batch(x, y, z)[0])
+
+
+class DiscreteCITester(object):
+    """
+    Power divergence conditional independence test on fixed categorical
+    data, see ``power_divergence``.
+
+    Every column is coded once as small ints when the tester is built, so
+    the many queries of a constraint-based search only count the
+    contingency tables.
+
+    Parameters
+    ----------
+    data : ndarray or pd.DataFrame
+        The dataset on which to test the independence conditions.
+    lambda_ : float or str, optional
+        statistic of the power divergence family, see ``power_divergence``.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> np.random.seed(23)
+    >>> data = np.random.randint(0, 5, size=(2500, 4))
+    >>> tester = DiscreteCITester(data, lambda_='log-likelihood')
+    >>> chi2, dof, p_value = tester(data, 0, 1, [2, 3])
+    """
+
+    def __init__(self, data, lambda_=None):
+        if isinstance(lambda_, str):
+            if lambda_ not in _POWER_DIV_LAMBDA:
+                raise ValueError(f"Invalid string for lambda_: {lambda_!r}, "
+                                 f"must be one of {list(_POWER_DIV_LAMBDA)}.")
+            lambda_ = _POWER_DIV_LAMBDA[lambda_]
+        elif lambda_ is None:
+            lambda_ = 1
+        self.lambda_ = lambda_
+        self.columns = None
+        if isinstance(data, pd.DataFrame):
+            self.columns = list(data.columns)
+            data = data.values
+        data = np.asarray(data)
+        self._encoded = [_encode(data[:, k]) for k in range(data.shape[1])]
+
+    def __call__(self, data, x, y, z):
+        """Same interface as ``CITest.chi2_test``, ``data`` is ignored."""
+
+        if self.columns is not None:
+            x, y = self.columns.index(x), self.columns.index(y)
+            z = [self.columns.index(k) for k in z]
+
+        return _power_divergence_test(self._encoded, x, y, z, self.lambda_)
+
+
 def power_divergence(data, x, y, z, lambda_=None):
     """
     This function tests the null hypothesis that the categorical data.
@@ -502,52 +702,442 @@ def power_divergence(data, x, y, z, lambda_=None):
     >>> 0.0 5 1.0
     """
 
-    if not isinstance(data, pd.DataFrame):
-        data = pd.DataFrame(data)
-
-    if len(z) == 0:
-        group_x_y = data.groupby([x, y]).size()
-        x_y = group_x_y.unstack(y, fill_value=0)
-        chi2, p_value, dof, exp = stats.chi2_contingency(x_y, lambda_=lambda_)
+    if isinstance(data, pd.DataFrame):
+        columns = list(data.columns)
+        data = data.values
+        x, y = columns.index(x), columns.index(y)
+        z = [columns.index(k) for k in z]
+    if isinstance(lambda_, str):
+        if lambda_ not in _POWER_DIV_LAMBDA:
+            raise ValueError(f"Invalid string for lambda_: {lambda_!r}, "
+                             f"must be one of {list(_POWER_DIV_LAMBDA)}.")
+        lambda_ = _POWER_DIV_LAMBDA[lambda_]
+    elif lambda_ is None:
+        lambda_ = 1
+
+    encoded = {k: _encode(data[:, k]) for k in {x, y, *z}}
+
+    return _power_divergence_test(encoded, x, y, z, lambda_)
+
+
+_POWER_DIV_LAMBDA = {
+    "pearson": 1,
+    "log-likelihood": 0,
+    "freeman-tukey": -1 / 2,
+    "mod-log-likelihood": -1,
+    "neyman": -2,
+    "cressie-read": 2 / 3,
+}
+
+# largest [strata, x_levels, y_levels] tensor counted at once
+_MAX_TABLE_SIZE = 2 ** 22
+
+
+def _power_divergence_test(encoded, x, y, z, lambda_):
+    """``power_divergence`` on columns coded by ``_encode``"""
+
+    chi2, dof = 0.0, 0
+    for counts in _contingency_counts(encoded, x, y, z):
+        stratum_chi2, stratum_dof = _stratified_power_divergence(counts,
+                                                                 lambda_)
+        chi2, dof = chi2 + stratum_chi2, dof + stratum_dof
+    if dof == 0:
+        chi2, p_value = 0.0, 1.0
     else:
-        chi2 = 0
-        dof = 0
-        for z_state, df in data.groupby(z):
-            try:
-                group_x_y = df.groupby([x, y]).size()
-                x_y = group_x_y.unstack(y, fill_value=0)
-                c, _, d, _ = stats.chi2_contingency(x_y, lambda_=lambda_)
-                chi2 += c
-                dof += d
-            except ValueError:
-                warn(f"Skipping the test {x}\u27C2{y}|{z}. Not enough samples.")
-        if dof == 0:
-            p_value = 1.0
-        else:
-            p_value = stats.chi2.sf(chi2, df=dof)
-                
+        p_value = stats.chi2.sf(chi2, df=dof)
+
     return chi2, dof, p_value
 
 
-def _rbf_dot(x):
+def _encode(column):
+    """Code a categorical column as small non-negative ints.
+
+    Returns the codes and the number of levels, rows holding NaN get -1."""
+
+    column = np.asarray(column)
+    if (column.dtype.kind in 'iub' and column.size and column.min() >= 0
+            and column.max() < column.size):
+        return column.astype(np.int64), int(column.max()) + 1
+    valid = ~pd.isnull(column)
+    levels, codes = np.unique(column[valid], return_inverse=True)
+    out = np.full(column.shape[0], -1, dtype=np.int64)
+    out[valid] = codes.reshape(-1)
+
+    return out, len(levels)
+
+
+def _contingency_counts(encoded, x, y, z):
+    """
+    Counts of every (z, x, y) state, as tensors shaped
+    [n_strata, x_levels, y_levels].
+
+    Every row gets a mixed-radix code and a single ``np.bincount`` fills
+    the whole tensor. Only the strata observed in the data are kept. When
+    that tensor would exceed ``_MAX_TABLE_SIZE`` cells, every stratum is
+    counted on its own with the levels of x and y observed in it.
+
+    Parameters
+    ----------
+    encoded : dict
+        codes and number of levels of each variable, see ``_encode``.
+    """
+
+    x_code, n_x = encoded[x]
+    y_code, n_y = encoded[y]
+    n_rows = x_code.shape[0]
+    valid = (x_code >= 0) & (y_code >= 0)
+    z_code, n_z = np.zeros(n_rows, dtype=np.int64), 1
+    for k in z:
+        code, n_k = encoded[k]
+        valid &= code >= 0
+        z_code = z_code * n_k + np.maximum(code, 0)
+        n_z *= n_k
+        if n_z > n_rows:
+            # keep the radix bounded by relabelling the observed strata
+            _, z_code = np.unique(z_code, return_inverse=True)
+            z_code = z_code.reshape(-1)
+            n_z = int(z_code.max()) + 1 if z_code.size else 1
+    x_code, y_code, z_code = x_code[valid], y_code[valid], z_code[valid]
+
+    if n_z * n_x * n_y <= _MAX_TABLE_SIZE:
+        code = (z_code * n_x + x_code) * n_y + y_code
+        counts = np.bincount(code, minlength=n_z * n_x * n_y)
+        counts = counts.reshape(n_z, n_x, n_y).astype(float)
+        return [counts[counts.sum(axis=(1, 2)) > 0]]
+
+    order = np.argsort(z_code, kind='stable')
+    bounds = np.flatnonzero(np.diff(z_code[order])) + 1
+    tables = []
+    for rows in np.split(order, bounds):
+        if not rows.size:
+            continue
+        x_levels, x_local = np.unique(x_code[rows], return_inverse=True)
+        y_levels, y_local = np.unique(y_code[rows], return_inverse=True)
+        code = x_local.reshape(-1) * len(y_levels) + y_local.reshape(-1)
+        counts = np.bincount(code, minlength=len(x_levels) * len(y_levels))
+        tables.append(counts.reshape(1, len(x_levels), len(y_levels))
+                      .astype(float))
+
+    return tables
+
+
+def _stratified_power_divergence(counts, lambda_):
+    """
+    Sum over strata of ``stats.chi2_contingency`` statistics and degrees of
+    freedom, computed in one vectorized pass.
+
+    As with a per-stratum table, levels of x or y absent from a stratum are
+    dropped and Yates' correction is applied to strata with one degree of
+    freedom.
+    """
+
+    row = counts.sum(axis=2, keepdims=True)
+    col = counts.sum(axis=1, keepdims=True)
+    total = row.sum(axis=1, keepdims=True)
+    dof = ((row > 0).sum(axis=(1, 2)) - 1) * ((col > 0).sum(axis=(1, 2)) - 1)
+    cell = (row > 0) & (col > 0) & (dof[:, None, None] > 0)
+    expected = np.where(cell, row * col / np.where(total > 0, total, 1), 1)
+    observed = np.where(cell, counts, 1)
+
+    yates = (dof == 1)[:, None, None]
+    diff = expected - observed
+    observed = np.where(yates,
+                        observed + np.minimum(0.5, np.abs(diff)) * np.sign(diff),
+                        observed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if lambda_ == 1:
+            terms = (observed - expected) ** 2 / expected
+        elif lambda_ == 0:
+            terms = 2.0 * special.xlogy(observed, observed / expected)
+        elif lambda_ == -1:
+            terms = 2.0 * special.xlogy(expected, expected / observed)
+        else:
+            terms = observed * ((observed / expected) ** lambda_ - 1)
+            terms /= 0.5 * lambda_ * (lambda_ + 1)
+    chi2 = np.sum(np.where(cell, terms, 0.0))
+
+    return float(chi2), int(dof[dof > 0].sum())
+
+
+def _median_width(x, max_samples=1000):
+    """
+    Median heuristic of the RBF kernel: sqrt(0.5 * median) of the positive
+    pairwise squared distances, computed on at most ``max_samples`` evenly
+    spaced rows.
+    """
 
     n = x.shape[0]
+    if max_samples is not None and n > max_samples:
+        x = x[np.linspace(0, n - 1, max_samples).astype(int)]
+    G = np.sum(x * x, 1)
+    dists = G[:, None] + G[None, :] - 2 * np.dot(x, x.T)
+    dists = dists[np.triu_indices(x.shape[0], k=1)]
+
+    return np.sqrt(0.5 * np.median(dists[dists > 0]))
+
+
+def _rbf_dot(x, width=None, max_samples=1000):
+
+    if width is None:
+        width = _median_width(x, max_samples=max_samples)
+    G = np.sum(x * x, 1)
+    H = np.dot(x, x.T)
+    H *= -2
+    H += G[:, None]
+    H += G[None, :]
+    H /= -2 * width ** 2
+
+    return np.exp(H, out=H)
+
+
+def _rbf_features(x, width, n_features, method='rff'):
+    """
+    Low-rank features ``F`` of the RBF kernel, ``F F^T`` approximates
+    ``_rbf_dot(x, width)`` in O(n * n_features) memory.
+
+    ``method`` is 'rff' (random Fourier features) or 'nystrom' (Nyström
+    approximation on ``n_features`` random landmarks).
+    """
+
+    n, dim = x.shape
+    if method == 'rff':
+        W = np.random.randn(dim, n_features) / width
+        b = np.random.uniform(0, 2 * np.pi, n_features)
+        return np.sqrt(2. / n_features) * np.cos(np.dot(x, W) + b)
+    elif method == 'nystrom':
+        landmarks = x[np.random.choice(n, min(n_features, n), replace=False)]
+        G = np.sum(x * x, 1)[:, None] + np.sum(landmarks * landmarks, 1)[None, :]
+        K_nm = np.exp(-(G - 2 * np.dot(x, landmarks.T)) / (2 * width ** 2))
+        K_mm = _rbf_dot(landmarks, width)
+        eigval, eigvec = np.linalg.eigh(K_mm)
+        keep = eigval > 1e-10 * eigval.max()
+        return np.dot(K_nm, eigvec[:, keep] / np.sqrt(eigval[keep]))
+    else:
+        raise ValueError(f"approx must be one of [None, 'rff', 'nystrom'], "
+                         f"but got {method}.")
+
+
+def _center(K):
+    """``H K H`` with ``H = I - 11^T / n``, by mean subtraction."""
+
+    row = K.mean(axis=0)
+
+    return K - row[None, :] - K.mean(axis=1)[:, None] + row.mean()
+
+
+class KCITester(object):
+    """
+    Kernel conditional independence test with low-rank kernels.
+
+    A KCI-style test [1]_ where the RBF kernels are approximated by random
+    Fourier features or Nyström features, in the manner of RCIT/RCoT [2]_,
+    so a query costs O(n * n_features^2) instead of O(n^3). The features of
+    x and y are regressed on the features of z, ``R_z = eps (K_z + eps I)^-1``
+    applied through the Woodbury identity, and the statistic is
+    ``n * ||Cov(R_z F_x, R_z F_y)||^2``. Its null distribution is
+    approximated by a gamma distribution matching the mean and variance of
+    the weighted chi-square limit.
+
+    The kernel of a set of variables is the product of per-variable RBF
+    kernels, whose building blocks (projections on the random frequencies
+    or squared distances to the landmarks) are cached per variable, so
+    tests with overlapping conditioning sets share most of the work. The
+    width of the kernel of the conditioning set is given by the median
+    heuristic on the joint set and its number of features grows with the
+    size of the set, otherwise the regression on z underfits and the test
+    rejects true conditional independences once |z| >= 2.
+
+    References
+    ----------
+    .. [1] Zhang, K., Peters, J., Janzing, D., & Schölkopf, B. (2011).
+           Kernel-based conditional independence test and application in
+           causal discovery. UAI.
+    .. [2] Strobl, E. V., Zhang, K., & Visweswaran, S. (2019). Approximate
+           kernel-based conditional independence tests for fast
+           non-parametric causal discovery. Journal of Causal Inference.
+
+    Parameters
+    ----------
+    data : ndarray
+        The dataset on which to test the independence conditions.
+    approx : str, default 'rff'
+        'rff' (random Fourier features) or 'nystrom'.
+    n_features : int, default 100
+        number of features, or of landmarks for 'nystrom', per variable of
+        the conditioning set.
+    max_features : int, default 500
+        maximum number of features of the conditioning set.
+    n_test_features : int, default 5
+        number of features of x and of y.
+    epsilon : float, default 1e-3
+        ridge of the regression on the conditioning set.
+    z_width : float, default 0.5
+        kernel width of the conditioning set relative to the median
+        heuristic of the joint set. A narrower kernel lowers the bias of
+        the regression on z, which otherwise inflates the false positive
+        rate on strongly nonlinear, low-noise data.
+    max_samples : int, default 1000
+        number of samples used by the median heuristic of kernel widths.
+    max_cache_size : int, default None
+        maximum number of variables whose features are cached, the least
+        recently used ones are evicted first. None means unbounded.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> np.random.seed(23)
+    >>> z = np.random.randn(10000, 1)
+    >>> data = np.hstack([np.sin(z), np.cos(z), z]) + 0.1 * np.random.randn(10000, 3)
+    >>> tester = KCITester(data)
+    >>> _, _, p_value = tester(data, 0, 1, [2])
+    """
+
+    def __init__(self, data, approx='rff', n_features=100, max_features=500,
+                 n_test_features=5, epsilon=1e-3, z_width=0.5,
+                 max_samples=1000, max_cache_size=None):
+        if approx not in ('rff', 'nystrom'):
+            raise ValueError(f"approx must be one of ['rff', 'nystrom'], "
+                             f"but got {approx}.")
+        data = np.asarray(data, dtype=float)
+        self.data = (data - data.mean(axis=0)) / data.std(axis=0)
+        self.n_samples, n_vars = data.shape
+        self.approx = approx
+        self.n_features = n_features
+        self.max_features = max(max_features, n_features)
+        self.n_test_features = min(n_test_features, n_features)
+        self.epsilon = epsilon
+        self.z_width = z_width
+        self.max_samples = max_samples
+        self.max_cache_size = max_cache_size
+        if approx == 'rff':
+            self._frequencies = np.random.randn(n_vars, self.max_features)
+            self._phases = np.random.uniform(0, 2 * np.pi, self.max_features)
+        else:
+            self._landmarks = np.random.choice(
+                self.n_samples, min(self.max_features, self.n_samples),
+                replace=False)
+        self._cache = OrderedDict()
+        self._widths = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _variable(self, v):
+        """Cached kernel building blocks of variable v"""
+
+        with self._lock:
+            if v in self._cache:
+                self._cache.move_to_end(v)
+                return self._cache[v]
+        x = self.data[:, [v]]
+        width = _median_width(x, max_samples=self.max_samples)
+        if self.approx == 'rff':
+            block = np.dot(x, self._frequencies[[v]]) / width
+        else:
+            landmarks = x[self._landmarks]
+            block = ((x - landmarks.T) ** 2 / (2 * width ** 2),
+                     (landmarks - landmarks.T) ** 2 / (2 * width ** 2))
+        with self._lock:
+            self._widths[v] = width
+            block = self._cache.setdefault(v, block)
+            self._cache.move_to_end(v)
+            if (self.max_cache_size is not None
+                    and len(self._cache) > self.max_cache_size):
+                self._cache.popitem(last=False)
+
+        return block
+
+    def features(self, variables, n_features=None, width=1.):
+        """Column-centred low-rank features of the product RBF kernel of
+        ``variables``, [n_samples, n_features], ``width`` scales the median
+        heuristic"""
+
+        m = self.n_features if n_features is None else n_features
+        blocks = [self._variable(v) for v in variables]
+        if self.approx == 'rff':
+            F = np.cos(np.sum([b[:, :m] for b in blocks], axis=0) / width
+                       + self._phases[:m])
+            F *= np.sqrt(2. / m)
+        else:
+            K_nm = np.exp(-np.sum([b[0][:, :m] for b in blocks], axis=0) / width ** 2)
+            K_mm = np.exp(-np.sum([b[1][:m, :m] for b in blocks], axis=0) / width ** 2)
+            eigval, eigvec = np.linalg.eigh(K_mm)
+            keep = eigval > 1e-10 * eigval.max()
+            F = np.dot(K_nm, eigvec[:, keep] / np.sqrt(eigval[keep]))
+
+        return F - F.mean(axis=0)
 
-    G = np.sum(x * x, 1).reshape(n, 1)
-    Q = np.tile(G, (1, n))
-    H = Q + G.T - 2 * np.dot(x, x.T)
+    def _joint_width(self, variables):
+        """Median heuristic of the product kernel of ``variables``, relative
+        to the per-variable widths"""
 
-    dists = Q + G.T - 2 * np.dot(x, x.T)
-    dists = dists - np.tril(dists)
-    dists = dists.reshape(n ** 2, 1)
-    deg = np.sqrt(0.5 * np.median(dists[dists > 0]))
+        for v in variables:
+            self._variable(v)
+        widths = np.array([self._widths[v] for v in variables])
 
-    H = np.exp(-H / 2 / (deg ** 2))
+        return _median_width(self.data[:, variables] / widths,
+                             max_samples=self.max_samples)
 
-    return H
+    def test(self, x, y, z=()):
+        """
+        Parameters
+        ----------
+        x : int
+        y : int
+        z : List, default ()
+            conditioning set.
+
+        Returns
+        -------
+        stat : float
+            the test statistic.
+        p_value : float
+        """
+
+        n = self.n_samples
+        z = list(z)
+        A = self.features([x], self.n_test_features)
+        B = self.features([y], self.n_test_features)
+        if len(z) > 0:
+            C = self.features(z, min(self.n_features * len(z),
+                                     self.max_features),
+                              width=self.z_width * self._joint_width(z))
+            AB = np.hstack([A, B])
+            ridge = np.dot(C.T, C) + self.epsilon * np.eye(C.shape[1])
+            # R_z F = F - C (C^T C + eps I)^-1 C^T F
+            AB -= np.dot(C, np.linalg.solve(ridge, np.dot(C.T, AB)))
+            A, B = AB[:, :A.shape[1]], AB[:, A.shape[1]:]
+            A = A - A.mean(axis=0)
+            B = B - B.mean(axis=0)
+
+        stat = np.sum(np.dot(A.T, B) ** 2) / n
+        # the limit is sum_k lambda_k chi2_1, lambda the eigenvalues of the
+        # covariance of the per-sample products a_t b_t^T
+        W = (A[:, :, None] * B[:, None, :]).reshape(n, -1)
+        W -= W.mean(axis=0)
+        cov = np.dot(W.T, W) / n
+        mean, var = np.trace(cov), 2 * np.sum(cov * cov)
+        k, theta = mean ** 2 / var, var / mean
+
+        return stat, stats.gamma.sf(stat, k, scale=theta)
+
+    def __call__(self, data, x, y, z):
+        """Same interface as ``CITest`` methods, ``data`` is ignored."""
+
+        stat, p_value = self.test(x, y, z)
 
+        return None, None, p_value
 
-def hsic_test(x, y, alpha=0.05, normalize=True):
+
+def hsic_test(x, y, alpha=0.05, normalize=True, approx=None, n_features=100,
+              max_samples=1000):
     """Hilbert-Schmidt independence criterion
 
     HSIC with a Gaussian kernel for the independence test,
@@ -568,6 +1158,16 @@ def hsic_test(x, y, alpha=0.05, normalize=True):
         significance level
     normalize: bool, default True
         whether use data normalization
+    approx: str, default None
+        None computes the exact statistic with n x n kernel matrices.
+        'rff' (random Fourier features) or 'nystrom' approximates the
+        kernels with ``n_features`` features, in memory linear in n, for
+        large samples.
+    n_features: int, default 100
+        number of features of the approximation.
+    max_samples: int, default 1000
+        number of samples used by the median heuristic of the kernel width
+        and, when approximating, by the estimate of the variance of HSIC.
 
     Returns
     -------
@@ -594,30 +1194,45 @@ def hsic_test(x, y, alpha=0.05, normalize=True):
         y = (y - np.mean(y)) / np.std(y)
 
     n = x.shape[0]
+    width_x = _median_width(x, max_samples=max_samples)
+    width_y = _median_width(y, max_samples=max_samples)
+    if approx is None:
+        K = _rbf_dot(x, width_x)
+        L = _rbf_dot(y, width_y)
+        Kc = _center(K)
+        Lc = _center(L)
 
-    H = np.identity(n) - np.ones((n, n), dtype=float) / n
-    K = _rbf_dot(x)
-    L = _rbf_dot(y)
-    Kc = np.dot(np.dot(H, K), H)
-    Lc = np.dot(np.dot(H, L), H)
+        testStat = np.sum(Kc.T * Lc) / n
 
-    testStat = np.sum(Kc.T * Lc) / n
+        varHSIC = (Kc * Lc / 6) ** 2
+        varHSIC = (np.sum(varHSIC) - np.trace(varHSIC)) / n / (n - 1)
 
-    varHSIC = (Kc * Lc / 6) ** 2
-    varHSIC = (np.sum(varHSIC) - np.trace(varHSIC)) / n / (n - 1)
-    varHSIC = varHSIC * 72 * (n - 4) * (n - 5) / n / (n - 1) / (n - 2) / (n - 3)
+        sum_K, sum_L = np.sum(K) - np.trace(K), np.sum(L) - np.trace(L)
+    else:
+        Fx = _rbf_features(x, width_x, n_features, method=approx)
+        Fy = _rbf_features(y, width_y, n_features, method=approx)
+        Fxc = Fx - Fx.mean(axis=0)
+        Fyc = Fy - Fy.mean(axis=0)
+
+        testStat = np.sum(np.dot(Fxc.T, Fyc) ** 2) / n
 
-    K = K - np.diag(np.diag(K))
-    L = L - np.diag(np.diag(L))
+        # mean of the off-diagonal terms estimated on a subsample
+        m = min(n, max_samples)
+        sub = np.linspace(0, n - 1, m).astype(int)
+        varHSIC = (np.dot(Fxc[sub], Fxc[sub].T) * np.dot(Fyc[sub], Fyc[sub].T) / 6) ** 2
+        varHSIC = (np.sum(varHSIC) - np.trace(varHSIC)) / m / (m - 1)
+
+        sum_K = np.sum(Fx.sum(axis=0) ** 2) - np.sum(Fx * Fx)
+        sum_L = np.sum(Fy.sum(axis=0) ** 2) - np.sum(Fy * Fy)
+    varHSIC = varHSIC * 72 * (n - 4) * (n - 5) / n / (n - 1) / (n - 2) / (n - 3)
 
-    bone = np.ones((n, 1), dtype=float)
-    muX = np.dot(np.dot(bone.T, K), bone) / n / (n - 1)
-    muY = np.dot(np.dot(bone.T, L), bone) / n / (n - 1)
+    muX = sum_K / n / (n - 1)
+    muY = sum_L / n / (n - 1)
     mHSIC = (1 + muX * muY - muX - muY) / n
     al = mHSIC ** 2 / varHSIC
     bet = varHSIC * n / mHSIC
 
-    thresh = stats.gamma.ppf(1 - alpha, al, scale=bet)[0][0]
+    thresh = stats.gamma.ppf(1 - alpha, al, scale=bet)
 
     if testStat < thresh:
         return 1
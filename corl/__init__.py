@@ -17,4 +17,4 @@
 from castle.backend import backend
 
 if backend == 'pytorch':
-    from .torch import CORL
+    from .torch import CORL, CORLEnsemble
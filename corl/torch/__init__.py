@@ -1 +1,2 @@
-from .corl import CORL
\ No newline at end of file
+from .corl import CORL
+from .ensemble import CORLEnsemble
@@ -28,6 +28,8 @@ from .frame import Actor, EpisodicCritic, Reward, DenseCritic
 from .frame import score_function as Score_Func
 from .utils.data_loader import DataGenerator
 from .utils.graph_analysis import get_graph_from_order, pruning_by_coef
+from .utils.graph_analysis import get_graphs_from_orders
+from .utils.graph_analysis import screen_candidate_parents
 from .utils.graph_analysis import pruning_by_coef_2nd
 
 
@@ -46,6 +48,48 @@ def set_seed(seed):
         pass
 
 
+CHECKPOINT_NAME = 'corl_checkpoint.pt'
+
+
+def get_rng_state():
+    """States of all random generators touched by ``set_seed``"""
+
+    state = {'random': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+
+    return state
+
+
+def set_rng_state(state):
+
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'].cpu())
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def save_checkpoint(state, path):
+    """Write ``state`` to ``path`` atomically, an interrupted save never
+    leaves a truncated checkpoint behind."""
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, device=None):
+
+    try:
+        return torch.load(path, map_location=device, weights_only=False)
+    except TypeError:  # ``weights_only`` is not supported before torch 1.13
+        return torch.load(path, map_location=device)
+
+
 class CORL(BaseLearner):
     """
     Causal discovery with Ordering-based Reinforcement Learning
@@ -87,8 +131,38 @@ class CORL(BaseLearner):
         type of regression function, must be one of ['LR', 'QR']
     reward_gpr_alpha: float, default: 1.0
         alpha of GPR
+    reward_cache_size: int, default: None
+        maximum number of orderings whose scores are cached, the least
+        recently used ones are evicted first. None means unbounded.
+    score_cache_path: str, default: None
+        SQLite file of a persistent RSS cache shared by runs on the same
+        dataset with the same regression type, e.g. seed or learning-rate
+        sweeps. None disables it.
+    candidate_parents: int, default: None
+        If not None, each node only regresses on at most this many candidate
+        parents, screened by correlation before training, see
+        ``screen_candidate_parents``. Makes large graphs tractable.
+    candidate_method: str, default: 'partial_corr'
+        screening statistic, 'corr' or 'partial_corr'.
     iteration: int, default: 5000
         training times
+    checkpoint_dir: str, default: None
+        If not None, actor, critic and optimizer state, RNG states and the
+        best orderings are saved to ``checkpoint_dir/corl_checkpoint.pt``
+        every ``checkpoint_freq`` iterations and when training stops.
+    checkpoint_freq: int, default: 500
+        number of iterations between two checkpoints.
+    early_stop_patience: int, default: None
+        If not None, training stops when the best score has not improved for
+        this many iterations.
+    decode_type: str, default: 'sample'
+        how the final ordering is extracted after training. 'sample' keeps
+        the best ordering sampled during training, 'greedy' additionally
+        decodes one batch taking the most likely node at each step and
+        'beam' additionally runs a beam search scored by the reward's
+        incremental regression score, see ``PointerDecoder.beam_search``.
+    beam_width: int, default: 4
+        number of kept partial orderings when ``decode_type='beam'``.
     actor_lr: float, default: 1e-4
         learning rate of Actor network, includes ``encoder`` and ``decoder``.
     critic_lr: float, default: 1e-3
@@ -133,7 +207,16 @@ class CORL(BaseLearner):
                  reward_score_type='BIC',
                  reward_regression_type='LR',
                  reward_gpr_alpha=1.0,
+                 reward_cache_size=None,
+                 score_cache_path=None,
+                 candidate_parents=None,
+                 candidate_method='partial_corr',
                  iteration=100,
+                 checkpoint_dir=None,
+                 checkpoint_freq=500,
+                 early_stop_patience=None,
+                 decode_type='sample',
+                 beam_width=4,
                  actor_lr=1e-4,
                  critic_lr=1e-3,
                  alpha=0.99,  # for score function
@@ -158,7 +241,16 @@ class CORL(BaseLearner):
         self.config.reward_score_type      = reward_score_type
         self.config.reward_regression_type = reward_regression_type
         self.config.reward_gpr_alpha       = reward_gpr_alpha
+        self.config.reward_cache_size      = reward_cache_size
+        self.config.score_cache_path       = score_cache_path
+        self.config.candidate_parents      = candidate_parents
+        self.config.candidate_method       = candidate_method
         self.config.iteration              = iteration
+        self.config.checkpoint_dir         = checkpoint_dir
+        self.config.checkpoint_freq        = checkpoint_freq
+        self.config.early_stop_patience    = early_stop_patience
+        self.config.decode_type            = decode_type
+        self.config.beam_width             = beam_width
         self.config.actor_lr               = actor_lr
         self.config.critic_lr              = critic_lr
         self.config.alpha                  = alpha
@@ -176,6 +268,10 @@ class CORL(BaseLearner):
             if self.device_type == 'gpu':
                 raise ValueError("GPU is unavailable, "
                                  "please set device_type = 'cpu'.")
+        if decode_type not in ('sample', 'greedy', 'beam'):
+            raise ValueError(f"decode_type must be one of "
+                             f"['sample', 'greedy', 'beam'], but got "
+                             f"{decode_type}.")
         if self.device_type == 'gpu':
             if self.device_ids:
                 os.environ['CUDA_VISIBLE_DEVICES'] = str(self.device_ids)
@@ -203,6 +299,15 @@ class CORL(BaseLearner):
                 (i, j) indicated element `0` denotes there must be no edge
                 between nodes `i` and `j` , the element `1` indicates that
                 there may or may not be an edge.
+            resume_from : str
+                path of a checkpoint written with ``checkpoint_dir``,
+                training continues from the iteration it was saved at.
+            design : ndarray
+                ``data`` with a column of ones appended, shape =
+                [n_samples, n_nodes + 1], reused by the 'LR' reward instead of
+                being rebuilt, see ``CORLEnsemble``.
+            gram : ndarray
+                ``design.T.dot(design)``, reused by the 'LR' reward.
         """
 
         X = Tensor(data, columns=columns)
@@ -213,13 +318,26 @@ class CORL(BaseLearner):
                              f'`n_nodes`, but got '
                              f'batch_size: {self.config.batch_size}, '
                              f'n_nodes: {self.config.seq_length}.')
-        self.dag_mask = getattr(kwargs, 'dag_mask', None)
-        causal_matrix = self._rl_search(X)
+        self.dag_mask = kwargs.get('dag_mask', None)
+        if self.config.candidate_parents is not None:
+            candidate_mask = screen_candidate_parents(
+                X, self.config.candidate_parents,
+                method=self.config.candidate_method
+            )
+            if self.dag_mask is None:
+                self.dag_mask = candidate_mask
+            else:
+                self.dag_mask = np.float64(np.abs(self.dag_mask) > 1e-3) \
+                                * candidate_mask
+        self._design = kwargs.get('design', None)
+        self._gram = kwargs.get('gram', None)
+        causal_matrix = self._rl_search(X,
+                                        resume_from=kwargs.get('resume_from'))
         self.causal_matrix = Tensor(causal_matrix,
                                     index=X.columns,
                                     columns=X.columns)
 
-    def _rl_search(self, X) -> torch.Tensor:
+    def _rl_search(self, X, resume_from=None) -> torch.Tensor:
         """
         Search DAG with ordering-based reinforcement learning
 
@@ -227,6 +345,8 @@ class CORL(BaseLearner):
         ----------
         X: numpy.ndarray
             The numpy.ndarray format data you want to learn.
+        resume_from: str, default: None
+            path of a checkpoint to resume training from.
         """
 
         set_seed(self.config.random_seed)
@@ -235,174 +355,257 @@ class CORL(BaseLearner):
         # generate observed data
         data_generator = DataGenerator(dataset=X,
                                        normalize=self.config.normalize,
-                                       device=self.device)
-        # Instantiating an Actor
-        actor = Actor(input_dim=self.config.input_dim,
-                      embed_dim=self.config.embed_dim,
-                      encoder_blocks=self.config.encoder_blocks,
-                      encoder_heads=self.config.encoder_heads,
-                      encoder_name=self.config.encoder_name,
-                      decoder_name=self.config.decoder_name,
-                      device=self.device)
-        # Instantiating an Critic
-        if self.config.reward_mode == 'episodic':
-            critic = EpisodicCritic(input_dim=self.config.embed_dim,
-                                    device=self.device)
-        else:
-            critic = DenseCritic(input_dim=self.config.embed_dim,
-                                 output_dim=self.config.embed_dim,
-                                 device=self.device)
+                                       device=self.device,
+                                       prefetch=True)
         # Instantiating an Reward
         reward =Reward(input_data=data_generator.dataset.cpu().detach().numpy(),
                        reward_mode=self.config.reward_mode,
                        score_type=self.config.reward_score_type,
                        regression_type=self.config.reward_regression_type,
-                       alpha=self.config.reward_gpr_alpha)
-        # Instantiating an Optimizer
-        optimizer = torch.optim.Adam([
-            {
-                'params': actor.encoder.parameters(), 'lr': self.config.actor_lr
-            },
-            {
-                'params': actor.decoder.parameters(), 'lr': self.config.actor_lr
-            },
-            {
-                'params': critic.parameters(), 'lr': self.config.critic_lr
-            }
-        ])
-
-        # initial max_reward
-        max_reward = float('-inf')
-
-        logging.info(f'Shape of input batch: {self.config.batch_size}, '
-                     f'{self.config.seq_length}, {self.config.input_dim}')
-        logging.info(f'Shape of input batch: {self.config.batch_size}, '
-                     f'{self.config.seq_length}, {self.config.embed_dim}')
-        logging.info('Starting training.')
-
-        graph_batch_pruned = Tensor(np.ones((self.config.seq_length,
-                                             self.config.seq_length)) -
-                                            np.eye(self.config.seq_length))
-        for i in tqdm(range(1, self.config.iteration + 1)):
-            # generate one batch input
-            input_batch = data_generator.draw_batch(batch_size=self.config.batch_size,
-                                                    dimension=self.config.input_dim)
-            # (batch_size, n_nodes, input_dim)
-            encoder_output = actor.encode(input=input_batch)
-            decoder_output = actor.decode(input=encoder_output)
-            actions,action_list,prob_list, mask_scores, s_list,in_flow_list,next_q_list= decoder_output
-
-            batch_graphs = []
-            action_mask_s = []
-            for m in range(actions.shape[0]):
-                zero_matrix = get_graph_from_order(actions[m].cpu())
-                action_mask = np.zeros(zero_matrix.shape[0])
-                for act in actions[m]:
-                    action_mask_s.append(action_mask.copy())
-                    action_mask += np.eye(zero_matrix.shape[0])[act]
-                batch_graphs.append(zero_matrix)
-            batch_graphs = np.stack(batch_graphs) # 64*10*10
-            action_mask_s = np.stack(action_mask_s)
-
-            # Reward
-            reward_output = reward.cal_rewards(batch_graphs, actions.cpu())
-            reward_list, normal_batch_reward, max_reward_batch, td_target = reward_output
-        # return reward_output
-            out_flow = torch.logsumexp(torch.cat([torch.log(torch.tensor(-reward_list))[:, None], next_q_list], 1), 1)
-            loss = (in_flow_list - out_flow).pow(2).mean()
-            print('loss',loss)
-
-
-        #     reward_list, normal_batch_reward, max_reward_batch, td_target = reward_output
-
-            # if max_reward < max_reward_batch:
-            #     max_reward = max_reward_batch
-
-            # # Critic
-            # h_list = s_list
-            # c_list = s_list
-            # prev_input = s_list.reshape((-1, self.config.embed_dim))
-            # prev_state_0 = h_list.reshape((-1, self.config.embed_dim))
-            # prev_state_1 = c_list.reshape((-1, self.config.embed_dim))
-
-            # action_mask_ =  action_mask_s.reshape((-1, self.config.seq_length))
-            # log_softmax = actor.decoder.log_softmax(input=prev_input,
-            #                                         position=actions,
-            #                                         mask=action_mask_,
-            #                                         state_0=prev_state_0,
-            #                                         state_1=prev_state_1)
-            # log_softmax = log_softmax.reshape((self.config.batch_size,
-            #                                    self.config.seq_length)).T
-            # if self.config.reward_mode == 'episodic':
-            #     critic.predict_env(stats_x=s_list[:, :-1, :])
-            #     critic.predict_tgt(stats_y=s_list[:, 1:, :])
-            #     critic.soft_replacement()
-            #     td_target = td_target[::-1][:-1]
-
-            #     actor_loss = Score_Func.episodic_actor_loss(
-            #         td_target=torch.tensor(td_target),
-            #         prediction_env=critic.prediction_env,
-            #         log_softmax=log_softmax,
-            #         device=self.device
-            #     )
-            #     critic_loss = Score_Func.episodic_critic_loss(
-            #         td_target=torch.tensor(td_target),
-            #         prediction_env=critic.prediction_env,
-            #         device=self.device
-            #     )
-            # elif self.config.reward_mode == 'dense':
-            #     log_softmax = torch.sum(log_softmax, 0)
-            #     reward_mean = np.mean(normal_batch_reward)
-            #     self.avg_baseline = self.config.alpha * self.avg_baseline + \
-            #                         (1.0 - self.config.alpha) * reward_mean
-            #     predict_reward = critic.predict_reward(encoder_output=encoder_output)
-
-            #     actor_loss = Score_Func.dense_actor_loss(normal_batch_reward,
-            #                                              self.avg_baseline,
-            #                                              predict_reward,
-            #                                              log_softmax,
-            #                                              device=self.device)
-            #     critic_loss = Score_Func.dense_critic_loss(normal_batch_reward,
-            #                                                self.avg_baseline,
-            #                                                predict_reward,
-            #                                                device=self.device)
-            # else:
-            #     raise ValueError(f"reward_mode must be one of ['episodic', "
-            #                      f"'dense'], but got {self.config.reward_mode}.")
-
-            optimizer.zero_grad()
-            loss.backward()
-
-            # actor_loss.backward()
-            # critic_loss.backward()
-
-
-            optimizer.step()
-
-            # logging
-            if i == 1 or i % consts.LOG_FREQUENCY == 0:
-                logging.info('[iter {}] max_reward: {:.4}, '
-                             'max_reward_batch: {:.4}'.format(i, max_reward,
-                                                              max_reward_batch))
-            if i == 1 or i % consts.LOG_FREQUENCY == 0:
-                ls_kv = reward.update_all_scores()
-                score_min, graph_int_key = ls_kv[0][1][0], ls_kv[0][0]
-                logging.info('[iter {}] score_min {:.4}'.format(i, score_min * 1.0))
-                graph_batch = get_graph_from_order(graph_int_key,
-                                                   dag_mask=self.dag_mask)
-
-                if self.config.reward_regression_type == 'LR':
-                    graph_batch_pruned = pruning_by_coef(
-                        graph_batch, data_generator.dataset.cpu().detach().numpy()
-                    )
-                elif self.config.reward_regression_type == 'QR':
-                    graph_batch_pruned = pruning_by_coef_2nd(
-                        graph_batch, data_generator.dataset.cpu().detach().numpy()
-                    )
-                else:
-                    raise ValueError(f"reward_regression_type must be one of "
-                                     f"['LR', 'QR'], but got "
-                                     f"{self.config.reward_regression_type}.")
-
-        return graph_batch_pruned.T
+                       alpha=self.config.reward_gpr_alpha,
+                       max_cache_size=self.config.reward_cache_size,
+                       cache_path=self.config.score_cache_path,
+                       dag_mask=self.dag_mask,
+                       design=self._design,
+                       gram=self._gram)
+        try:
+            # Instantiating an Actor
+            actor = Actor(input_dim=self.config.input_dim,
+                          embed_dim=self.config.embed_dim,
+                          encoder_blocks=self.config.encoder_blocks,
+                          encoder_heads=self.config.encoder_heads,
+                          encoder_name=self.config.encoder_name,
+                          decoder_name=self.config.decoder_name,
+                          device=self.device)
+            # Instantiating an Critic
+            if self.config.reward_mode == 'episodic':
+                critic = EpisodicCritic(input_dim=self.config.embed_dim,
+                                        device=self.device)
+            else:
+                critic = DenseCritic(input_dim=self.config.embed_dim,
+                                     output_dim=self.config.embed_dim,
+                                     device=self.device)
+            # Instantiating an Optimizer
+            optimizer = torch.optim.Adam([
+                {
+                    'params': actor.encoder.parameters(), 'lr': self.config.actor_lr
+                },
+                {
+                    'params': actor.decoder.parameters(), 'lr': self.config.actor_lr
+                },
+                {
+                    'params': critic.parameters(), 'lr': self.config.critic_lr
+                }
+            ])
+
+            # initial max_reward
+            max_reward = float('-inf')
+            start_iter = 1
+            best_score, best_iter = float('inf'), 0
+            if resume_from is not None:
+                checkpoint = load_checkpoint(resume_from, device=self.device)
+                actor.encoder.load_state_dict(checkpoint['encoder'])
+                actor.decoder.load_state_dict(checkpoint['decoder'])
+                critic.load_state_dict(checkpoint['critic'])
+                optimizer.load_state_dict(checkpoint['optimizer'])
+                data_generator.load_state_dict(checkpoint['data_generator'])
+                reward.top_k = checkpoint['top_k']
+                if 'avg_baseline' in checkpoint:
+                    self.avg_baseline = checkpoint['avg_baseline']
+                set_rng_state(checkpoint['rng_state'])
+                max_reward = checkpoint['max_reward']
+                best_score, best_iter = checkpoint['best_score'], checkpoint['best_iter']
+                start_iter = checkpoint['iteration'] + 1
+                logging.info(f'Resume training from iteration {start_iter}.')
+
+            def save(iteration):
+                state = {
+                    'iteration': iteration,
+                    'encoder': actor.encoder.state_dict(),
+                    'decoder': actor.decoder.state_dict(),
+                    'critic': critic.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'data_generator': data_generator.state_dict(),
+                    'top_k': reward.top_k,
+                    'rng_state': get_rng_state(),
+                    'max_reward': max_reward,
+                    'best_score': best_score,
+                    'best_iter': best_iter,
+                }
+                if self.config.reward_mode == 'dense':
+                    state['avg_baseline'] = self.avg_baseline
+                save_checkpoint(state, os.path.join(self.config.checkpoint_dir,
+                                                    CHECKPOINT_NAME))
+
+            logging.info(f'Shape of input batch: {self.config.batch_size}, '
+                         f'{self.config.seq_length}, {self.config.input_dim}')
+            logging.info(f'Shape of input batch: {self.config.batch_size}, '
+                         f'{self.config.seq_length}, {self.config.embed_dim}')
+            logging.info('Starting training.')
+
+            i, stop = start_iter - 1, False
+            for i in tqdm(range(start_iter, self.config.iteration + 1)):
+                # generate one batch input
+                input_batch = data_generator.draw_batch(batch_size=self.config.batch_size,
+                                                        dimension=self.config.input_dim)
+                # (batch_size, n_nodes, input_dim)
+                encoder_output = actor.encode(input=input_batch)
+                decoder_output = actor.decode(input=encoder_output)
+                actions,action_list,prob_list, mask_scores, s_list,in_flow_list,next_q_list= decoder_output
+
+                batch_graphs, action_mask_s = get_graphs_from_orders(actions)
+                batch_graphs = batch_graphs.cpu().numpy() # 64*10*10
+                action_mask_s = action_mask_s.reshape(-1, self.config.seq_length)
+
+                # Reward
+                reward_output = reward.cal_rewards(batch_graphs, actions.cpu())
+                reward_list, normal_batch_reward, max_reward_batch, td_target = reward_output
+            # return reward_output
+                out_flow = torch.logsumexp(torch.cat([torch.log(torch.tensor(-reward_list))[:, None], next_q_list], 1), 1)
+                loss = (in_flow_list - out_flow).pow(2).mean()
+                print('loss',loss)
+
+
+            #     reward_list, normal_batch_reward, max_reward_batch, td_target = reward_output
+
+                # if max_reward < max_reward_batch:
+                #     max_reward = max_reward_batch
+
+                # # Critic
+                # h_list = s_list
+                # c_list = s_list
+                # prev_input = s_list.reshape((-1, self.config.embed_dim))
+                # prev_state_0 = h_list.reshape((-1, self.config.embed_dim))
+                # prev_state_1 = c_list.reshape((-1, self.config.embed_dim))
+
+                # action_mask_ =  action_mask_s.reshape((-1, self.config.seq_length))
+                # log_softmax = actor.decoder.log_softmax(input=prev_input,
+                #                                         position=actions,
+                #                                         mask=action_mask_,
+                #                                         state_0=prev_state_0,
+                #                                         state_1=prev_state_1)
+                # log_softmax = log_softmax.reshape((self.config.batch_size,
+                #                                    self.config.seq_length)).T
+                # if self.config.reward_mode == 'episodic':
+                #     critic.predict_env(stats_x=s_list[:, :-1, :])
+                #     critic.predict_tgt(stats_y=s_list[:, 1:, :])
+                #     critic.soft_replacement()
+                #     td_target = td_target[::-1][:-1]
+
+                #     actor_loss = Score_Func.episodic_actor_loss(
+                #         td_target=torch.tensor(td_target),
+                #         prediction_env=critic.prediction_env,
+                #         log_softmax=log_softmax,
+                #         device=self.device
+                #     )
+                #     critic_loss = Score_Func.episodic_critic_loss(
+                #         td_target=torch.tensor(td_target),
+                #         prediction_env=critic.prediction_env,
+                #         device=self.device
+                #     )
+                # elif self.config.reward_mode == 'dense':
+                #     log_softmax = torch.sum(log_softmax, 0)
+                #     reward_mean = np.mean(normal_batch_reward)
+                #     self.avg_baseline = self.config.alpha * self.avg_baseline + \
+                #                         (1.0 - self.config.alpha) * reward_mean
+                #     predict_reward = critic.predict_reward(encoder_output=encoder_output)
+
+                #     actor_loss = Score_Func.dense_actor_loss(normal_batch_reward,
+                #                                              self.avg_baseline,
+                #                                              predict_reward,
+                #                                              log_softmax,
+                #                                              device=self.device)
+                #     critic_loss = Score_Func.dense_critic_loss(normal_batch_reward,
+                #                                                self.avg_baseline,
+                #                                                predict_reward,
+                #                                                device=self.device)
+                # else:
+                #     raise ValueError(f"reward_mode must be one of ['episodic', "
+                #                      f"'dense'], but got {self.config.reward_mode}.")
+
+                optimizer.zero_grad()
+                loss.backward()
+
+                # actor_loss.backward()
+                # critic_loss.backward()
+
+
+                optimizer.step()
+
+                # logging
+                if i == 1 or i % consts.LOG_FREQUENCY == 0:
+                    logging.info('[iter {}] max_reward: {:.4}, '
+                                 'max_reward_batch: {:.4}'.format(i, max_reward,
+                                                                  max_reward_batch))
+                graph_int_key, (score_min, _) = reward.best_ordering()
+                if i == 1 or i % consts.LOG_FREQUENCY == 0:
+                    logging.info('[iter {}] score_min {:.4}'.format(i, score_min * 1.0))
+
+                # early stopping
+                if score_min < best_score:
+                    best_score, best_iter = score_min, i
+                stop = (self.config.early_stop_patience is not None and
+                        i - best_iter >= self.config.early_stop_patience)
+                if self.config.checkpoint_dir is not None and (
+                        stop or i % self.config.checkpoint_freq == 0):
+                    save(i)
+                if stop:
+                    logging.info(f'[iter {i}] best score has not improved for '
+                                 f'{self.config.early_stop_patience} iterations, '
+                                 f'stop training.')
+                    break
+            if (self.config.checkpoint_dir is not None and
+                    i % self.config.checkpoint_freq != 0 and not stop):
+                save(i)
+
+            if self.config.decode_type != 'sample':
+                self._decode_final(actor, data_generator, reward)
+            graph_int_key, _ = reward.best_ordering()
+            graph_batch = get_graph_from_order(graph_int_key,
+                                               dag_mask=self.dag_mask)
+            if self.config.reward_regression_type == 'LR':
+                graph_batch_pruned = pruning_by_coef(
+                    graph_batch, data_generator.dataset.cpu().detach().numpy()
+                )
+            elif self.config.reward_regression_type == 'QR':
+                graph_batch_pruned = pruning_by_coef_2nd(
+                    graph_batch, data_generator.dataset.cpu().detach().numpy()
+                )
+            else:
+                raise ValueError(f"reward_regression_type must be one of "
+                                 f"['LR', 'QR'], but got "
+                                 f"{self.config.reward_regression_type}.")
+
+            return graph_batch_pruned.T
+        finally:
+            data_generator.close()
+            reward.close()
+
+    @torch.no_grad()
+    def _decode_final(self, actor, data_generator, reward) -> None:
+        """Decode orderings with the trained actor in one pass, without
+        sampling, and add them to the candidates tracked by ``reward``."""
+
+        actor.encoder.eval()
+        actor.decoder.eval()
+        input_batch = data_generator.draw_batch(batch_size=self.config.batch_size,
+                                                dimension=self.config.input_dim)
+        encoder_output = actor.encode(input=input_batch)
+        if self.config.decode_type == 'greedy':
+            actor.decoder.decode_mode = 'greedy'
+            try:
+                actions = actor.decode(input=encoder_output)[0]
+            finally:
+                actor.decoder.decode_mode = 'sample'
+        else:
+            ordering = actor.decoder.beam_search(
+                encoder_output, reward.incremental_score,
+                beam_width=self.config.beam_width
+            )
+            actions = torch.tensor([ordering])
+        graphs, _ = get_graphs_from_orders(actions)
+        reward.cal_rewards(graphs.cpu().numpy(), actions.cpu())
+        logging.info(f'Decoded {len(actions)} {self.config.decode_type} '
+                     f'ordering(s), best score '
+                     f'{reward.best_ordering()[1][0]:.4}.')
 
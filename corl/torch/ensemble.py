@@ -0,0 +1,218 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+
+from castle.common import BaseLearner, Tensor
+from .corl import CORL
+from .utils.data_loader import DataGenerator
+
+
+def _limit_threads(n_threads):
+    """Bound the intra-op threads of torch and, if available, of BLAS."""
+
+    torch.set_num_threads(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=n_threads)
+
+
+def _attach(spec):
+    """Attach to a shared memory block described by (name, shape, dtype)."""
+
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    return shm, array
+
+
+def _seed_params(seed, corl_params, learn_kwargs):
+    """
+    Parameters of one seed: its own checkpoint directory and checkpoint to
+    resume from, so that the seeds never share a checkpoint.
+    """
+
+    corl_params, learn_kwargs = dict(corl_params), dict(learn_kwargs)
+    if corl_params.get('checkpoint_dir') is not None:
+        corl_params['checkpoint_dir'] = os.path.join(
+            corl_params['checkpoint_dir'], f'seed_{seed}')
+    if learn_kwargs.get('resume_from') is not None:
+        learn_kwargs['resume_from'] = learn_kwargs['resume_from'].format(
+            seed=seed)
+
+    return corl_params, learn_kwargs
+
+
+def _run_seed(seed, design_spec, gram_spec, corl_params, learn_kwargs):
+    """Run one CORL seed on the shared dataset, executed in a worker."""
+
+    design_shm, design = _attach(design_spec)
+    gram_shm, gram = _attach(gram_spec)
+    try:
+        n_nodes = design.shape[1] - 1
+        learner = CORL(random_seed=seed, **corl_params)
+        learner.learn(design[:, :n_nodes], design=design, gram=gram,
+                      **learn_kwargs)
+        causal_matrix = np.asarray(learner.causal_matrix).copy()
+    finally:
+        del design, gram
+        design_shm.close()
+        gram_shm.close()
+
+    return seed, causal_matrix
+
+
+def _to_shared(array):
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+class CORLEnsemble(BaseLearner):
+    """
+    Run CORL with several random seeds on the same dataset in parallel and
+    combine the results into an edge-frequency consensus.
+
+    The (normalized) dataset, its design matrix with a column of ones and the
+    Gram matrix used by the 'LR' reward are computed once and shared with
+    all workers through shared memory, so no worker copies the data or
+    rebuilds the Gram matrix.
+
+    Parameters
+    ----------
+    seeds: iterable of int, default: (0, 1, 2, 3)
+        random seeds, one CORL run each.
+    n_jobs: int, default: None
+        number of worker processes, defaults to ``len(seeds)`` bounded by
+        the number of CPUs.
+    threads_per_job: int, default: 1
+        number of torch/BLAS threads of each worker.
+    threshold: float, default: 0.5
+        an edge belongs to ``causal_matrix`` if it is found by at least this
+        fraction of the seeds.
+    corl_params:
+        other parameters of ``CORL``, except ``random_seed``. With
+        ``checkpoint_dir``, each seed writes its checkpoints to
+        ``checkpoint_dir/seed_<seed>``.
+
+    Attributes
+    ----------
+    graphs: dict
+        causal matrix of each seed.
+    edge_frequency: np.ndarray
+        [n_nodes, n_nodes] fraction of seeds that found each edge.
+
+    Examples
+    --------
+    >>> from castle.datasets import load_dataset
+    >>> X, true_dag, _ = load_dataset('IID_Test')
+    >>> n = CORLEnsemble(seeds=range(8), n_jobs=4, iteration=1000)
+    >>> n.learn(X)
+    >>> print(n.edge_frequency)
+    """
+
+    def __init__(self, seeds=(0, 1, 2, 3), n_jobs=None, threads_per_job=1,
+                 threshold=0.5, **corl_params):
+        super().__init__()
+        if 'random_seed' in corl_params:
+            raise ValueError('Use `seeds` instead of `random_seed`.')
+        self.seeds = list(seeds)
+        self.n_jobs = n_jobs
+        self.threads_per_job = threads_per_job
+        self.threshold = threshold
+        self.corl_params = corl_params
+        self.graphs = None
+        self.edge_frequency = None
+
+    def learn(self, data, columns=None, **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        data: castle.Tensor or numpy.ndarray
+            The castle.Tensor or numpy.ndarray format data you want to learn.
+        columns : Index or array-like
+            Column labels to use for resulting tensor. Will default to
+            RangeIndex (0, 1, 2, ..., n) if no column labels are provided.
+        Other Parameters:
+            passed to ``CORL.learn`` in every worker, e.g. ``dag_mask``.
+            ``resume_from`` must contain a ``{seed}`` field, formatted with
+            the seed of each worker, e.g.
+            ``'ckpt/seed_{seed}/corl_checkpoint.pt'``.
+        """
+
+        resume_from = kwargs.get('resume_from')
+        if resume_from is not None and '{seed}' not in resume_from:
+            raise ValueError('resume_from must contain a {seed} field, one '
+                             'checkpoint is resumed per seed, but got '
+                             f'{resume_from}.')
+
+        X = Tensor(data, columns=columns)
+        corl_params = dict(self.corl_params)
+        dataset = np.asarray(X)
+        if corl_params.pop('normalize', False):
+            dataset = DataGenerator(dataset, normalize=True).dataset.numpy()
+        corl_params['normalize'] = False
+        ones = np.ones((dataset.shape[0], 1), dtype=np.float32)
+        design = np.hstack((dataset, ones))
+        gram = design.T.dot(design)
+
+        n_jobs = self.n_jobs
+        if n_jobs is None:
+            n_jobs = min(len(self.seeds), multiprocessing.cpu_count())
+        design_shm, design_spec = _to_shared(design)
+        gram_shm, gram_spec = _to_shared(gram)
+        del design, gram
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_limit_threads,
+                    initargs=(self.threads_per_job,)) as executor:
+                futures = [executor.submit(_run_seed, seed, design_spec,
+                                           gram_spec,
+                                           *_seed_params(seed, corl_params,
+                                                         kwargs))
+                           for seed in self.seeds]
+                results = [future.result() for future in futures]
+        finally:
+            design_shm.close()
+            design_shm.unlink()
+            gram_shm.close()
+            gram_shm.unlink()
+
+        self.graphs = dict(results)
+        logging.info(f'Finished {len(self.graphs)} CORL seeds.')
+        edge_frequency = np.mean(np.stack(list(self.graphs.values())), axis=0)
+        self.edge_frequency = Tensor(edge_frequency,
+                                     index=X.columns,
+                                     columns=X.columns)
+        self.causal_matrix = Tensor(
+            (edge_frequency >= self.threshold).astype(int),
+            index=X.columns,
+            columns=X.columns
+        )
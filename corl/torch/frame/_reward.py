@@ -14,6 +14,8 @@
 # limitations under the License.
 
 
+import heapq
+from collections import OrderedDict
 import numpy as np
 from scipy.spatial.distance import pdist, squareform
 from scipy.linalg import cholesky, cho_solve
@@ -22,6 +24,7 @@ from sklearn.preprocessing import PolynomialFeatures
 from sklearn.gaussian_process.kernels import RBF, WhiteKernel
 
 from ..utils.validation import Validation
+from ..utils.score_cache import RSSCache, parent_bitmask
 
 
 class GPRMine(object):
@@ -66,6 +69,64 @@ class GPRMine(object):
         return K
 
 
+class TopKOrderings(object):
+    """
+    Keep the ``k`` orderings with the lowest score seen so far.
+
+    A bounded heap whose root is the worst kept ordering, so a push is
+    O(log k), and the best ordering is tracked separately so that it can be
+    read in O(1).
+
+    Parameters
+    ----------
+    k: int, default: 10
+        number of orderings to keep.
+    """
+
+    def __init__(self, k=10):
+        self.k = k
+        self._heap = []  # (-score, counter, ordering, reward_list)
+        self._keys = set()
+        self._counter = 0
+        self._best = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, ordering, score, reward_list) -> None:
+        """Record the score of ``ordering``, a tuple of node indices."""
+
+        if ordering in self._keys:
+            return
+        if self._best is None or score < self._best[1][0]:
+            self._best = (ordering, (score, reward_list))
+
+        item = (-score, self._counter, ordering, reward_list)
+        self._counter += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            _, _, dropped, _ = heapq.heapreplace(self._heap, item)
+            self._keys.discard(dropped)
+        else:
+            return
+        self._keys.add(ordering)
+
+    @property
+    def best(self) -> tuple:
+        """(ordering, (score, reward_list)) of the best ordering, or None"""
+
+        return self._best
+
+    def items(self) -> list:
+        """Kept orderings sorted by score, best first, in the format
+        [(ordering, (score, reward_list)), ...]"""
+
+        ls = sorted(self._heap, key=lambda x: (-x[0], x[1]))
+        return [(ordering, (-neg_score, reward_list))
+                for neg_score, _, ordering, reward_list in ls]
+
+
 class Reward(object):
     """
     Used for calculate reward for ordering-based Causal discovery
@@ -74,11 +135,34 @@ class Reward(object):
     steps can be the potential parents of the currently selected variable.
     Hence, author design the rewards in the following cases:
     `episodic reward` and `dense reward`.
-    
+
+    Parameters
+    ----------
+    top_k: int, default: 10
+        number of best orderings kept by ``update_all_scores``.
+    max_cache_size: int, default: None
+        maximum number of orderings whose scores are cached in ``self.d``,
+        the least recently used ones are evicted first. None means unbounded.
+    cache_path: str, default: None
+        If not None, per-node RSS values are also stored in this SQLite file
+        and reused by later runs on the same data, see ``RSSCache``.
+    dag_mask: np.ndarray, default: None
+        [n_nodes, n_nodes] mask applied to every scored graph, row ``i``
+        marks the nodes allowed as parents of node ``i``.
+    design: np.ndarray, default: None
+        ``input_data`` with a column of ones appended, [n_samples, n_nodes + 1].
+        Only for 'LR', e.g. a view of shared memory. If None, the columns of
+        each regression are gathered from ``input_data``, which may then be
+        memory-mapped, without building the design matrix.
+    gram: np.ndarray, default: None
+        ``design.T.dot(design)``, only for 'LR', computed here by blocks of
+        rows if None.
     """
 
     def __init__(self, input_data, reward_mode='episodic',
-                 score_type='BIC', regression_type='LR', alpha=1.0):
+                 score_type='BIC', regression_type='LR', alpha=1.0,
+                 top_k=10, max_cache_size=None, cache_path=None,
+                 dag_mask=None, design=None, gram=None):
 
 
         self.input_data = input_data
@@ -86,7 +170,12 @@ class Reward(object):
         self.alpha = alpha
         self.n_samples = input_data.shape[0]
         self.seq_length = input_data.shape[1]
-        self.d = {}  # store results
+        self.d = OrderedDict()  # store results
+        self.dag_mask = None
+        if dag_mask is not None:
+            self.dag_mask = np.float64(np.abs(dag_mask) > 1e-3)
+        self.max_cache_size = max_cache_size
+        self.top_k = TopKOrderings(k=top_k)
         self.d_RSS = [{} for _ in range(self.seq_length)]  # store RSS for reuse
         self.bic_penalty = np.log(input_data.shape[0]) / input_data.shape[0]
 
@@ -98,6 +187,14 @@ class Reward(object):
         self.score_type = score_type
         self.regression_type = regression_type
 
+        self.rss_cache = None
+        if cache_path is not None:
+            self.rss_cache = RSSCache(cache_path, input_data,
+                                      regression_type=regression_type,
+                                      score_type=score_type,
+                                      alpha=alpha)
+            self.d_RSS = self.rss_cache.load(self.seq_length)
+
         self.poly = PolynomialFeatures()
 
         if self.regression_type == 'GPR_learnable':
@@ -107,10 +204,8 @@ class Reward(object):
                                                   noise_level_bounds=(
                                                   1e-10, 1e+1))
         elif regression_type == 'LR':
-            self.ones = np.ones((input_data.shape[0], 1), dtype=np.float32)
-            X = np.hstack((self.input_data, self.ones))
-            self.X = X
-            self.XtX = X.T.dot(X)
+            self.X = design
+            self.XtX = self._design_gram(input_data) if gram is None else gram
         elif regression_type == 'GPR':
             self.gpr = GPRMine()
             m = input_data.shape[0]
@@ -160,6 +255,37 @@ class Reward(object):
 
         return reward_list, normal_batch_reward, max_reward_batch, td_target
 
+    @staticmethod
+    def _design_gram(input_data, chunk_size=65536):
+        """Gram matrix of ``input_data`` with a column of ones appended,
+        accumulated by blocks of rows"""
+
+        n, d = input_data.shape
+        gram = np.zeros((d + 1, d + 1))
+        for start in range(0, n, chunk_size):
+            block = np.asarray(input_data[start:start + chunk_size],
+                               dtype=np.float64)
+            gram[:d, :d] += block.T.dot(block)
+            gram[:d, d] += block.sum(axis=0)
+        gram[d, :d] = gram[:d, d]
+        gram[d, d] = n
+
+        return gram.astype(np.result_type(input_data.dtype, np.float32))
+
+    def _design_columns(self, cols):
+        """Columns ``cols`` of the design matrix, the last one being ones"""
+
+        if self.X is not None:
+            return self.X[:, cols]
+        index = np.flatnonzero(cols[:-1])
+        out = np.empty((self.n_samples, len(index) + int(cols[-1])),
+                       dtype=self.XtX.dtype)
+        out[:, :len(index)] = self.input_data[:, index]
+        if cols[-1]:
+            out[:, -1] = 1
+
+        return out
+
     def calculate_yerr(self, X_train, y_train, XtX=None, Xty=None):
         if self.regression_type == 'LR':
             return self.calculate_LR(X_train, y_train, XtX, Xty)
@@ -210,9 +336,13 @@ class Reward(object):
         if not ture_flag:
             if graph_batch_to_tuple in self.d:
                 graph_score = self.d[graph_batch_to_tuple]
+                if self.max_cache_size is not None:
+                    self.d.move_to_end(graph_batch_to_tuple)
                 reward = graph_score[0]
                 return reward, np.array(graph_score[1])
 
+        if self.dag_mask is not None:
+            graph_batch = graph_batch * self.dag_mask
         RSS_ls = []
         for i in range(self.seq_length):
             RSSi = self.cal_RSSi(i, graph_batch)
@@ -236,14 +366,45 @@ class Reward(object):
                             f"but got ``{self.score_type}``.")
         if not ture_flag:
             self.d[graph_batch_to_tuple] = (BIC, reward_list)
+            if (self.max_cache_size is not None
+                    and len(self.d) > self.max_cache_size):
+                self.d.popitem(last=False)
+            self.top_k.push(graph_batch_to_tuple, BIC, reward_list)
 
         return BIC, np.array(reward_list)
 
+    def incremental_score(self, prefix, node):
+        """
+        Score contribution of appending ``node`` to the partial ordering
+        ``prefix``.
+
+        A node regresses on every node chosen after it, that is on all nodes
+        not in ``prefix + [node]``, so its contribution is fixed as soon as it
+        is chosen. Summing contributions over a full ordering gives a
+        quantity that ranks orderings like ``score_type``.
+        """
+
+        col = np.ones(self.seq_length)
+        col[list(prefix)] = 0
+        col[node] = 0
+        if self.dag_mask is not None:
+            col = col * self.dag_mask[node]
+        RSSi = self.cal_RSS_parents(node, col)
+        if self.score_type == 'BIC_different_var':
+            return np.log(RSSi / self.n_samples + 1e-8)
+
+        return RSSi
+
     def cal_RSSi(self, i, graph_batch):
-        col = graph_batch[i]
-        str_col = str(col)
-        if str_col in self.d_RSS[i]:
-            RSSi = self.d_RSS[i][str_col]
+
+        return self.cal_RSS_parents(i, graph_batch[i])
+
+    def cal_RSS_parents(self, i, col):
+        """RSS of node ``i`` regressed on the nodes marked in ``col``"""
+
+        parents = parent_bitmask(col)
+        if parents in self.d_RSS[i]:
+            RSSi = self.d_RSS[i][parents]
             return RSSi
         if np.sum(col) < 0.1:
             y_err = self.input_data[:, i]
@@ -252,8 +413,8 @@ class Reward(object):
             cols_TrueFalse = col > 0.5
             if self.regression_type == 'LR':
                 cols_TrueFalse = np.append(cols_TrueFalse, True)
-                X_train = self.X[:, cols_TrueFalse]
-                y_train = self.X[:, i]
+                X_train = self._design_columns(cols_TrueFalse)
+                y_train = self.input_data[:, i]
                 XtX = self.XtX[:, cols_TrueFalse][cols_TrueFalse, :]
                 Xty = self.XtX[:, i][cols_TrueFalse]
                 y_err = self.calculate_yerr(X_train, y_train, XtX, Xty)
@@ -281,10 +442,18 @@ class Reward(object):
                                 f"[`LR`, `GPR`, `GPR_learnable`], "
                                 f"but got ``{self.regression_type}``.")
         RSSi = np.sum(np.square(y_err))
-        self.d_RSS[i][str_col] = RSSi
+        self.d_RSS[i][parents] = RSSi
+        if self.rss_cache is not None:
+            self.rss_cache.put(i, parents, RSSi)
 
         return RSSi
 
+    def close(self):
+        """Write pending values to the persistent RSS cache, if any."""
+
+        if self.rss_cache is not None:
+            self.rss_cache.close()
+
     def penalized_score(self, score_cyc, lambda1=1, lambda2=1):
         score, cyc = score_cyc
         return score + lambda1 * float(cyc > 1e-5) + lambda2 * cyc
@@ -296,9 +465,12 @@ class Reward(object):
         return ls
 
     def update_all_scores(self):
-        score_cycs = list(self.d.items())
-        ls = []
-        for graph_int, score_l in score_cycs:
-            ls.append((graph_int, (score_l[0], score_l[-1])))
-        return sorted(ls, key=lambda x: x[1][0])
+        """Best ``top_k`` orderings sorted by score, best first"""
+
+        return self.top_k.items()
+
+    def best_ordering(self):
+        """(ordering, (score, reward_list)) of the best ordering so far"""
+
+        return self.top_k.best
 
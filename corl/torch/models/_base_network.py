@@ -14,10 +14,17 @@
 # limitations under the License.
 
 
+import inspect
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions.categorical import Categorical
+from torch.utils.checkpoint import checkpoint
+
+# non-reentrant checkpointing where supported (torch >= 1.11)
+_CHECKPOINT_KWARGS = {}
+if 'use_reentrant' in inspect.signature(checkpoint).parameters:
+    _CHECKPOINT_KWARGS['use_reentrant'] = False
 
 tl = lambda x: torch.LongTensor(x)
 
@@ -75,6 +82,11 @@ class BaseDecoder(nn.Module):
 class PointerDecoder(BaseDecoder):
     """Base Class for all Decoder"""
 
+    # upper bound of elements of the [batch, steps, seq_length, hidden]
+    # intermediate built per chunk in ``log_softmax``, chunks are
+    # recomputed in the backward pass instead of being kept alive
+    LOG_SOFTMAX_CHUNK_ELEMENTS = 2 ** 24
+
     def __init__(self, input_dim, hidden_dim, device=None) -> None:
         super(PointerDecoder, self).__init__(input_dim=input_dim,
                                              hidden_dim=hidden_dim,
@@ -84,6 +96,8 @@ class PointerDecoder(BaseDecoder):
         self.positions = []  # store visited cities for reward
         self.mask = torch.zeros(1, device=self.device)
         self.mask_scores = []
+        self.encoder_ref = None  # cached projections of encoder_output
+        self.decode_mode = 'sample'  # or 'greedy', see ``step_decode``
         # Attention mechanism -- glimpse  _encoder_glimpse
         self.conv1d_ref_g = nn.Conv1d(in_channels=input_dim,
                                  out_channels=hidden_dim,
@@ -140,15 +154,19 @@ class PointerDecoder(BaseDecoder):
                             f'``{self.__class__.__name__}``.')
 
         # [batch_size, time_sequence] 
-        masked_scores = self.pointer_net(self.encoder_output, output)
+        masked_scores = self.pointer_net(self.encoder_output, output,
+                                         ref_projection=self.encoder_ref)
         #   self.models(s)
 
         
         # Multinomial distribution
         prob = Categorical(logits=masked_scores) # masked_score就是gflownet里面self.models(s)
 
-        # Sample from distribution
-        action = prob.sample().long()
+        # Sample from distribution, or take the most likely node
+        if self.decode_mode == 'greedy':
+            action = torch.argmax(masked_scores, dim=-1)
+        else:
+            action = prob.sample().long()
         # print('action',action)
         # print('output',output)
         parents_Qsa = masked_scores[torch.arange(output.shape[0]), action]
@@ -159,8 +177,7 @@ class PointerDecoder(BaseDecoder):
         self.mask = self.mask + F.one_hot(action, self.seq_length)
 
         # Retrieve decoder's new input
-        action_index = action.reshape(-1, 1, 1).repeat(1, 1, self.hidden_dim)
-        next_input = torch.gather(self.encoder_output, 0, action_index)[:, 0, :]
+        next_input = self._next_input(action)
 
         in_flow = torch.log(torch.zeros((next_input.shape[0],))
                             .index_add_(0, batch_idxs, torch.exp(parents_Qsa)))
@@ -168,40 +185,157 @@ class PointerDecoder(BaseDecoder):
 
         next_q = self.mlp(next_input).squeeze()
 
-        next_masked_scores = self.pointer_net(self.encoder_output, next_q)
+        next_masked_scores = self.pointer_net(self.encoder_output, next_q,
+                                              ref_projection=self.encoder_ref)
         # print('next_q',next_masked_scores)   
 
         return next_input, state, action, masked_scores,in_flow,next_masked_scores
 
-    def pointer_net(self, ref, query) -> torch.Tensor:
+    def _next_input(self, action) -> torch.Tensor:
+        """Decoder input of the next step after choosing ``action``"""
+
+        action_index = action.reshape(-1, 1, 1).repeat(1, 1, self.hidden_dim)
+        return torch.gather(self.encoder_output, 0, action_index)[:, 0, :]
+
+    @torch.no_grad()
+    def beam_search(self, x, score_fn, beam_width=4, sample_index=0) -> list:
+        """
+        Beam search over orderings for one sample of the batch.
+
+        At every step each beam is extended by its ``beam_width`` most likely
+        nodes under the pointer network, the extensions are ranked by the
+        accumulated cost of ``score_fn`` (ties broken by log-likelihood) and
+        the ``beam_width`` best ones are kept.
+
+        Parameters
+        ----------
+        x: torch.Tensor
+            Encoder's output, [batch_size, seq_length, hidden_dim]
+        score_fn: callable
+            ``score_fn(prefix, node)`` returns the cost of appending ``node``
+            to the partial ordering ``prefix``, lower is better, e.g.
+            ``Reward.incremental_score``.
+        beam_width: int, default: 4
+            number of kept partial orderings.
+        sample_index: int, default: 0
+            index of the sample in ``x`` to decode.
+
+        Returns
+        -------
+        out: list
+            the best ordering.
+        """
+
+        self.batch_size = x.shape[0]
+        self.seq_length = x.shape[1]
+        self.encoder_output = x
+        self.encoder_ref = self.project_reference(x)
+        ref = x[sample_index:sample_index + 1]
+        ref_projection = tuple(each[sample_index:sample_index + 1]
+                               for each in self.encoder_ref)
+
+        # (cost, -log_prob, ordering) of every beam
+        beams = [(0.0, 0.0, [])]
+        s_i = torch.mean(ref, 1)
+        state = None
+        if self.__class__.__name__ == 'LSTMDecoder':
+            state = (torch.zeros_like(s_i), torch.zeros_like(s_i))
+        for _ in range(self.seq_length):
+            n_beams = len(beams)
+            if state is not None:
+                h, c = self.lstm_cell(s_i, state)
+                output, state = h, (h, c)
+            else:
+                output = self.mlp(s_i)
+            self.mask = torch.zeros((n_beams, self.seq_length), device=x.device)
+            for k, (_, _, ordering) in enumerate(beams):
+                self.mask[k, ordering] = 1
+            masked_scores = self.pointer_net(
+                ref.expand(n_beams, -1, -1), output,
+                ref_projection=tuple(each.expand(n_beams, -1, -1)
+                                     for each in ref_projection)
+            )
+            log_prob = F.log_softmax(masked_scores, dim=-1)
+            n_candidates = min(beam_width, self.seq_length - len(beams[0][2]))
+            top_log_prob, top_node = torch.topk(log_prob, n_candidates, dim=-1)
+
+            candidates = []
+            for k, (cost, neg_log_prob, ordering) in enumerate(beams):
+                for lp, node in zip(top_log_prob[k].tolist(),
+                                    top_node[k].tolist()):
+                    candidates.append((cost + score_fn(ordering, node),
+                                       neg_log_prob - lp, ordering + [node], k))
+            candidates = sorted(candidates, key=lambda x: x[:2])[:beam_width]
+
+            beams = [candidate[:3] for candidate in candidates]
+            parents = torch.tensor([candidate[3] for candidate in candidates],
+                                   device=x.device)
+            actions = torch.tensor([candidate[2][-1] for candidate in candidates],
+                                   device=x.device)
+            s_i = ref[0, actions]
+            if state is not None:
+                state = (state[0][parents], state[1][parents])
+        self.mask = torch.zeros(1, device=self.device)
+
+        return beams[0][2]
+
+    def project_reference(self, ref) -> tuple:
+        """Project encoder states for the glimpse and pointer mechanisms.
+
+        The encoder output does not change during one decode, so the
+        projections are computed once in ``forward`` and reused at every
+        step, see ``pointer_net``.
+
+        Parameters
+        ----------
+        ref: torch.Tensor
+            encoder_states, [batch_size, seq_length, input_dim]
+
+        Returns
+        -------
+        out: tuple
+            (encoder_ref_g, encoder_ref_p), each one is
+            [batch_size, seq_length, hidden_dim]
+        """
+
+        ref_t = ref.permute(0, 2, 1)
+        encoder_ref_g = self.conv1d_ref_g(ref_t).permute(0, 2, 1)
+        encoder_ref_p = self.conv1d_ref_p(ref_t).permute(0, 2, 1)
+
+        return encoder_ref_g, encoder_ref_p
+
+    def pointer_net(self, ref, query, ref_projection=None) -> torch.Tensor:
         """Attention mechanism + Pointer mechanism
 
         Parameters
         ----------
         ref: torch.Tensor
-            encoder_states
+            encoder_states, [batch_size, seq_length, input_dim], or
+            [batch_size, 1, seq_length, input_dim] when ``query`` holds
+            several steps per sample.
         query: torch.Tensor
-            decoder_states
+            decoder_states, [batch_size, hidden_dim] or
+            [batch_size, n_steps, hidden_dim]
+        ref_projection: tuple, default: None
+            output of ``project_reference(ref)``, computed here if None.
         """
 
+        if ref_projection is None:
+            ref_projection = self.project_reference(ref)
+        encoder_ref_g, encoder_ref_p = ref_projection
+
         # Attention mechanism
-        encoder_ref_g = self.conv1d_ref_g(
-            ref.permute(0, 2, 1)
-        ).permute(0, 2, 1)
-        encoder_query_g = self.w_q_g(query).unsqueeze(1)
+        encoder_query_g = self.w_q_g(query).unsqueeze(-2)
         scores_g = torch.mean(
             self.v_g(torch.tanh(encoder_ref_g + encoder_query_g)), dim=-1
         )
         attention_g = F.softmax(scores_g - self.mask * 1e9, dim=-1)
 
-        glimpse = torch.mul(ref, attention_g.unsqueeze(2))
-        glimpse = torch.sum(glimpse, dim=1) + query
+        glimpse = torch.matmul(attention_g.unsqueeze(-2), ref).squeeze(-2)
+        glimpse = glimpse + query
 
         # Pointer mechanism
-        encoder_ref_p = self.conv1d_ref_p(
-            ref.permute(0, 2, 1)
-        ).permute(0, 2, 1)
-        encoder_query_p = self.w_q_p(glimpse).unsqueeze(1)
+        encoder_query_p = self.w_q_p(glimpse).unsqueeze(-2)
         scores_p = torch.mean(
             self.v_p(torch.tanh(encoder_ref_p + encoder_query_p)), dim=-1
         )
@@ -212,6 +346,27 @@ class PointerDecoder(BaseDecoder):
         return masked_scores
 
     def log_softmax(self, input, position, mask, state_0, state_1) -> torch.Tensor:
+        """Replay the pointer network over all decode steps at once.
+
+        Every sample is scored against its own encoder output by
+        broadcasting, steps are processed in chunks so that peak memory stays
+        O(batch_size * seq_length * hidden_dim) instead of expanding
+        ``encoder_output`` to one copy per step. When gradients are needed
+        and there are several chunks, each chunk is checkpointed: only its
+        scores are kept for the backward pass, which recomputes the
+        [batch_size, chunk, seq_length, hidden_dim] intermediates.
+
+        Parameters
+        ----------
+        input: torch.Tensor
+            decoder inputs of all steps, [batch_size * seq_length, hidden_dim]
+        position: torch.Tensor
+            actions, [batch_size, seq_length]
+        mask: array_like
+            visited mask of all steps, [batch_size * seq_length, seq_length]
+        state_0, state_1: torch.Tensor
+            (h, c) of all steps for LSTMDecoder
+        """
 
         if self.__class__.__name__ == 'LSTMDecoder':
             state = state_0, state_1
@@ -223,16 +378,46 @@ class PointerDecoder(BaseDecoder):
             raise TypeError(f'Supported subclass of PointerDecoder is one of '
                             f'[`LSTMDecoder`, `MLPDecoder`], but got'
                             f'``{self.__class__.__name__}``.')
-        self.mask = torch.tensor(mask, dtype=torch.float32, device=self.device)
-
-        # encoder_output_expand
-        encoder_output_ex = self.encoder_output.unsqueeze(1)
-        encoder_output_ex = encoder_output_ex.repeat(1, self.seq_length, 1, 1)
-        encoder_output_ex = encoder_output_ex.reshape(-1, self.seq_length, self.hidden_dim)
-        masked_scores = self.pointer_net(encoder_output_ex, output)
+        batch_size = self.encoder_output.shape[0]
+        output = output.reshape(batch_size, self.seq_length, -1)
+        mask = torch.as_tensor(mask, dtype=torch.float32, device=output.device)
+        mask = mask.reshape(batch_size, self.seq_length, self.seq_length)
+
+        if self.encoder_ref is None:
+            self.encoder_ref = self.project_reference(self.encoder_output)
+        ref = self.encoder_output.unsqueeze(1)
+        ref_projection = tuple(each.unsqueeze(1) for each in self.encoder_ref)
+
+        step_elements = batch_size * self.seq_length * self.hidden_dim
+        chunk = max(1, self.LOG_SOFTMAX_CHUNK_ELEMENTS // step_elements)
+        recompute = torch.is_grad_enabled() and chunk < self.seq_length
+        masked_scores = []
+        for start in range(0, self.seq_length, chunk):
+            args = (ref, output[:, start:start + chunk],
+                    mask[:, start:start + chunk]) + ref_projection
+            if recompute:
+                masked_scores.append(checkpoint(self._chunk_scores, *args,
+                                                **_CHECKPOINT_KWARGS))
+            else:
+                masked_scores.append(self._chunk_scores(*args))
+        masked_scores = torch.cat(masked_scores, dim=1)
+        masked_scores = masked_scores.reshape(-1, self.seq_length)
 
         prob = Categorical(logits=masked_scores)
         log_softmax = prob.log_prob(position.reshape(-1,))
         self.mask = torch.zeros(1, device=self.device)
 
         return log_softmax
+
+    def _chunk_scores(self, ref, query, mask, encoder_ref_g,
+                      encoder_ref_p) -> torch.Tensor:
+        """``pointer_net`` under ``mask``, the mask is an argument so that
+        a checkpointed chunk is recomputed with its own mask"""
+
+        previous_mask, self.mask = self.mask, mask
+        try:
+            return self.pointer_net(ref, query,
+                                    ref_projection=(encoder_ref_g,
+                                                    encoder_ref_p))
+        finally:
+            self.mask = previous_mask
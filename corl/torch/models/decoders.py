@@ -39,7 +39,8 @@ class LSTMDecoder(PointerDecoder):
         """"""
         self.batch_size = x.shape[0]
         self.seq_length = x.shape[1] # 10 
-        self.encoder_output = x  
+        self.encoder_output = x
+        self.encoder_ref = self.project_reference(x)
 
         s_i = torch.mean(x, 1)
         hi_ci = (torch.zeros((self.batch_size, self.hidden_dim), device=s_i.device),
@@ -94,6 +95,7 @@ class MLPDecoder(PointerDecoder):
         self.batch_size = x.shape[0]
         self.seq_length = x.shape[1]
         self.encoder_output = x
+        self.encoder_ref = self.project_reference(x)
 
         s_i = torch.mean(x, 1) # s_0
 
@@ -169,43 +169,33 @@ class MultiHeadAttention(nn.Module):
         self.bn = nn.BatchNorm1d(num_features=output_dim, device=device)
 
     def forward(self, x) -> torch.Tensor:
+        batch_size, seq_length, _ = x.shape
         Q = self.w_q(x)  # [batch_size, seq_length, n_hidden]
         K = self.w_k(x)
         V = self.w_v(x)
 
-        # Split and concat
-        Q_ = torch.cat(torch.split(Q,
-                                   split_size_or_sections=Q.shape[2]//self.heads,
-                                   dim=2),
-                       dim=0)
-        K_ = torch.cat(torch.split(K,
-                                   split_size_or_sections=K.shape[2]//self.heads,
-                                   dim=2),
-                       dim=0)
-        V_ = torch.cat(torch.split(V,
-                                   split_size_or_sections=V.shape[2]//self.heads,
-                                   dim=2),
-                       dim=0)
-        # Multiplication # [num_heads*batch_size, seq_length, seq_length]
-        output = torch.matmul(Q_, K_.permute(0, 2, 1))
+        # Split heads # [batch_size, num_heads, seq_length, n_hidden/num_heads]
+        Q_ = Q.view(batch_size, seq_length, self.heads, -1).transpose(1, 2)
+        K_ = K.view(batch_size, seq_length, self.heads, -1).transpose(1, 2)
+        V_ = V.view(batch_size, seq_length, self.heads, -1).transpose(1, 2)
+
+        # Multiplication # [batch_size, num_heads, seq_length, seq_length]
+        output = torch.matmul(Q_, K_.transpose(2, 3))
 
         # Scale
         output = output / (K_.shape[-1] ** 0.5)
 
-        # Activation  # [num_heads*batch_size, seq_length, seq_length]
-        output = F.softmax(output, dim=1)
+        # Activation, normalized over the query axis
+        output = F.softmax(output, dim=2)
 
         # Dropouts
         output = F.dropout(output, p=self.dropout_rate)
 
-        # Weighted sum # [num_heads*batch_size, seq_length, n_hidden/num_heads]
+        # Weighted sum # [batch_size, num_heads, seq_length, n_hidden/num_heads]
         output = torch.matmul(output, V_)
 
-        # Restore shape
-        output = torch.cat(torch.split(output,
-                                       split_size_or_sections=output.shape[0]//self.heads,
-                                       dim=0),
-                           dim=2)  # [batch_size, seq_length, n_hidden]
+        # Restore shape # [batch_size, seq_length, n_hidden]
+        output = output.transpose(1, 2).reshape(batch_size, seq_length, -1)
         # Residual connection
         output += x  # [batch_size, seq_length, n_hidden]
         output = self.bn(output.permute(0, 2, 1)).permute(0, 2, 1)
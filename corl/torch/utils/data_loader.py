@@ -14,42 +14,161 @@
 # limitations under the License.
 
 
+import queue
+import threading
 import numpy as np
 import torch
 import torch.nn.functional as F
 
+from castle.datasets.storage import open_dataset
+
 
 class DataGenerator(object):
     """Training dataset generator
 
     Parameters
     ----------
-    dataset: array_like
-        A 2-dimension np.ndarray
+    dataset: array_like or str
+        A 2-dimension np.ndarray, or a ``.npy`` file or simulation directory
+        written with ``output_dir``. Files and ``np.memmap`` datasets on CPU
+        are used in place, memory-mapped, without being read into memory
+        (except with ``normalize``).
     normalize: bool, default: False
         Whether normalization ``dataset``
     device: option, default: None
         torch.device('cpu') or torch.device('cuda')
+    pin_memory: bool, default: False
+        If True, ``dataset`` is kept in host memory and each batch is gathered
+        into page-locked memory before being copied to ``device``
+        asynchronously. Only useful when ``device`` is a CUDA device.
+    prefetch: bool, default: False
+        If True, a background thread draws the next batch while the current
+        one is being consumed. Indices are then drawn from a private
+        ``np.random.RandomState`` seeded from the global numpy random state,
+        so results stay reproducible under ``np.random.seed``.
     """
 
-    def __init__(self, dataset, normalize=False, device=None) -> None :
+    def __init__(self, dataset, normalize=False, device=None,
+                 pin_memory=False, prefetch=False) -> None :
 
+        if isinstance(dataset, str):
+            # copy-on-write, so that torch can share it, the file is never written
+            dataset = open_dataset(dataset, mmap_mode='c')
+        elif isinstance(dataset, np.memmap) and not dataset.flags.writeable:
+            dataset = np.memmap(dataset.filename, dtype=dataset.dtype, mode='c',
+                                offset=dataset.offset, shape=dataset.shape,
+                                order='F' if dataset.flags.f_contiguous
+                                and not dataset.flags.c_contiguous else 'C')
         self.dataset = dataset
         self.normalize = normalize
         self.device = device
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
         self.data_size, self.n_nodes = self.dataset.shape
-        self.dataset = torch.tensor(self.dataset,
-                                    requires_grad=True,
-                                    device=self.device)
+        # the dataset is only ever indexed, never differentiated
+        storage_device = 'cpu' if self.pin_memory else self.device
+        self.dataset = torch.as_tensor(np.asarray(self.dataset),
+                                       device=storage_device)
         if self.normalize:
             self.dataset = F.normalize(self.dataset)
 
-    def _draw_single_sample(self, dimension) -> torch.Tensor :
+        if self.prefetch:
+            self._random_state = np.random.RandomState(
+                np.random.randint(np.iinfo(np.int32).max)
+            )
+        else:
+            self._random_state = np.random
+        self._queue = None
+        self._thread = None
+        self._stop_event = None
+        self._prefetch_shape = None
+        # generator state after the last batch handed out
+        self._state = None
+
+    def _gather(self, batch_size, dimension) -> torch.Tensor :
+        """Draw all indices at once and gather them with a single kernel."""
+
+        index = self._random_state.randint(0, self.data_size,
+                                           size=batch_size * dimension)
+        index = torch.from_numpy(index).to(self.dataset.device)
+        out = torch.empty((batch_size * dimension, self.n_nodes),
+                          dtype=self.dataset.dtype,
+                          device=self.dataset.device,
+                          pin_memory=self.pin_memory)
+        torch.index_select(self.dataset, 0, index, out=out)
+        if self.pin_memory:
+            out = out.to(self.device, non_blocking=True)
+
+        # [batch_size, n_nodes, dimension]
+        return out.view(batch_size, dimension, self.n_nodes).permute(0, 2, 1)
+
+    def _prefetch_worker(self, batch_size, dimension, batches, stop_event):
 
-        index = np.random.randint(0, self.data_size, size=dimension)
-        single_sample = self.dataset[index] # [dimension, n_nodes]
+        while not stop_event.is_set():
+            try:
+                item = (self._gather(batch_size, dimension),
+                        self._random_state.get_state())
+            except Exception as error:
+                item = (error, None)
+            while not stop_event.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(item[0], Exception):
+                return
 
-        return single_sample.T # [n_nodes, dimension]
+    def _start_prefetch(self, batch_size, dimension):
+
+        self.close()
+        self._queue = queue.Queue(maxsize=1)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch_worker,
+                                        args=(batch_size, dimension,
+                                              self._queue, self._stop_event),
+                                        daemon=True)
+        self._prefetch_shape = (batch_size, dimension)
+        self._state = self._random_state.get_state()
+        self._thread.start()
+
+    def state_dict(self) -> dict :
+        """
+        State of the private random generator used with ``prefetch``, as
+        after the last batch returned by ``draw_batch``: the batches already
+        prefetched are not part of it.
+        """
+
+        if not self.prefetch:
+            return {}
+        if self._thread is not None:
+            return {'random_state': self._state}
+        return {'random_state': self._random_state.get_state()}
+
+    def load_state_dict(self, state_dict) -> None :
+
+        if self.prefetch and 'random_state' in state_dict:
+            # batches prefetched from the old state are dropped
+            self.close()
+            self._random_state.set_state(state_dict['random_state'])
+            self._state = None
+
+    def close(self) -> None :
+        """
+        Stop the prefetch thread, if any, and rewind the random generator
+        to the state after the last batch handed out.
+        """
+
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            if self._state is not None:
+                self._random_state.set_state(self._state)
+        self._state = None
+        self._queue = None
+        self._thread = None
+        self._stop_event = None
+        self._prefetch_shape = None
 
     def draw_batch(self, batch_size, dimension) -> torch.Tensor :
         """Draw batch sample
@@ -60,12 +179,22 @@ class DataGenerator(object):
             Draw ``batch_size`` single_samples
         dimension: int
             Draw ``dimension`` samples to represent node features
+
+        Returns
+        -------
+        out: torch.Tensor
+            shape = (batch_size, n_nodes, dimension)
         """
 
-        batch = []
-        for _ in range(batch_size):
-            single_sample = self._draw_single_sample(dimension=dimension)
-            batch.append(single_sample)
+        if not self.prefetch:
+            return self._gather(batch_size, dimension)
 
-        return torch.stack(batch)
+        if self._prefetch_shape != (batch_size, dimension):
+            self._start_prefetch(batch_size, dimension)
+        batch, state = self._queue.get()
+        if isinstance(batch, Exception):
+            self.close()
+            raise batch
+        self._state = state
 
+        return batch
@@ -15,8 +15,8 @@
 
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
+import torch
+from scipy.linalg import solve_triangular
 
 
 def get_graph_from_order(sequence, dag_mask=None) -> np.ndarray:
@@ -67,6 +67,111 @@ def get_graph_from_order(sequence, dag_mask=None) -> np.ndarray:
     return init_graph
 
 
+def get_graphs_from_orders(orders, dag_mask=None) -> tuple:
+    """
+    Batched version of ``get_graph_from_order``, which also returns the
+    visited-node mask of every decoding step.
+
+    Node ``i`` is a potential parent of node ``j`` iff it comes earlier in
+    the ordering, i.e. ``rank[i] < rank[j]``, and node ``j`` is visited
+    before step ``t`` iff ``rank[j] < t``. Everything is computed with
+    tensor ops on the device of ``orders``.
+
+    Parameters
+    ----------
+    orders: torch.Tensor
+        shape = [batch_size, n_nodes], each row is a permutation of nodes.
+    dag_mask : ndarray or torch.Tensor, default: None
+        two-dimensional array with [0, 1], shape = [n_nodes, n_nodes].
+        (i, j) indicated element `0` denotes there must be no edge
+        between nodes `i` and `j` , the element `1` indicates that
+        there may or may not be an edge.
+
+    Returns
+    -------
+    out: tuple
+        graphs: torch.Tensor
+            shape = [batch_size, n_nodes, n_nodes], graphs[b] equals
+            ``get_graph_from_order(orders[b], dag_mask)``.
+        action_masks: torch.Tensor
+            shape = [batch_size, n_nodes, n_nodes], action_masks[b, t] marks
+            the nodes chosen before step ``t``.
+
+    Examples
+    --------
+    >>> orders = torch.tensor([[2, 0, 1, 3]])
+    >>> graphs, masks = get_graphs_from_orders(orders)
+    >>> print(graphs[0])
+    tensor([[0., 1., 0., 1.],
+            [0., 0., 0., 1.],
+            [1., 1., 0., 1.],
+            [0., 0., 0., 0.]], dtype=torch.float64)
+    """
+
+    orders = torch.as_tensor(orders).long()
+    batch_size, num_node = orders.shape
+    steps = torch.arange(num_node, device=orders.device)
+    rank = torch.empty_like(orders)
+    rank.scatter_(1, orders, steps.expand(batch_size, num_node))
+
+    graphs = (rank.unsqueeze(2) < rank.unsqueeze(1)).double()
+    if dag_mask is not None:
+        dag_mask = torch.as_tensor(dag_mask, device=orders.device)
+        graphs = graphs * (torch.abs(dag_mask) > 1e-3).double()
+    action_masks = (rank.unsqueeze(1) < steps.view(1, -1, 1)).double()
+
+    return graphs, action_masks
+
+
+def screen_candidate_parents(X, max_parents, method='partial_corr') -> np.ndarray:
+    """
+    Build a sparse candidate-parent mask by correlation screening.
+
+    For every node keep the ``max_parents`` other nodes with the largest
+    absolute (partial) correlation, so that each regression of the scorer
+    uses at most ``max_parents`` predictors.
+
+    Parameters
+    ----------
+    X: np.ndarray
+        [n, d] data.
+    max_parents: int
+        maximum number of candidate parents of each node.
+    method: str, default: 'partial_corr'
+        'corr' for marginal correlation, 'partial_corr' for partial
+        correlation given all other nodes.
+
+    Returns
+    -------
+    out: np.ndarray
+        [d, d] mask in the format of ``dag_mask``, row ``i`` marks the
+        candidate parents of node ``i``.
+    """
+
+    d = X.shape[1]
+    corr = np.corrcoef(X, rowvar=False)
+    if method == 'partial_corr':
+        precision = np.linalg.pinv(corr, hermitian=True)
+        diag = np.sqrt(np.abs(np.diag(precision)))
+        strength = np.abs(precision / np.outer(diag, diag))
+    elif method == 'corr':
+        strength = np.abs(corr)
+    else:
+        raise ValueError(f"method must be one of ['corr', 'partial_corr'], "
+                         f"but got ``{method}``.")
+    np.fill_diagonal(strength, -np.inf)
+
+    mask = np.zeros((d, d))
+    if max_parents >= d - 1:
+        mask[:] = 1
+    elif max_parents > 0:
+        top = np.argpartition(-strength, max_parents - 1, axis=1)[:, :max_parents]
+        mask[np.arange(d)[:, None], top] = 1
+    np.fill_diagonal(mask, 0)
+
+    return mask
+
+
 def cover_rate(graph, graph_true) -> np.ndarray:
 
     error = graph - graph_true
@@ -74,40 +179,118 @@ def cover_rate(graph, graph_true) -> np.ndarray:
     return np.sum(np.float32(error > -0.1))
 
 
-def pruning_by_coef(graph_batch, X, thresh=0.3) -> np.ndarray:
+def _centered_gram(X) -> np.ndarray:
+    """Gram matrix of the column-centered data, regressions on it are
+    equivalent to ordinary least squares with an intercept."""
+
+    Xc = X - np.mean(X, axis=0)
+
+    return Xc.T.dot(Xc)
+
+
+def _solve_systems(A, b) -> np.ndarray:
+    """Solve a stack of symmetric systems ``A x = b``, fall back to the
+    minimum-norm least squares solution when some of them are singular."""
+
+    try:
+        return np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.matmul(np.linalg.pinv(A, hermitian=True), b[..., None])[..., 0]
+
+
+def _nested_order(parents) -> np.ndarray:
+    """Return the ordering if every parent set is the set of all preceding
+    nodes, e.g. the graph of ``get_graph_from_order`` without ``dag_mask``,
+    otherwise None."""
+
+    d = len(parents)
+    order = np.argsort(np.sum(parents, axis=1), kind='stable')
+    if np.array_equal(parents[np.ix_(order, order)],
+                      np.tril(np.ones((d, d), dtype=bool), k=-1)):
+        return order
+
+    return None
+
+
+def _linear_coef(parents, gram) -> np.ndarray:
     """
-    for a given graph, pruning the edge according to edge weights;
-    linear regression for each causal regression for edge weights and
-    then thresholding
+    Least squares coefficients of every node on its parents.
+
+    Parameters
+    ----------
+    parents: np.ndarray
+        [d, d] boolean, parents[i, j] means j is a parent of i.
+    gram: np.ndarray
+        [d, d] centered Gram matrix of data.
+
+    Returns
+    -------
+    W: np.ndarray
+        [d, d], W[i, j] is the coefficient of parent j for node i.
     """
 
-    n, d = X.shape
-    reg = LinearRegression()
-    W = []
+    d = len(parents)
+    W = np.zeros((d, d))
+    order = _nested_order(parents)
+    if order is not None:
+        # nested parent sets: with G = L L^T, row k of L^{-1} holds the
+        # residual of the k-th node on all previous ones.
+        try:
+            L = np.linalg.cholesky(gram[np.ix_(order, order)])
+        except np.linalg.LinAlgError:
+            pass
+        else:
+            T = solve_triangular(L, np.eye(d), lower=True)
+            coef = - T / np.diag(T)[:, None]
+            np.fill_diagonal(coef, 0.0)
+            W[np.ix_(order, order)] = coef
+            return W
+
+    n_parents = np.sum(parents, axis=1)
+    for k in np.unique(n_parents[n_parents > 0]):
+        nodes = np.flatnonzero(n_parents == k)
+        pa = np.nonzero(parents[nodes])[1].reshape(-1, k)
+        A = gram[pa[:, :, None], pa[:, None, :]]
+        b = gram[pa, nodes[:, None]]
+        W[nodes[:, None], pa] = _solve_systems(A, b)
+
+    return W
+
+
+def _quadratic_features(X) -> tuple:
+    """
+    Degree-2 polynomial expansion of ``X`` without the bias column.
 
-    loss = 0
+    Returns
+    -------
+    out: tuple
+        features: [n, k + k * (k + 1) / 2] linear, squared and cross terms.
+        first, second: column of ``X`` each feature is built from, a linear
+        feature has ``first == second``.
+    """
 
-    for i in range(d):
-        col = np.abs(graph_batch[i]) > 0.1
-        if np.sum(col) <= 0.1:
-            W.append(np.zeros(d))
-            continue
+    k = X.shape[1]
+    rows, cols = np.triu_indices(k)
+    features = np.hstack((X, X[:, rows] * X[:, cols]))
+    first = np.concatenate((np.arange(k), rows))
+    second = np.concatenate((np.arange(k), cols))
 
-        X_train = X[:, col]
+    return features, first, second
 
-        y = X[:, i]
-        reg.fit(X_train, y)
-        loss += 0.5 / n * np.sum(np.square(reg.predict(X_train) - y))
-        reg_coeff = reg.coef_
 
-        cj = 0
-        new_reg_coeff = np.zeros(d, )
-        for ci in range(d):
-            if col[ci]:
-                new_reg_coeff[ci] = reg_coeff[cj]
-                cj += 1
+def pruning_by_coef(graph_batch, X, thresh=0.3) -> np.ndarray:
+    """
+    for a given graph, pruning the edge according to edge weights;
+    linear regression for each causal regression for edge weights and
+    then thresholding
+
+    All regressions are solved from one centered Gram matrix, in a single
+    Cholesky factorization when the parent sets are nested (a graph built
+    from an ordering), otherwise in batched solves grouped by parent number.
+    """
 
-        W.append(new_reg_coeff)
+    parents = np.abs(graph_batch) > 0.1
+    W = _linear_coef(parents, _centered_gram(X))
 
     return np.float32(np.abs(W) > thresh)
 
@@ -117,40 +300,25 @@ def pruning_by_coef_2nd(graph_batch, X, thresh=0.3) -> np.ndarray:
     for a given graph, pruning the edge according to edge weights;
     quadratic regression for each causal regression for edge weights and then
     thresholding
+
+    A parent is kept if any linear, squared or cross term it takes part in
+    has a coefficient larger than ``thresh``.
     """
 
     d = len(graph_batch)
-    reg = LinearRegression()
-    poly = PolynomialFeatures()
-    W = []
+    W = np.zeros((d, d))
 
     for i in range(d):
-        col = graph_batch[i] > 0.1
-        if np.sum(col) <= 0.1:
-            W.append(np.zeros(d))
+        col = np.flatnonzero(graph_batch[i] > 0.1)
+        if len(col) == 0:
             continue
 
-        X_train = X[:, col]
-        X_train_expand = poly.fit_transform(X_train)[:, 1:]
-        X_train_expand_names = poly.get_feature_names()[1:]
-
-        y = X[:, i]
-        reg.fit(X_train_expand, y)
-        reg_coeff = reg.coef_
-
-        cj = 0
-        new_reg_coeff = np.zeros(d, )
-
-        for ci in range(d):
-            if col[ci]:
-                xxi = 'x{}'.format(cj)
-                for iii, xxx in enumerate(X_train_expand_names):
-                    if xxi in xxx:
-                        if np.abs(reg_coeff[iii]) > thresh:
-                            new_reg_coeff[ci] = 1.0
-                            break
-                cj += 1
-        W.append(new_reg_coeff)
+        features, first, second = _quadratic_features(X[:, col])
+        gram = _centered_gram(np.hstack((features, X[:, [i]])))
+        reg_coeff = _solve_systems(gram[:-1, :-1], gram[:-1, -1])
 
-    return np.array(W)
+        large = np.abs(reg_coeff) > thresh
+        W[i, col[first[large]]] = 1.0
+        W[i, col[second[large]]] = 1.0
 
+    return W
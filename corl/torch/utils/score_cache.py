@@ -0,0 +1,116 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import hashlib
+import sqlite3
+import numpy as np
+
+
+def parent_bitmask(col) -> bytes:
+    """Pack a row of a graph matrix into a compact parent-set key."""
+
+    return np.packbits(np.asarray(col) > 0.5).tobytes()
+
+
+def dataset_key(data, **params) -> str:
+    """Content hash of ``data`` together with the scoring parameters."""
+
+    md5f = hashlib.md5()
+    md5f.update(str(data.shape).encode())
+    md5f.update(str(data.dtype).encode())
+    # by blocks of rows, memory-mapped data is never read at once
+    step = max(1, 2 ** 24 // max(1, data[:1].nbytes))
+    for start in range(0, data.shape[0], step):
+        md5f.update(np.ascontiguousarray(data[start:start + step]).tobytes())
+    for name in sorted(params):
+        md5f.update(f'{name}={params[name]}'.encode())
+
+    return md5f.hexdigest()
+
+
+class RSSCache(object):
+    """
+    Persistent cache of per-node RSS values, stored in a SQLite file.
+
+    Scores are keyed by a content hash of the input data and the scoring
+    parameters, plus (node, parent bitmask), so different runs, and
+    concurrent processes, on the same dataset share their regressions.
+    New values are buffered and written every ``flush_every`` entries.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file, created if it doesn't exist.
+    data: np.ndarray
+        input data of ``Reward``.
+    flush_every: int, default: 1000
+        number of buffered values that triggers a write.
+    params:
+        scoring parameters that change the RSS values, e.g.
+        ``regression_type``.
+    """
+
+    def __init__(self, path, data, flush_every=1000, **params):
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.flush_every = flush_every
+        self.key = dataset_key(data, **params)
+        self._pending = []
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS rss ('
+                           'dataset TEXT, node INTEGER, parents BLOB, '
+                           'value REAL, '
+                           'PRIMARY KEY (dataset, node, parents)'
+                           ') WITHOUT ROWID')
+        self._conn.commit()
+
+    def load(self, n_nodes) -> list:
+        """All stored values of this dataset, one dict per node."""
+
+        d_RSS = [{} for _ in range(n_nodes)]
+        rows = self._conn.execute('SELECT node, parents, value FROM rss '
+                                  'WHERE dataset = ?', (self.key,))
+        for node, parents, value in rows:
+            d_RSS[node][bytes(parents)] = value
+
+        return d_RSS
+
+    def put(self, node, parents, value) -> None:
+
+        self._pending.append((self.key, int(node), parents, float(value)))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO rss '
+                                   'VALUES (?, ?, ?, ?)', self._pending)
+        self._pending = []
+
+    def close(self) -> None:
+
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
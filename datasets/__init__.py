@@ -16,6 +16,8 @@
 from .simulator import DAG, IIDSimulation
 from .simulator import Topology, THPSimulation
 from .loader import load_dataset
+from .storage import load_simulation
+from .suite import simulate_suite
 from .builtin_dataset import DataSetRegistry
 
 __builtin_dataset__ = DataSetRegistry.meta.keys()
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import shutil
 import urllib
 import tarfile
 import hashlib
@@ -21,10 +22,13 @@ import pandas as pd
 import numpy as np
 from urllib.error import URLError
 
-from .simulator import DAG, IIDSimulation
+from .simulator import DAG, IIDSimulation, set_random_seed
 from .simulator import Topology, THPSimulation
+from .storage import (cache_key, cached, default_cache_dir, load_frame,
+                      load_simulation, save_frame)
 
 USER_AGENT = "gcastle/dataset"
+MIRROR_ENV = 'CASTLE_DATA_MIRROR'
 
 
 def _check_exist(root, filename, files):
@@ -69,6 +73,29 @@ def _read_data(root, filename, files):
     return result
 
 
+def _extract(savegz, root):
+
+    tar = tarfile.open(savegz)
+    names = tar.getnames()
+    for name in names:
+        tar.extract(name, path=root)
+    tar.close()
+
+
+def _copy_from_mirror(root, mirror, filename, md5):
+    """Extract the datasets from a local mirror of the download urls."""
+
+    source = os.path.join(mirror, filename)
+    if not _check_integrity(source, md5):
+        raise RuntimeError("{} not found or corrupted in the mirror {}."
+                           .format(filename, mirror))
+    os.makedirs(root, exist_ok=True)
+    savegz = os.path.join(root, filename)
+    if os.path.abspath(source) != os.path.abspath(savegz):
+        shutil.copyfile(source, savegz)
+    _extract(savegz, root)
+
+
 def _download(root, url, filename, md5):
     """Download the datasets if it doesn't exist already."""
 
@@ -86,11 +113,7 @@ def _download(root, url, filename, md5):
             with open(savegz, "wb") as fh:
                 fh.write(response.read())
 
-            tar = tarfile.open(savegz)
-            names = tar.getnames()
-            for name in names:
-                tar.extract(name, path=root)
-            tar.close()
+            _extract(savegz, root)
         except URLError as error:
             print("Failed to download (trying next):\n{}".format(error))
             continue
@@ -126,41 +149,96 @@ class BuiltinDataSet(object):
         return self._topology_matrix
 
 
-class IID_Test(BuiltinDataSet):
+class SimulatedDataSet(BuiltinDataSet):
+    """
+    A dataset simulated once with fixed parameters and seed, then kept in
+    the dataset cache, under a key derived from its parameters, and
+    loaded memory-mapped.
+    """
+
+    params = {}
+
+    def load(self, root=None, download=False, cache_dir=None, mirror=None):
+
+        cache_dir = cache_dir or default_cache_dir()
+        key = cache_key(name=type(self).__name__, **self.params)
+        directory = cached(os.path.join(cache_dir, key), self._simulate)
+        data, meta = load_simulation(directory, mmap_mode='c')
+        self._read(data, meta)
+
+    def _simulate(self, output_dir):
+        raise NotImplementedError
+
+    def _read(self, data, meta):
+        raise NotImplementedError
+
+
+class IID_Test(SimulatedDataSet):
     """
     A function for loading IID dataset
     """
 
+    params = {'n_nodes': 10, 'n_edges': 20, 'weight_range': (0.5, 2.0),
+              'n': 2000, 'method': 'linear', 'sem_type': 'gauss', 'seed': 1}
+
     def __init__(self):
         super().__init__()
 
-    def load(self, *args, **kwargs):
-        weighted_random_dag = DAG.erdos_renyi(n_nodes=10, n_edges=20,
-                                              weight_range=(0.5, 2.0),
-                                              seed=1)
-        dataset = IIDSimulation(W=weighted_random_dag, n=2000,
-                                method='linear', sem_type='gauss')
-        self._true_graph_matrix, self._data = dataset.B, dataset.X
+    def _simulate(self, output_dir):
+        p = self.params
+        weighted_random_dag = DAG.erdos_renyi(n_nodes=p['n_nodes'],
+                                              n_edges=p['n_edges'],
+                                              weight_range=p['weight_range'],
+                                              seed=p['seed'])
+        IIDSimulation(W=weighted_random_dag, n=p['n'], method=p['method'],
+                      sem_type=p['sem_type'], output_dir=output_dir)
+
+    def _read(self, data, meta):
+        self._true_graph_matrix, self._data = np.asarray(meta['B']), data
 
 
-class THP_Test(BuiltinDataSet):
+class THP_Test(SimulatedDataSet):
     """
     A function for loading THP dataset
     """
 
+    params = {'n_nodes': 10, 'n_edges': 10, 'topology_nodes': 20,
+              'topology_edges': 20, 'mu_range': (0.00005, 0.0001),
+              'alpha_range': (0.005, 0.007), 'T': 25000, 'max_hop': 2,
+              'seed': 1}
+
     def __init__(self):
         super().__init__()
 
-    def load(self, *args, **kwargs):
-        self._true_graph_matrix = DAG.erdos_renyi(n_nodes=10, n_edges=10)
-        self._topology_matrix = Topology.erdos_renyi(n_nodes=20, n_edges=20)
-        simulator = THPSimulation(self._true_graph_matrix, self._topology_matrix,
-                                  mu_range=(0.00005, 0.0001),
-                                  alpha_range=(0.005, 0.007))
-        self._data = simulator.simulate(T=25000, max_hop=2)
+    def _simulate(self, output_dir):
+        p = self.params
+        # the generators reseed the global random state from their seed
+        # argument, None would draw a fresh one from the OS
+        true_graph_matrix = DAG.erdos_renyi(n_nodes=p['n_nodes'],
+                                            n_edges=p['n_edges'],
+                                            seed=p['seed'])
+        topology_matrix = Topology.erdos_renyi(n_nodes=p['topology_nodes'],
+                                               n_edges=p['topology_edges'],
+                                               seed=p['seed'])
+        simulator = THPSimulation(true_graph_matrix, topology_matrix,
+                                  mu_range=p['mu_range'],
+                                  alpha_range=p['alpha_range'])
+        set_random_seed(p['seed'])
+        simulator.simulate(T=p['T'], max_hop=p['max_hop'],
+                           output_dir=output_dir)
+
+    def _read(self, data, meta):
+        self._true_graph_matrix = np.asarray(meta['causal_matrix'])
+        self._topology_matrix = np.asarray(meta['topology_matrix'])
+        self._data = pd.DataFrame(data)
 
 
 class RealDataSet(BuiltinDataSet):
+    """
+    A dataset downloaded as a tar archive, or copied from a local mirror of
+    the download urls so that it never touches the network, then kept in
+    the dataset cache under a key of its md5 as memory-mapped columns.
+    """
 
     def __init__(self):
         super().__init__()
@@ -169,25 +247,43 @@ class RealDataSet(BuiltinDataSet):
         self.md5 = None
         self.file_list = None
 
-    def load(self, root=None, download=False):
+    def load(self, root=None, download=False, cache_dir=None, mirror=None):
+
+        cache_dir = cache_dir or default_cache_dir()
+        key = cache_key(name=type(self).__name__, md5=self.md5)
+        directory = cached(os.path.join(cache_dir, key),
+                           lambda output_dir: self._convert(
+                               output_dir, root, download, mirror))
+        self._data, meta = load_frame(directory, mmap_mode='c')
+        self._true_graph_matrix = np.asarray(meta['true_graph_matrix'])
+        self._topology_matrix = meta.get('topology_matrix')
+        if self._topology_matrix is not None:
+            self._topology_matrix = np.asarray(self._topology_matrix)
+
+    def _convert(self, output_dir, root, download, mirror):
+        """Parse the extracted files once and write them to the cache."""
 
         if root is None:
             root = './'
+        mirror = mirror or os.environ.get(MIRROR_ENV)
 
-        if _check_exist(root, self.tar_file, self.file_list):
-            self._data, self._true_graph_matrix, self._topology_matrix = \
-                _read_data(root, self.tar_file, self.file_list)
-            return
-
-        if download:
-            _download(root, self.url, self.tar_file, self.md5)
+        if not _check_exist(root, self.tar_file, self.file_list):
+            if mirror:
+                _copy_from_mirror(root, mirror, self.tar_file, self.md5)
+            elif download:
+                _download(root, self.url, self.tar_file, self.md5)
 
         if not _check_exist(root, self.tar_file, self.file_list):
             raise RuntimeError('Dataset not found.' +
                                ' You can use download=True to download it.')
 
-        self._data, self._true_graph_matrix, self._topology_matrix = \
+        data, true_graph_matrix, topology_matrix = \
             _read_data(root, self.tar_file, self.file_list)
+        arrays = {'true_graph_matrix': true_graph_matrix}
+        if topology_matrix is not None:
+            arrays['topology_matrix'] = topology_matrix
+        save_frame(output_dir, data, arrays=arrays, name=self.tar_file,
+                   md5=self.md5)
 
 
 class V18_N55_Wireless(RealDataSet):
@@ -16,7 +16,8 @@
 from .builtin_dataset import *
 
 
-def load_dataset(name='IID_Test', root=None, download=False):
+def load_dataset(name='IID_Test', root=None, download=False, cache_dir=None,
+                 mirror=None):
     """
     A function for loading some well-known datasets.
 
@@ -31,6 +32,13 @@ def load_dataset(name='IID_Test', root=None, download=False):
         If true, downloads the dataset from the internet and
         puts it in root directory. If dataset is already downloaded, it is not
         downloaded again.
+    cache_dir: str
+        Directory of the dataset cache, defaults to ``$CASTLE_DATA_CACHE`` or
+        ``~/.cache/castle``. Datasets are simulated or parsed once, stored
+        there as ``.npy`` files and loaded memory-mapped afterwards.
+    mirror: str
+        Local directory holding the archives of the real datasets, used
+        instead of downloading them, defaults to ``$CASTLE_DATA_MIRROR``.
 
     Return
     ------
@@ -39,8 +47,8 @@ def load_dataset(name='IID_Test', root=None, download=False):
             adjacency matrix for the target causal graph.
         topology_matrix: numpy.matrix
             adjacency matrix for the topology.
-        data: pandas.core.frame.DataFrame
-            standard trainning dataset.
+        data: numpy.ndarray or pandas.core.frame.DataFrame
+            standard trainning dataset, memory-mapped copy-on-write.
     """
 
     if name not in DataSetRegistry.meta.keys():
@@ -48,5 +56,5 @@ def load_dataset(name='IID_Test', root=None, download=False):
                          ' ''castle.datasets.__builtin_dataset__'' to get registered '
                          'dataset list'.format(name))
     loader = DataSetRegistry.meta.get(name)()
-    loader.load(root, download)
+    loader.load(root, download, cache_dir=cache_dir, mirror=mirror)
     return loader.data, loader.true_graph_matrix, loader.topology_matrix
@@ -21,6 +21,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import logging
 import random
 from random import sample
@@ -28,17 +29,69 @@ import numpy as np
 import pandas as pd
 import networkx as nx
 from networkx.algorithms import bipartite
-from tqdm import tqdm
 from copy import deepcopy
-from itertools import combinations
+from scipy import sparse as sp
+from scipy.linalg import solve_triangular
 from scipy.special import expit as sigmoid
 
+from .storage import (EVENT_COLUMNS, write_array, write_grouped_columns,
+                      save_meta)
+
+# rows simulated at once when streaming, or for nonlinear SEMs
+DEFAULT_CHUNK_SIZE = 100000
+
 
 def set_random_seed(seed):
     random.seed(seed)
     np.random.seed(seed)
 
 
+def _topological_layers(W):
+    """Layers of the DAG with dense or sparse adjacency W, peeled from the
+    nodes without parents, every parent of a node being in an earlier
+    layer; raise ValueError if W has a cycle."""
+
+    if sp.issparse(W):
+        B = sp.csr_matrix(W != 0, dtype=int)
+    else:
+        B = (np.asarray(W) != 0).astype(int)
+    in_degree = np.asarray(B.sum(axis=0)).ravel()
+    layers, n_sorted = [], 0
+    layer = np.flatnonzero(in_degree == 0)
+    while layer.size > 0:
+        layers.append(layer)
+        n_sorted += layer.size
+        in_degree[layer] = -1
+        in_degree -= np.asarray(B[layer].sum(axis=0)).ravel()
+        layer = np.flatnonzero(in_degree == 0)
+    if n_sorted != B.shape[0]:
+        raise ValueError('W must be a DAG')
+
+    return layers
+
+
+def _topological_order(W):
+    """Topological order of the DAG with adjacency W, see
+    ``_topological_layers``."""
+
+    return np.concatenate(_topological_layers(W)).astype(int)
+
+
+def _parents(W):
+    """Parents of every node and the weights of their edges, for a dense or
+    sparse W."""
+
+    if sp.issparse(W):
+        W = sp.csc_matrix(W)
+        W.eliminate_zeros()
+        return [(W.indices[W.indptr[j]:W.indptr[j + 1]],
+                 W.data[W.indptr[j]:W.indptr[j + 1]])
+                for j in range(W.shape[1])]
+    parents = [np.flatnonzero(W[:, j]) for j in range(W.shape[1])]
+
+    return [(pa, W[pa, j]) for j, pa in enumerate(parents)]
+
+
 class DAG(object):
     '''
     A class for simulating random (causal) DAG, where any DAG generator
@@ -49,9 +102,11 @@ class DAG(object):
 
     @staticmethod
     def _random_permutation(M):
-        # np.random.permutation permutes first axis only
-        P = np.random.permutation(np.eye(M.shape[0]))
-        return P.T @ M @ P
+        # same as P.T @ M @ P with P = np.random.permutation(np.eye(d)),
+        # by indexing instead of two dense products
+        perm = np.random.permutation(M.shape[0])
+        inv = np.argsort(perm)
+        return np.asarray(M)[np.ix_(inv, inv)]
 
     @staticmethod
     def _random_acyclic_orientation(B_und):
@@ -63,6 +118,79 @@ class DAG(object):
     def _graph_to_adjmat(G):
         return nx.to_numpy_matrix(G)
 
+    @staticmethod
+    def _sample_pairs(n_pairs, p):
+        """Indices of a Binomial(n_pairs, p) number of distinct pairs drawn
+        uniformly among ``n_pairs``, without enumerating them"""
+
+        n_edges = np.random.binomial(n_pairs, min(p, 1.))
+        if n_edges > n_pairs // 2:
+            return np.sort(np.random.choice(n_pairs, n_edges, replace=False))
+        codes = np.unique(np.random.randint(0, n_pairs, size=int(n_edges * 1.1) + 10))
+        while codes.size < n_edges:
+            codes = np.union1d(codes, np.random.randint(0, n_pairs, size=n_edges))
+        return np.sort(np.random.choice(codes, n_edges, replace=False))
+
+    @staticmethod
+    def _orient_edges(rows, cols, n_nodes, weight_range=None):
+        """
+        Orient undirected edges (rows[k], cols[k]) from the lower to the
+        higher rank of a random permutation of the nodes, and return the
+        (weighted) adjacency as a ``scipy.sparse.csr_matrix``.
+        """
+
+        rank = np.random.permutation(n_nodes)
+        forward = rank[rows] < rank[cols]
+        src = np.where(forward, rows, cols)
+        dst = np.where(forward, cols, rows)
+        if weight_range is None:
+            weights = np.ones(src.size)
+        else:
+            weights = np.random.uniform(low=weight_range[0],
+                                        high=weight_range[1], size=src.size)
+            weights[np.random.rand(src.size) < 0.5] *= -1
+        return sp.csr_matrix((weights, (src, dst)), shape=(n_nodes, n_nodes))
+
+    @staticmethod
+    def _sparse_erdos_renyi(n_nodes, n_edges, weight_range):
+
+        creation_prob = (2 * n_edges) / (n_nodes ** 2)
+        codes = DAG._sample_pairs(n_nodes * (n_nodes - 1) // 2, creation_prob)
+        # code k <-> pair (i, j), j < i, of the strict lower triangle
+        rows = np.floor((np.sqrt(8 * codes.astype(float) + 1) + 1) / 2).astype(np.int64)
+        rows[rows * (rows - 1) // 2 > codes] -= 1
+        rows[(rows + 1) * rows // 2 <= codes] += 1
+        cols = codes - rows * (rows - 1) // 2
+        return DAG._orient_edges(rows, cols, n_nodes, weight_range)
+
+    @staticmethod
+    def _sparse_scale_free(n_nodes, m, weight_range):
+
+        # Barabasi-Albert preferential attachment, as networkx does
+        repeated = []
+        targets = list(range(m))
+        rows, cols = [], []
+        for source in range(m, n_nodes):
+            rows.extend([source] * m)
+            cols.extend(targets)
+            repeated.extend(targets)
+            repeated.extend([source] * m)
+            chosen = set()
+            while len(chosen) < m:
+                chosen.add(repeated[np.random.randint(len(repeated))])
+            targets = list(chosen)
+        return DAG._orient_edges(np.array(rows, dtype=np.int64),
+                                 np.array(cols, dtype=np.int64),
+                                 n_nodes, weight_range)
+
+    @staticmethod
+    def _sparse_bipartite(n_top, n_bottom, n_edges, weight_range):
+
+        codes = DAG._sample_pairs(n_top * n_bottom, n_edges / (n_top * n_bottom))
+        rows, cols = np.divmod(codes, n_bottom)
+        return DAG._orient_edges(rows, cols + n_top, n_top + n_bottom,
+                                 weight_range)
+
     @staticmethod
     def _BtoW(B, d, w_range):
         U = np.random.uniform(low=w_range[0], high=w_range[1], size=[d, d])
@@ -158,10 +286,29 @@ class DAG(object):
         return B
 
     @staticmethod
-    def erdos_renyi(n_nodes, n_edges, weight_range=None, seed=None):
+    def erdos_renyi(n_nodes, n_edges, weight_range=None, seed=None,
+                    sparse=False):
+        """
+        Parameters
+        ----------
+        n_nodes: int
+            Number of nodes.
+        n_edges: int
+            Expected number of edges.
+        weight_range: tuple, default=None
+            Range of the absolute edge weights, None returns a binary DAG.
+        seed: int, default=None
+        sparse: bool, default=False
+            If True, edges are sampled directly as index arrays, oriented by
+            a random permutation of the node ranks, and a
+            ``scipy.sparse.csr_matrix`` is returned, which scales to
+            n_nodes = 10^5. The dense adjacency is kept for small graphs.
+        """
 
         assert n_nodes > 0
         set_random_seed(seed)
+        if sparse:
+            return DAG._sparse_erdos_renyi(n_nodes, n_edges, weight_range)
         # Erdos-Renyi
         creation_prob = (2 * n_edges) / (n_nodes ** 2)
         G_und = nx.erdos_renyi_graph(n=n_nodes, p=creation_prob, seed=seed)
@@ -174,12 +321,16 @@ class DAG(object):
         return W
 
     @staticmethod
-    def scale_free(n_nodes, n_edges, weight_range=None, seed=None):
+    def scale_free(n_nodes, n_edges, weight_range=None, seed=None,
+                   sparse=False):
+        """See ``erdos_renyi`` for the parameters."""
 
         assert (n_nodes > 0 and n_edges >= n_nodes and n_edges < n_nodes * n_nodes)
         set_random_seed(seed)
         # Scale-free, Barabasi-Albert
         m = int(round(n_edges / n_nodes))
+        if sparse:
+            return DAG._sparse_scale_free(n_nodes, m, weight_range)
         G_und = nx.barabasi_albert_graph(n=n_nodes, m=m)
         B_und = DAG._graph_to_adjmat(G_und)
         B = DAG._random_acyclic_orientation(B_und)
@@ -190,13 +341,17 @@ class DAG(object):
         return W
 
     @staticmethod
-    def bipartite(n_nodes, n_edges, split_ratio = 0.2, weight_range=None, seed=None):
+    def bipartite(n_nodes, n_edges, split_ratio = 0.2, weight_range=None, seed=None,
+                  sparse=False):
+        """See ``erdos_renyi`` for the parameters."""
 
         assert n_nodes > 0
         set_random_seed(seed)
         # Bipartite, Sec 4.1 of (Gu, Fu, Zhou, 2018)
         n_top = int(split_ratio * n_nodes)
         n_bottom = n_nodes -  n_top
+        if sparse:
+            return DAG._sparse_bipartite(n_top, n_bottom, n_edges, weight_range)
         creation_prob = n_edges/(n_top*n_bottom)
         G_und = bipartite.random_graph(n_top, n_bottom, p=creation_prob, directed=True)
         B_und = DAG._graph_to_adjmat(G_und)
@@ -244,8 +399,10 @@ class IIDSimulation(object):
 
     Parameters
     ----------
-    W: np.ndarray
-        Weighted adjacency matrix for the target causal graph.
+    W: np.ndarray or scipy.sparse matrix
+        Weighted adjacency matrix for the target causal graph. A sparse W,
+        e.g. from ``DAG.erdos_renyi(..., sparse=True)``, is never made
+        dense: the samples are computed layer by layer of the DAG.
     n: int
         Number of samples for standard trainning dataset.
     method: str, (linear or nonlinear), default='linear'
@@ -255,22 +412,69 @@ class IIDSimulation(object):
         mlp, mim, gp, gp-add, quadratic (nonlinear).
     noise_scale: float
         Scale parameter of noise distribution in linear SEM.
+    chunk_size: int, default=None
+        Number of rows simulated at once, bounds the memory of the noise and
+        of the hidden units for very large n. None simulates linear SEMs at
+        once and nonlinear SEMs, or any SEM with ``output_dir``, in blocks
+        of ``DEFAULT_CHUNK_SIZE`` rows.
+    output_dir: str, default=None
+        If not None, samples are written to ``output_dir/X.npy`` as they
+        are simulated, with W, B and the parameters in
+        ``output_dir/meta.json``, and ``X`` is the memory-mapped file, see
+        ``castle.datasets.storage.load_simulation``. The logistic SEM is
+        simulated at once before being written.
+    seed: int, default=None
+        If not None, seed of the random generators, stored in the metadata.
     '''
 
     def __init__(self, W, n=1000, method='linear', 
-                 sem_type='gauss', noise_scale=1.0):
+                 sem_type='gauss', noise_scale=1.0, chunk_size=None,
+                 output_dir=None, seed=None):
 
+        if seed is not None:
+            set_random_seed(seed)
+        if sp.issparse(W):
+            W = sp.csc_matrix(W, dtype=float)
         self.B = (W != 0).astype(int)
-        if method == 'linear':
+        if output_dir is not None:
+            self.X = self._simulate_to_file(W, n, method, sem_type,
+                                            noise_scale, chunk_size,
+                                            output_dir, seed)
+        elif method == 'linear':
             self.X = IIDSimulation._simulate_linear_sem(
-                    W, n, sem_type, noise_scale)
+                    W, n, sem_type, noise_scale, chunk_size=chunk_size)
         elif method == 'nonlinear':
             self.X = IIDSimulation._simulate_nonlinear_sem(
-                    W, n, sem_type, noise_scale)
+                    W, n, sem_type, noise_scale, chunk_size=chunk_size)
         logging.info('Finished synthetic dataset')
 
+    def _simulate_to_file(self, W, n, method, sem_type, noise_scale,
+                          chunk_size, output_dir, seed):
+
+        os.makedirs(output_dir, exist_ok=True)
+        if method == 'linear' and sem_type in ('gauss', 'exp', 'gumbel', 'uniform'):
+            chunks = IIDSimulation._linear_sem_chunks(
+                W, n, sem_type, noise_scale,
+                chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+        elif method == 'linear':
+            chunks = [(0, IIDSimulation._simulate_linear_sem(
+                W, n, sem_type, noise_scale))]
+        elif method == 'nonlinear':
+            chunks = IIDSimulation._nonlinear_sem_chunks(
+                W, n, sem_type, noise_scale,
+                chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+        else:
+            raise ValueError(f"method must be one of ['linear', 'nonlinear'], "
+                             f"but got {method}.")
+        X = write_array(os.path.join(output_dir, 'X.npy'), chunks,
+                        shape=(n, W.shape[0]))
+        save_meta(output_dir, arrays={'W': W, 'B': self.B}, kind='iid',
+                  data='X.npy', method=method, sem_type=sem_type,
+                  noise_scale=noise_scale, n=n, seed=seed)
+        return X
+
     @staticmethod
-    def _simulate_linear_sem(W, n, sem_type, noise_scale):
+    def _simulate_linear_sem(W, n, sem_type, noise_scale, chunk_size=None):
         """
         Simulate samples from linear SEM with specified type of noise.
         For uniform, noise z ~ uniform(-a, a), where a = noise_scale.
@@ -285,64 +489,127 @@ class IIDSimulation(object):
             gauss, exp, gumbel, uniform, logistic.
         noise_scale: float 
             Scale parameter of noise distribution in linear SEM.
+        chunk_size: int, default=None
+            Number of rows simulated at once, see ``_linear_sem_chunks``.
         
         Return
         ------
         X: np.ndarray
             [n, d] sample matrix, [d, d] if n=inf
         """
-        def _simulate_single_equation(X, w, scale):
+        def _simulate_single_equation(X, w):
             """X: [n, num of parents], w: [num of parents], x: [n]"""
-            if sem_type == 'gauss':
-                z = np.random.normal(scale=scale, size=n)
-                x = X @ w + z
-            elif sem_type == 'exp':
-                z = np.random.exponential(scale=scale, size=n)
-                x = X @ w + z
-            elif sem_type == 'gumbel':
-                z = np.random.gumbel(scale=scale, size=n)
-                x = X @ w + z
-            elif sem_type == 'uniform':
-                z = np.random.uniform(low=-scale, high=scale, size=n)
-                x = X @ w + z
-            elif sem_type == 'logistic':
-                x = np.random.binomial(1, sigmoid(X @ w)) * 1.0
-            else:
-                raise ValueError('Unknown sem type. In a linear model, \
-                                 the options are as follows: gauss, exp, \
-                                 gumbel, uniform, logistic.')
-            return x
+            return np.random.binomial(1, sigmoid(X @ w)) * 1.0
 
         d = W.shape[0]
-        if noise_scale is None:
-            scale_vec = np.ones(d)
-        elif np.isscalar(noise_scale):
-            scale_vec = noise_scale * np.ones(d)
-        else:
-            if len(noise_scale) != d:
-                raise ValueError('noise scale must be a scalar or has length d')
-            scale_vec = noise_scale
-        G_nx =  nx.from_numpy_matrix(W, create_using=nx.DiGraph)
-        if not nx.is_directed_acyclic_graph(G_nx):
-            raise ValueError('W must be a DAG')
+        scale_vec = IIDSimulation._noise_scale_vec(noise_scale, d)
+        ordered_vertices = _topological_order(W)
         if np.isinf(n):  # population risk for linear gauss SEM
             if sem_type == 'gauss':
+                if sp.issparse(W):
+                    W = W.toarray()
                 # make 1/d X'X = true cov
                 X = np.sqrt(d) * np.diag(scale_vec) @ np.linalg.inv(np.eye(d) - W)
                 return X
             else:
                 raise ValueError('population risk not available')
         # empirical risk
-        ordered_vertices = list(nx.topological_sort(G_nx))
-        assert len(ordered_vertices) == d
-        X = np.zeros([n, d])
-        for j in ordered_vertices:
-            parents = list(G_nx.predecessors(j))
-            X[:, j] = _simulate_single_equation(X[:, parents], W[parents, j], scale_vec[j])
+        if sem_type == 'logistic':
+            X = np.zeros([n, d])
+            parents = _parents(W)
+            for j in ordered_vertices:
+                pa, w = parents[j]
+                X[:, j] = _simulate_single_equation(X[:, pa], w)
+            return X
+        X = np.empty([n, d])
+        for start, X_chunk in IIDSimulation._linear_sem_chunks(
+                W, n, sem_type, scale_vec, chunk_size=chunk_size):
+            X[start:start + X_chunk.shape[0]] = X_chunk
         return X
 
     @staticmethod
-    def _simulate_nonlinear_sem(W, n, sem_type, noise_scale):
+    def _noise_scale_vec(noise_scale, d):
+
+        if noise_scale is None:
+            scale_vec = np.ones(d)
+        elif np.isscalar(noise_scale):
+            scale_vec = noise_scale * np.ones(d)
+        else:
+            if len(noise_scale) != d:
+                raise ValueError('noise scale must be a scalar or has length d')
+            scale_vec = np.asarray(noise_scale, dtype=float)
+        return scale_vec
+
+    @staticmethod
+    def _linear_sem_chunks(W, n, sem_type, noise_scale, chunk_size=None):
+        """
+        Simulate a linear SEM with additive noise by blocks of rows.
+
+        The noise Z of a block is drawn at once and ``X = Z (I - W)^-1`` is
+        one matrix product. ``(I - W)^-1`` is computed once by a triangular
+        solve, ``I - W`` being triangular once its rows and columns follow a
+        topological order. With a sparse W the inverse, which is dense, is
+        never formed: the nodes of each layer of the DAG get the
+        contributions of their parents with one sparse product.
+
+        Parameters
+        ----------
+        W: np.ndarray or scipy.sparse matrix
+            [d, d] weighted adj matrix of DAG.
+        n: int
+            Number of samples.
+        sem_type: str
+            gauss, exp, gumbel or uniform.
+        noise_scale: float or array-like
+            Scale parameter of noise distribution.
+        chunk_size: int, default=None
+            Number of rows of each block, None yields a single block.
+
+        Yields
+        ------
+        start: int
+            index of the first row of the block.
+        X: np.ndarray
+            [chunk_size, d] samples.
+        """
+        d = W.shape[0]
+        scale_vec = IIDSimulation._noise_scale_vec(noise_scale, d)
+        if sem_type == 'gauss':
+            draw = lambda size: np.random.normal(scale=scale_vec, size=size)
+        elif sem_type == 'exp':
+            draw = lambda size: np.random.exponential(scale=scale_vec, size=size)
+        elif sem_type == 'gumbel':
+            draw = lambda size: np.random.gumbel(scale=scale_vec, size=size)
+        elif sem_type == 'uniform':
+            draw = lambda size: np.random.uniform(low=-scale_vec, high=scale_vec,
+                                                  size=size)
+        else:
+            raise ValueError('Unknown sem type. In a linear model, \
+                             the options are as follows: gauss, exp, \
+                             gumbel, uniform, logistic.')
+        chunk_size = n if chunk_size is None else int(chunk_size)
+        if sp.issparse(W):
+            W = sp.csc_matrix(W)
+            layers = _topological_layers(W)[1:]
+            incoming = [W[:, layer].T.tocsr() for layer in layers]
+            for start in range(0, n, chunk_size):
+                X = draw((min(chunk_size, n - start), d))
+                for layer, W_in in zip(layers, incoming):
+                    X[:, layer] += (W_in @ X.T).T
+                yield start, X
+            return
+        order = _topological_order(W)
+        # upper unit triangular in topological order
+        U = np.eye(d) - W[np.ix_(order, order)]
+        M = np.zeros([d, d])
+        M[np.ix_(order, order)] = solve_triangular(U, np.eye(d),
+                                                   unit_diagonal=True)
+        for start in range(0, n, chunk_size):
+            Z = draw((min(chunk_size, n - start), d))
+            yield start, Z @ M
+
+    @staticmethod
+    def _simulate_nonlinear_sem(W, n, sem_type, noise_scale, chunk_size=None):
         """
         Simulate samples from nonlinear SEM.
 
@@ -356,178 +623,198 @@ class IIDSimulation(object):
             mlp, mim, gp, gp-add, or quadratic.
         noise_scale: float
             Scale parameter of noise distribution in linear SEM.
+        chunk_size: int, default=None
+            Number of rows simulated at once, None means
+            ``DEFAULT_CHUNK_SIZE``, see ``_nonlinear_sem_chunks``.
 
         Return
         ------
         X: np.ndarray
             [n, d] sample matrix
         """
-        if sem_type == 'quadratic':
-            return IIDSimulation._simulate_quad_sem(W, n, noise_scale)
-
-        def _simulate_single_equation(X, scale):
-            """X: [n, num of parents], x: [n]"""
-            z = np.random.normal(scale=scale, size=n)
-            pa_size = X.shape[1]
-            if pa_size == 0:
-                return z
-            if sem_type == 'mlp':
-                hidden = 100
-                W1 = np.random.uniform(low=0.5, high=2.0, size=[pa_size, hidden])
-                W1[np.random.rand(*W1.shape) < 0.5] *= -1
-                W2 = np.random.uniform(low=0.5, high=2.0, size=hidden)
-                W2[np.random.rand(hidden) < 0.5] *= -1
-                x = sigmoid(X @ W1) @ W2 + z
-            elif sem_type == 'mim':
-                w1 = np.random.uniform(low=0.5, high=2.0, size=pa_size)
-                w1[np.random.rand(pa_size) < 0.5] *= -1
-                w2 = np.random.uniform(low=0.5, high=2.0, size=pa_size)
-                w2[np.random.rand(pa_size) < 0.5] *= -1
-                w3 = np.random.uniform(low=0.5, high=2.0, size=pa_size)
-                w3[np.random.rand(pa_size) < 0.5] *= -1
-                x = np.tanh(X @ w1) + np.cos(X @ w2) + np.sin(X @ w3) + z
-            elif sem_type == 'gp':
-                from sklearn.gaussian_process import GaussianProcessRegressor
-                gp = GaussianProcessRegressor()
-                x = gp.sample_y(X, random_state=None).flatten() + z
-            elif sem_type == 'gp-add':
-                from sklearn.gaussian_process import GaussianProcessRegressor
-                gp = GaussianProcessRegressor()
-                x = sum([gp.sample_y(X[:, i, None], random_state=None).flatten()
-                        for i in range(X.shape[1])]) + z
-            else:
-                raise ValueError('Unknown sem type. In a nonlinear model, \
-                                 the options are as follows: mlp, mim, \
-                                 gp, gp-add, or quadratic.')
-            return x
+        X = np.empty([n, W.shape[0]])
+        for start, X_chunk in IIDSimulation._nonlinear_sem_chunks(
+                W, n, sem_type, noise_scale,
+                chunk_size=chunk_size or DEFAULT_CHUNK_SIZE):
+            X[start:start + X_chunk.shape[0]] = X_chunk
+        return X
 
-        B = (W != 0).astype(int)
-        d = B.shape[0]
-        if noise_scale is None:
-            scale_vec = np.ones(d)
-        elif np.isscalar(noise_scale):
-            scale_vec = noise_scale * np.ones(d)
+    @staticmethod
+    def _signed_uniform(size, low=0.5, high=2.0):
+        """Uniform(low, high) draws with a random sign"""
+        w = np.random.uniform(low=low, high=high, size=size)
+        w[np.random.rand(*np.shape(w)) < 0.5] *= -1
+        return w
+
+    @staticmethod
+    def _nonlinear_sem_params(W, sem_type, n_features=100):
+        """
+        Random functions of every node, drawn at once for all the edges.
+
+        The 'gp' and 'gp-add' functions are sample paths of a GP with an RBF
+        kernel of unit length scale, the prior of
+        ``GaussianProcessRegressor().sample_y``, approximated by
+        ``n_features`` random Fourier features:
+        ``f(x) = sqrt(2 / m) * sum_k a_k cos(w_k^T x + b_k)``,
+        a ~ N(0, 1), w ~ N(0, I), b ~ U(0, 2 pi).
+
+        Returns
+        -------
+        out: list
+            for each node, its parents and the parameters of its function.
+        """
+        d = W.shape[0]
+        parents = [pa for pa, _ in _parents(W)]
+        sizes = np.array([len(pa) for pa in parents])
+        split = lambda a: np.split(a, np.cumsum(sizes)[:-1])
+        n_edges = sizes.sum()
+        if sem_type == 'mlp':
+            hidden = 100
+            W1 = split(IIDSimulation._signed_uniform((n_edges, hidden)))
+            W2 = IIDSimulation._signed_uniform((d, hidden))
+            params = [(W1[j], W2[j]) for j in range(d)]
+        elif sem_type == 'mim':
+            w = [split(IIDSimulation._signed_uniform(n_edges)) for _ in range(3)]
+            params = [(w[0][j], w[1][j], w[2][j]) for j in range(d)]
+        elif sem_type == 'gp':
+            omega = split(np.random.normal(size=(n_edges, n_features)))
+            phase = np.random.uniform(0, 2 * np.pi, size=(d, n_features))
+            amplitude = np.random.normal(size=(d, n_features))
+            params = [(omega[j], phase[j], amplitude[j]) for j in range(d)]
+        elif sem_type == 'gp-add':
+            omega = split(np.random.normal(size=(n_edges, n_features)))
+            phase = split(np.random.uniform(0, 2 * np.pi, size=(n_edges, n_features)))
+            amplitude = split(np.random.normal(size=(n_edges, n_features)))
+            params = [(omega[j], phase[j], amplitude[j]) for j in range(d)]
+        elif sem_type == 'quadratic':
+            params = IIDSimulation._quadratic_params(W, parents)
         else:
-            if len(noise_scale) != d:
-                raise ValueError('noise scale must be a scalar or has length d')
-            scale_vec = noise_scale
-
-        X = np.zeros([n, d])
-        G_nx =  nx.from_numpy_matrix(B, create_using=nx.DiGraph)
-        ordered_vertices = list(nx.topological_sort(G_nx))
-        assert len(ordered_vertices) == d
-        for j in ordered_vertices:
-            parents = list(G_nx.predecessors(j))
-            X[:, j] = _simulate_single_equation(X[:, parents], scale_vec[j])
-        return X
+            raise ValueError('Unknown sem type. In a nonlinear model, \
+                             the options are as follows: mlp, mim, \
+                             gp, gp-add, or quadratic.')
+        return list(zip(parents, params))
 
     @staticmethod
-    def _simulate_quad_sem(W, n, noise_scale):
+    def _nonlinear_sem_chunks(W, n, sem_type, noise_scale, chunk_size=None,
+                              n_features=100):
         """
-        Simulate samples from SEM with specified type of noise.
-        Coefficient is randomly drawn but specifically designed 
-        to avoid overflow issues.
+        Simulate a nonlinear SEM by blocks of rows.
+
+        The functions of all nodes are drawn once, so the blocks are iid
+        samples of the same SEM, then each block is computed node by node
+        in topological order with matrix products over its parents.
 
         Parameters
         ----------
-        W: np.ndarray
-            weigthed DAG.
+        W: np.ndarray or scipy.sparse matrix
+            [d, d] weighted adj matrix of DAG.
         n: int
             Number of samples.
-        noise_scale: float
-            Scale parameter of noise distribution in linear SEM.
-
-        Return
+        sem_type: str
+            mlp, mim, gp, gp-add, or quadratic.
+        noise_scale: float or array-like
+            Scale parameter of noise distribution.
+        chunk_size: int, default=None
+            Number of rows of each block, None yields a single block.
+        n_features: int, default=100
+            Number of random Fourier features of 'gp' and 'gp-add'.
+
+        Yields
         ------
+        start: int
+            index of the first row of the block.
         X: np.ndarray
-            [n,d] sample matrix
+            [chunk_size, d] samples.
         """
-        def generate_quadratic_coef(random_zero=True):
-            if random_zero and np.random.randint(low=0, high=2):
-                return 0
-            else:
-                coef = np.random.uniform(low=0.5, high=1)
-                if np.random.randint(low=0, high=2):
-                    coef *= -1
-                return coef
-
-        G = nx.DiGraph(W)
         d = W.shape[0]
-        X = np.zeros([n, d])
-        ordered_vertices = list(nx.topological_sort(G))
-        assert len(ordered_vertices) == d
-        for j in ordered_vertices:
-            parents = list(G.predecessors(j))
-
-            if len(parents) == 0:
-                eta = np.zeros([n])
-            elif len(parents) == 1:
-                # We don't generate random zero coefficient if there is only one parent
-                eta = np.zeros([n])
-                used_parents = set()
-                p = parents[0]
-                num_terms = 0
-
-                # Linear term
-                coef = generate_quadratic_coef(random_zero=False)
-                if coef != 0:
-                    eta += coef * X[:, p]
-                    used_parents.add(p)
-                    num_terms += 1
-
-                # Squared term
-                coef = generate_quadratic_coef(random_zero=False)
-                if coef != 0:
-                    eta += coef * np.square(X[:, p])
-                    used_parents.add(p)
-                    num_terms += 1
-                    
-                if num_terms > 0:
-                    eta /= num_terms    # Compute average
-
-                # Remove parent if both coef is zero
-                if p not in used_parents:
-                    W[p, j] = 0
-            else:    # More than 1 parent
-                eta = np.zeros([n])
-                used_parents = set()
-                num_terms = 0
-
-                for p in parents:
-                    # Linear terms
-                    coef = generate_quadratic_coef(random_zero=True)
-                    if coef > 0:
-                        eta += coef * X[:, p]
-                        used_parents.add(p)
-                        num_terms += 1
-
-                    # Squared terms
-                    coef = generate_quadratic_coef(random_zero=True)
-                    if coef > 0:
-                        eta += coef * np.square(X[:, p])
-                        used_parents.add(p)
-                        num_terms += 1
-
-                # Cross terms
-                for p1, p2 in combinations(parents, 2):
-                    coef = generate_quadratic_coef(random_zero=True)
-                    if coef > 0:
-                        eta += coef * X[:, p1] * X[:, p2]
-                        used_parents.add(p1)
-                        used_parents.add(p2)
-                        num_terms += 1
-
-                if num_terms > 0:
-                    eta /= num_terms    # Compute average
-
-                # Remove parent if both coef is zero
-                unused_parents = set(parents) - used_parents
-                if p in unused_parents:
-                    W[p, j] = 0
-
-            X[:, j] = eta + np.random.normal(scale=noise_scale, size=n)
+        scale_vec = IIDSimulation._noise_scale_vec(noise_scale, d)
+        ordered_vertices = _topological_order(W)
+        params = IIDSimulation._nonlinear_sem_params(W, sem_type, n_features)
+        chunk_size = n if chunk_size is None else int(chunk_size)
+        for start in range(0, n, chunk_size):
+            X = np.random.normal(scale=scale_vec, size=(min(chunk_size, n - start), d))
+            for j in ordered_vertices:
+                parents, param = params[j]
+                if len(parents) > 0:
+                    X[:, j] += IIDSimulation._nonlinear_function(
+                        X[:, parents], sem_type, param)
+            yield start, X
 
-        return X
+    @staticmethod
+    def _nonlinear_function(X, sem_type, param):
+        """X: [n, num of parents], f(X): [n]"""
+        if sem_type == 'mlp':
+            W1, W2 = param
+            return sigmoid(X @ W1) @ W2
+        elif sem_type == 'mim':
+            w1, w2, w3 = param
+            return np.tanh(X @ w1) + np.cos(X @ w2) + np.sin(X @ w3)
+        elif sem_type == 'gp':
+            omega, phase, amplitude = param
+            m = amplitude.shape[0]
+            return np.sqrt(2. / m) * np.cos(X @ omega + phase) @ amplitude
+        elif sem_type == 'gp-add':
+            omega, phase, amplitude = param
+            m = amplitude.shape[1]
+            # one 1-d GP per parent, [n, m] features at a time
+            f = np.zeros(X.shape[0])
+            for p in range(X.shape[1]):
+                f += np.cos(X[:, [p]] * omega[p] + phase[p]) @ amplitude[p]
+            return np.sqrt(2. / m) * f
+        else:  # quadratic
+            lin, sq, cross = param
+            return (X @ lin + np.square(X) @ sq
+                    + np.einsum('ni,ij,nj->n', X, cross, X))
+
+    @staticmethod
+    def _quadratic_params(W, parents):
+        """
+        Coefficients of the quadratic SEM, specifically designed to avoid
+        overflow issues: the linear, squared and cross terms of each node
+        are averaged over its nonzero terms.
+
+        With one parent both terms have a coefficient in +-[0.5, 1]. With
+        more parents, each term is kept with probability 1/4 and then has a
+        coefficient in [0.5, 1]. Parents with no term are removed from W.
+        """
+        def generate_quadratic_coef(size, random_zero=True):
+            coef = np.random.uniform(low=0.5, high=1, size=size)
+            coef[np.random.randint(low=0, high=2, size=size) == 1] *= -1
+            if random_zero:
+                coef[np.random.randint(low=0, high=2, size=size) == 1] = 0
+                coef[coef < 0] = 0
+            return coef
+
+        sizes = np.array([len(pa) for pa in parents])
+        split = lambda a, s: np.split(a, np.cumsum(s)[:-1])
+        single = sizes == 1
+        pair_sizes = sizes * (sizes - 1) // 2
+        one_lin = iter(generate_quadratic_coef(single.sum(), random_zero=False))
+        one_sq = iter(generate_quadratic_coef(single.sum(), random_zero=False))
+        many = np.where(single, 0, sizes)
+        lins = split(generate_quadratic_coef(many.sum()), many)
+        sqs = split(generate_quadratic_coef(many.sum()), many)
+        crosses = split(generate_quadratic_coef(pair_sizes.sum()), pair_sizes)
+
+        params = []
+        for j, pa in enumerate(parents):
+            k = len(pa)
+            if k == 1:
+                lin, sq = np.array([next(one_lin)]), np.array([next(one_sq)])
+            else:
+                lin, sq = lins[j], sqs[j]
+            cross = np.zeros((k, k))
+            cross[np.triu_indices(k, 1)] = crosses[j]
+            num_terms = np.count_nonzero(lin) + np.count_nonzero(sq) \
+                + np.count_nonzero(cross)
+            if num_terms > 0:  # Compute average
+                lin, sq, cross = lin / num_terms, sq / num_terms, cross / num_terms
+            # Remove parents without any term
+            used = (lin != 0) | (sq != 0) | (cross != 0).any(axis=0) \
+                | (cross != 0).any(axis=1)
+            W[pa[~used], j] = 0
+            params.append((lin, sq, cross))
+        return params
 
 
 class Topology(object):
@@ -594,15 +881,31 @@ class THPSimulation(object):
 
         self._causal_matrix = (causal_matrix != 0).astype(int)
 
-        self._topo = nx.from_numpy_matrix(topology_matrix,
-                                          create_using=nx.Graph)
+        topology = sp.csr_matrix(np.asarray(topology_matrix) != 0, dtype=int)
+        topology = ((topology + topology.T) > 0).astype(int)
+        topology.setdiag(0)
+        topology.eliminate_zeros()
+        self._topology = topology.tocsr()
 
         self._mu_range = mu_range
         self._alpha_range = alpha_range
 
-    def simulate(self, T, max_hop=1, beta=10):
+    def simulate(self, T, max_hop=1, beta=10, output_dir=None):
         """
         Generate simulation data.
+
+        The events of each generation are triggered at once: the k-hop
+        neighborhoods are computed once as sparse matrices, then the number
+        of offspring of every (parent event, neighbor, event type) is drawn
+        from a Poisson distribution and their times uniformly over the
+        duration of the parent.
+
+        If ``output_dir`` is not None, the events are written to one
+        memory-mapped ``.npy`` file per column (event, timestamp, node) with
+        the matrices and parameters in ``output_dir/meta.json``, and the dict
+        of columns is returned instead of a DataFrame. Each generation is
+        then spilled to disk as soon as it is triggered and the events are
+        grouped by node on disk, so only one generation is held in memory.
         """
         N = self._causal_matrix.shape[0]
 
@@ -612,59 +915,125 @@ class THPSimulation(object):
         alpha = alpha * self._causal_matrix
         alpha = np.ones([max_hop+1, N, N]) * alpha
 
-        immigrant_events = dict()
-        for node in self._topo.nodes:
-            immigrant_events[node] = self._trigger_events(mu, 0, T, beta)
-
-        base_events = immigrant_events.copy()
-        events = immigrant_events.copy()
-        while sum(map(len, base_events.values())) != 0:
-            offspring_events = dict()
-            for node in tqdm(self._topo.nodes):
-                offspring_events[node] = []
-                for k in range(max_hop+1):
-                    k_base_events = []
-                    for neighbor in self._get_k_hop_neighbors(
-                            self._topo, node, k):
-                        k_base_events += base_events[neighbor]
-                    k_new_events = [self._trigger_events(
-                        alpha[k, i], start_time, duration, beta)
-                        for (i, start_time, duration) in k_base_events]
-                    for event_group in k_new_events:
-                        offspring_events[node] += event_group
-                events[node] += offspring_events[node]
-            base_events = offspring_events
-
-        Xn_list = []
-        for node, event_group in events.items():
-            Xn = pd.DataFrame(event_group,
-                              columns=['event', 'timestamp', 'duration'])
-            Xn.insert(0, 'node', node)
-            Xn_list.append(Xn.reindex(columns=['event', 'timestamp', 'node']))
-        X = pd.concat(Xn_list, sort=False, ignore_index=True)
-        return X
+        generations = self._generations(mu, alpha, T, max_hop, beta)
+        n_nodes = self._topology.shape[0]
+        if output_dir is not None:
+            columns = write_grouped_columns(
+                output_dir, generations, 'node', n_nodes,
+                dtypes={name: np.int64 for name in EVENT_COLUMNS})
+            save_meta(output_dir,
+                      arrays={'causal_matrix': self._causal_matrix,
+                              'topology_matrix': self._topology.toarray()},
+                      kind='event', mu_range=self._mu_range,
+                      alpha_range=self._alpha_range, T=T, max_hop=max_hop,
+                      beta=beta)
+            return columns
+
+        # group the events by node, in order of generation
+        generations = list(generations)
+        order = np.argsort(np.concatenate([g['node'] for g in generations]),
+                           kind='stable')
+        columns = {name: np.concatenate([g[name] for g in generations])[order]
+                   for name in EVENT_COLUMNS}
+
+        return pd.DataFrame(columns)
+
+    def _generations(self, mu, alpha, T, max_hop, beta):
+        """
+        Yield the events of each generation, the immigrants first, then the
+        offspring of the previous generation until none is triggered.
+        """
+        N = len(mu)
+        neighbors = self._get_k_hop_neighbors(self._topology, max_hop)
+        effects = [sp.csr_matrix(alpha_k) for alpha_k in alpha]
+
+        # immigrants: every node has every event type at rate mu
+        n_nodes = self._topology.shape[0]
+        base = self._trigger_events(
+            np.repeat(np.arange(n_nodes), N), np.tile(mu, n_nodes),
+            np.tile(np.arange(N), n_nodes), np.zeros(n_nodes * N),
+            np.full(n_nodes * N, float(T)), beta)
+        generation = 0
+        yield base
+        while len(base['event']):
+            offspring = []
+            for k in range(max_hop + 1):
+                # (parent event, node at k hops) pairs
+                parent, node = self._expand(neighbors[k], base['node'])
+                # (pair, event type) with a nonzero intensity
+                pair, event = self._expand(effects[k], base['event'][parent])
+                parent, node = parent[pair], node[pair]
+                offspring.append(self._trigger_events(
+                    node, alpha[k, base['event'][parent], event], event,
+                    base['timestamp'][parent], base['duration'][parent],
+                    beta))
+            base = {name: np.concatenate([o[name] for o in offspring])
+                    for name in offspring[0]}
+            generation += 1
+            logging.info(f'Generation {generation}: '
+                         f'{len(base["event"])} events.')
+            yield base
+
+    @staticmethod
+    def _expand(matrix, rows):
+        """
+        Pair each entry of ``rows`` with the nonzero columns of its row in
+        the csr ``matrix``.
+
+        Returns
+        -------
+        out: tuple
+            index in ``rows`` and column of each pair.
+        """
+        counts = np.diff(matrix.indptr)[rows]
+        index = np.repeat(np.arange(len(rows)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                     counts)
+        columns = matrix.indices[matrix.indptr[rows][index] + offset]
+        return index, columns
 
     @staticmethod
-    def _trigger_events(intensity_vec, start_time, duration, beta):
-
-        events = []
-        for i, intensity in enumerate(intensity_vec):
-            if intensity:
-                trigger_time = start_time
-                while True:
-                    trigger_time = round(trigger_time + np.random.exponential(
-                        1 / intensity))
-                    if trigger_time > start_time + duration:
-                        break
-                    sub_duration = (np.max((0, np.random.exponential(beta)))).round()
-                    events.append((i, trigger_time, sub_duration))
-        return events
+    def _trigger_events(node, intensity, event, start_time, duration, beta):
+        """
+        Poisson processes of the given intensities, one per entry, whose
+        times rounded to integers fall in [start_time, start_time + duration].
+
+        Returns
+        -------
+        out: dict
+            columns event, timestamp, node and duration of the triggered
+            events, times and durations rounded to integers.
+        """
+        window = duration + 0.5
+        counts = np.random.poisson(intensity * window)
+        index = np.repeat(np.arange(len(counts)), counts)
+        timestamp = np.round(start_time[index] + window[index] *
+                             np.random.uniform(size=len(index)))
+        timestamp = timestamp.astype(np.int64)
+        return {'event': np.asarray(event, dtype=np.int64)[index],
+                'timestamp': timestamp,
+                'node': np.asarray(node, dtype=np.int64)[index],
+                'duration': np.round(np.random.exponential(beta, len(index)))}
 
     @staticmethod
-    def _get_k_hop_neighbors(G, node, k):
-        if k == 0:
-            return {node}
-        else:
-            return (set(nx.single_source_dijkstra_path_length(G, node, k).keys())
-                    - set(nx.single_source_dijkstra_path_length(
-                        G, node, k - 1).keys()))
+    def _get_k_hop_neighbors(topology, max_hop):
+        """
+        Nodes at exactly k hops of each node, for k = 0, ..., max_hop, by a
+        breadth-first search over the sparse adjacency matrix.
+
+        Returns
+        -------
+        out: list
+            [n_nodes, n_nodes] csr matrices, entry (i, j) of the k-th is 1
+            if the shortest path between i and j has k edges.
+        """
+        n_nodes = topology.shape[0]
+        reached = sp.identity(n_nodes, dtype=int, format='csr')
+        neighbors = [reached]
+        for _ in range(max_hop):
+            frontier = ((neighbors[-1] @ topology) > 0).astype(int)
+            frontier = (frontier - frontier.multiply(reached)).tocsr()
+            frontier.eliminate_zeros()
+            reached = ((reached + frontier) > 0).astype(int)
+            neighbors.append(frontier)
+        return neighbors
@@ -0,0 +1,347 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+
+
+META_FILE = 'meta.json'
+EVENT_COLUMNS = ('event', 'timestamp', 'node')
+CACHE_ENV = 'CASTLE_DATA_CACHE'
+# part of every cache key: bump it whenever the output of a simulator or
+# the layout of a cached dataset changes, so that entries written before
+# are rebuilt instead of being served silently
+CACHE_VERSION = 1
+
+
+def _to_json(value):
+
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def write_array(path, chunks, shape, dtype=np.float64):
+    """
+    Write row blocks into a memory-mapped ``.npy`` file.
+
+    Parameters
+    ----------
+    path: str
+        ``.npy`` file, overwritten if it exists.
+    chunks: iterable
+        (start, block) pairs, ``block`` being the rows from ``start``.
+    shape: tuple
+        shape of the whole array.
+    dtype: np.dtype, default: np.float64
+
+    Returns
+    -------
+    out: np.memmap
+        the written array, opened read-only.
+    """
+
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    for start, block in chunks:
+        out[start:start + block.shape[0]] = block
+    out.flush()
+    del out
+
+    return np.load(path, mmap_mode='r')
+
+
+def write_columns(directory, chunks, n_rows, dtypes):
+    """
+    Write blocks of columnar records, e.g. events, into one memory-mapped
+    ``.npy`` file per column.
+
+    Parameters
+    ----------
+    directory: str
+    chunks: iterable
+        dicts mapping each column name to an array, all of the same length.
+    n_rows: int
+        total number of rows of the chunks.
+    dtypes: dict
+        dtype of each column.
+
+    Returns
+    -------
+    out: dict
+        the written columns, opened read-only.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, f'{name}.npy') for name in dtypes}
+    columns = {name: np.lib.format.open_memmap(paths[name], mode='w+',
+                                               dtype=dtype, shape=(n_rows,))
+               for name, dtype in dtypes.items()}
+    start = 0
+    for chunk in chunks:
+        size = len(next(iter(chunk.values())))
+        for name, column in columns.items():
+            column[start:start + size] = chunk[name]
+        start += size
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+
+
+def write_grouped_columns(directory, chunks, key, n_groups, dtypes,
+                          chunk_size=100000):
+    """
+    Write blocks of columnar records into one memory-mapped ``.npy`` file
+    per column, with the rows grouped by the integer column ``key`` and in
+    order of arrival within a group, as a stable sort on ``key`` would.
+
+    The blocks are appended to temporary files as they come, so their
+    total length does not need to be known in advance, then a counting
+    sort scatters them ``chunk_size`` rows at a time into the final files:
+    at most one block and one chunk are held in memory.
+
+    Parameters
+    ----------
+    directory: str
+    chunks: iterable
+        dicts mapping each column name to an array, all of the same length.
+    key: str
+        name of the column whose values, in [0, n_groups), group the rows.
+    n_groups: int
+        number of groups.
+    dtypes: dict
+        dtype of each column, ``key`` included.
+    chunk_size: int, default: 100000
+        number of rows scattered at once.
+
+    Returns
+    -------
+    out: dict
+        the written columns, opened read-only.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    spills = {name: os.path.join(directory, f'{name}.tmp') for name in dtypes}
+    counts = np.zeros(n_groups, dtype=np.int64)
+    files = {name: open(path, 'wb') for name, path in spills.items()}
+    try:
+        for chunk in chunks:
+            for name, dtype in dtypes.items():
+                np.asarray(chunk[name], dtype=dtype).tofile(files[name])
+            counts += np.bincount(chunk[key], minlength=n_groups)
+    finally:
+        for f in files.values():
+            f.close()
+
+    n_rows = int(counts.sum())
+    paths = {name: os.path.join(directory, f'{name}.npy') for name in dtypes}
+    columns = {name: np.lib.format.open_memmap(paths[name], mode='w+',
+                                               dtype=dtype, shape=(n_rows,))
+               for name, dtype in dtypes.items()}
+    # next free row of each group
+    offsets = np.cumsum(counts) - counts
+    for start in range(0, n_rows, chunk_size):
+        size = min(chunk_size, n_rows - start)
+        block = {name: np.fromfile(spills[name], dtype=dtype, count=size,
+                                   offset=start * np.dtype(dtype).itemsize)
+                 for name, dtype in dtypes.items()}
+        order = np.argsort(block[key], kind='stable')
+        groups = block[key][order]
+        # rank of each row within its group in this block
+        rank = np.arange(size) - np.searchsorted(groups, groups)
+        rows = offsets[groups] + rank
+        for name, column in columns.items():
+            column[rows] = block[name][order]
+        offsets += np.bincount(groups, minlength=n_groups)
+    for column in columns.values():
+        column.flush()
+    del columns
+    for path in spills.values():
+        os.remove(path)
+
+    return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+
+
+def save_meta(directory, arrays=None, **meta):
+    """
+    Write the metadata of a simulation to ``directory/meta.json``, arrays
+    such as W and B are stored next to it as ``.npy`` files, or ``.npz``
+    files for scipy sparse matrices.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    meta = {key: _to_json(value) for key, value in meta.items()}
+    meta['arrays'] = {}
+    for name, array in (arrays or {}).items():
+        if sp.issparse(array):
+            file = f'{name}.npz'
+            sp.save_npz(os.path.join(directory, file), sp.csr_matrix(array))
+        else:
+            file = f'{name}.npy'
+            np.save(os.path.join(directory, file), np.asarray(array))
+        meta['arrays'][name] = file
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_meta(directory, mmap_mode='r') -> dict:
+    """Metadata written by ``save_meta``, with its arrays loaded."""
+
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    for name, file in meta.pop('arrays', {}).items():
+        path = os.path.join(directory, file)
+        if file.endswith('.npz'):
+            meta[name] = sp.load_npz(path)
+        else:
+            meta[name] = np.load(path, mmap_mode=mmap_mode)
+
+    return meta
+
+
+def load_simulation(directory, mmap_mode='r') -> tuple:
+    """
+    Open a simulation written by ``IIDSimulation`` or ``THPSimulation``
+    with ``output_dir``, without reading the data into memory.
+
+    Parameters
+    ----------
+    directory: str
+    mmap_mode: str, default: 'r'
+        see ``np.load``, 'c' gives writable copy-on-write arrays.
+
+    Returns
+    -------
+    out: tuple
+        data: np.memmap or dict
+            [n, d] samples, or the event columns of ``EVENT_COLUMNS``.
+        meta: dict
+    """
+
+    meta = load_meta(directory, mmap_mode=mmap_mode)
+    if meta.get('kind') == 'event':
+        data = {name: np.load(os.path.join(directory, f'{name}.npy'),
+                              mmap_mode=mmap_mode)
+                for name in EVENT_COLUMNS}
+    else:
+        data = np.load(os.path.join(directory, meta['data']),
+                       mmap_mode=mmap_mode)
+
+    return data, meta
+
+
+def open_dataset(path, mmap_mode='r') -> np.ndarray:
+    """Memory-map a ``.npy`` file or the samples of a simulation directory."""
+
+    if os.path.isdir(path):
+        return load_simulation(path, mmap_mode=mmap_mode)[0]
+
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def default_cache_dir() -> str:
+    """Dataset cache, ``$CASTLE_DATA_CACHE`` or ``~/.cache/castle``."""
+
+    return os.environ.get(CACHE_ENV,
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'castle'))
+
+
+def cache_key(**params) -> str:
+    """
+    Content address of a dataset, a hash of the parameters generating it
+    and of ``CACHE_VERSION``.
+    """
+
+    params = dict(params, cache_version=CACHE_VERSION)
+    text = json.dumps({key: _to_json(value) for key, value in params.items()},
+                      sort_keys=True)
+
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def cached(directory, build):
+    """
+    Directory of a cached dataset, built by ``build(tmp_directory)`` if it
+    does not exist.
+
+    The dataset is written to a temporary directory renamed once complete,
+    so concurrent builds never expose a partial dataset.
+    """
+
+    if os.path.isfile(os.path.join(directory, META_FILE)):
+        return directory
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        build(tmp)
+        os.rename(tmp, directory)
+    except OSError:
+        # built by another process in the meantime
+        if not os.path.isfile(os.path.join(directory, META_FILE)):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return directory
+
+
+def save_frame(directory, frame, arrays=None, **meta):
+    """
+    Write a DataFrame to one ``.npy`` file per column, text columns as
+    fixed-width strings, with its metadata.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for i, name in enumerate(frame.columns):
+        column = frame[name].to_numpy()
+        if column.dtype == object:
+            column = column.astype(str)
+        file = f'column_{i}.npy'
+        np.save(os.path.join(directory, file), column)
+        columns.append([str(name), file])
+    save_meta(directory, arrays=arrays, kind='frame', columns=columns, **meta)
+
+
+def load_frame(directory, mmap_mode='r') -> tuple:
+    """
+    DataFrame written by ``save_frame`` from its memory-mapped columns.
+
+    Returns
+    -------
+    out: tuple
+        data: pd.DataFrame
+        meta: dict
+    """
+
+    meta = load_meta(directory, mmap_mode=mmap_mode)
+    data = pd.DataFrame({name: np.load(os.path.join(directory, file),
+                                       mmap_mode=mmap_mode)
+                         for name, file in meta['columns']})
+
+    return data, meta
@@ -0,0 +1,184 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import random
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import pandas as pd
+
+from .simulator import DAG, IIDSimulation
+from .storage import (META_FILE, _to_json, cache_key, cached,
+                      default_cache_dir)
+
+
+GRAPH_TYPES = ('erdos_renyi', 'scale_free', 'bipartite', 'hierarchical',
+               'low_rank')
+SIMULATION_PARAMS = ('n', 'method', 'sem_type', 'noise_scale')
+
+
+def _expand_grid(grid, n_repeats):
+    """All the tasks of a grid, a dict or a list of dicts of value lists."""
+
+    if isinstance(grid, dict):
+        grid = [grid]
+    tasks = []
+    for sub_grid in grid:
+        sub_grid = dict(sub_grid)
+        if 'seed' not in sub_grid:
+            sub_grid['seed'] = range(n_repeats)
+        names = sorted(sub_grid)
+        for values in product(*(sub_grid[name] for name in names)):
+            task = dict(zip(names, values))
+            if task.get('graph') not in GRAPH_TYPES:
+                raise ValueError(f"graph must be one of {list(GRAPH_TYPES)}, "
+                                 f"but got {task.get('graph')}.")
+            tasks.append(task)
+
+    return tasks
+
+
+def _task_generator(task) -> np.random.Generator:
+    """
+    Random generator of a task, seeded by its parameters, so a dataset
+    does not depend on the rest of the suite or on the worker running it.
+    """
+
+    key = cache_key(**task)
+
+    return np.random.default_rng([int(key[i:i + 8], 16)
+                                  for i in range(0, len(key), 8)])
+
+
+def _simulate_task(task, cache_dir):
+    """Simulate one dataset of a suite into the cache, run in a worker."""
+
+    def build(output_dir):
+        rng = _task_generator(task)
+        graph_seed, simulation_seed = rng.integers(2 ** 31, size=2)
+        graph_params = {name: value for name, value in task.items()
+                        if name not in SIMULATION_PARAMS + ('graph', 'seed')}
+        W = getattr(DAG, task['graph'])(seed=int(graph_seed), **graph_params)
+        IIDSimulation(W,
+                      output_dir=output_dir, seed=int(simulation_seed),
+                      **{name: task[name] for name in SIMULATION_PARAMS
+                         if name in task})
+
+    key = cache_key(name='IIDSimulation', **task)
+    path = cached(os.path.join(cache_dir, key), build)
+
+    return dict(task, key=key, path=path)
+
+
+def simulate_suite(grid, n_repeats=1, n_jobs=None, cache_dir=None,
+                   manifest=None) -> pd.DataFrame:
+    """
+    Simulate the datasets of a parameter grid on a process pool.
+
+    Each dataset is a DAG generated by ``DAG.<graph>`` and samples of
+    ``IIDSimulation``, written to the dataset cache under a key derived
+    from its parameters, so datasets already simulated by a previous suite
+    are reused. Every task has its own ``np.random.Generator`` seeded from
+    its parameters, from which the seeds of the graph and of the samples
+    are drawn: the datasets are reproducible and independent of the
+    scheduling of the tasks, and the global random state of the caller is
+    left untouched.
+
+    Parameters
+    ----------
+    grid: dict or list of dict
+        lists of values of each parameter, all the combinations are
+        simulated. 'graph' is one of ``GRAPH_TYPES``; 'n', 'method',
+        'sem_type' and 'noise_scale' are passed to ``IIDSimulation``, the
+        other parameters, e.g. 'n_nodes', 'n_edges' or 'weight_range', to
+        the graph generator. 'seed' is the replicate, defaults to
+        ``range(n_repeats)``.
+    n_repeats: int, default: 1
+        number of replicates of each combination if 'seed' is not in grid.
+    n_jobs: int, default: None
+        number of worker processes, defaults to the number of CPUs, 1
+        simulates in the current process.
+    cache_dir: str, default: None
+        dataset cache, see ``castle.datasets.storage.default_cache_dir``.
+    manifest: str, default: None
+        path of the JSON manifest, defaults to a file of ``cache_dir``
+        named after the tasks of the suite.
+
+    Returns
+    -------
+    out: pd.DataFrame
+        the manifest, one row per dataset with its parameters, key and
+        path, the path can be opened by ``load_simulation``.
+
+    Examples
+    --------
+    >>> from castle.datasets import simulate_suite, load_simulation
+    >>> suite = simulate_suite({'graph': ['erdos_renyi', 'scale_free'],
+    ...                         'n_nodes': [10, 20], 'n_edges': [20],
+    ...                         'weight_range': [(0.5, 2.0)],
+    ...                         'n': [2000], 'sem_type': ['gauss', 'exp']},
+    ...                        n_repeats=5, n_jobs=4)
+    >>> X, meta = load_simulation(suite.path[0])
+    """
+
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    tasks = _expand_grid(grid, n_repeats)
+    # datasets already in the cache are not sent to the workers
+    records = [None] * len(tasks)
+    missing = []
+    for i, task in enumerate(tasks):
+        key = cache_key(name='IIDSimulation', **task)
+        path = os.path.join(cache_dir, key)
+        if os.path.isfile(os.path.join(path, META_FILE)):
+            records[i] = dict(task, key=key, path=path)
+        else:
+            missing.append(i)
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(missing) <= 1:
+        # the generators reseed the global random state, which belongs to
+        # the caller when the tasks run in this process
+        random_state = random.getstate()
+        np_random_state = np.random.get_state()
+        try:
+            results = [_simulate_task(tasks[i], cache_dir) for i in missing]
+        finally:
+            random.setstate(random_state)
+            np.random.set_state(np_random_state)
+    else:
+        with ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(missing)),
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(_simulate_task,
+                                        [tasks[i] for i in missing],
+                                        [cache_dir] * len(missing)))
+    for i, record in zip(missing, results):
+        records[i] = record
+    logging.info(f'Simulated {len(missing)} datasets, '
+                 f'{len(tasks) - len(missing)} found in {cache_dir}.')
+
+    if manifest is None:
+        suite_key = cache_key(keys=[record['key'] for record in records])
+        manifest = os.path.join(cache_dir, f'suite-{suite_key}.json')
+    with open(manifest, 'w') as f:
+        json.dump([{name: _to_json(value) for name, value in record.items()}
+                   for record in records], f, indent=2)
+
+    return pd.DataFrame(records)
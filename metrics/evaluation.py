@@ -13,9 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
 import numpy as np
-import pandas as pd
+from scipy import sparse as sp
 
 
 class MetricsDAG(object):
@@ -37,24 +36,35 @@ class MetricsDAG(object):
     F1: 2*(recall*precision)/(recall+precision)
     gscore: max(0, (TP-FP))/(TP+FN), A score ranges from 0 to 1
 
+    A stack of K estimates is evaluated at once, each metric is then an
+    array of K values. Graphs given as scipy sparse matrices are evaluated
+    from their edge lists, without any dense [d, d] array, e.g. for
+    d = 10^4 nodes.
+
     Parameters
     ----------
-    B_est: np.ndarray
-        [d, d] estimate, {0, 1, -1}, -1 is undirected edge in CPDAG.
-    B_true: np.ndarray
-        [d, d] ground truth graph, {0, 1}.
+    B_est: np.ndarray or scipy.sparse matrix
+        [d, d] or [K, d, d] estimate, {0, 1, -1}, -1 is undirected edge in
+        CPDAG, or a sparse [d, d] matrix or a list of them.
+    B_true: np.ndarray or scipy.sparse matrix
+        [d, d] ground truth graph, {0, 1}, or [K, d, d] with one graph per
+        estimate.
     """
 
     def __init__(self, B_est, B_true):
-        
+
+        if isinstance(B_est, (list, tuple)) or sp.issparse(B_est):
+            self.metrics = MetricsDAG._count_accuracy_sparse(B_est, B_true)
+            return
+
         if not isinstance(B_est, np.ndarray):
             raise TypeError("Input B_est is not numpy.ndarray!")
 
         if not isinstance(B_true, np.ndarray):
             raise TypeError("Input B_true is not numpy.ndarray!")
 
-        self.B_est = copy.deepcopy(B_est)
-        self.B_true = copy.deepcopy(B_true)
+        self.B_est = np.array(B_est)
+        self.B_true = np.array(B_true)
 
         self.metrics = MetricsDAG._count_accuracy(self.B_est, self.B_true)
 
@@ -64,9 +74,10 @@ class MetricsDAG(object):
         Parameters
         ----------
         B_est: np.ndarray
-            [d, d] estimate, {0, 1, -1}, -1 is undirected edge in CPDAG.
+            [d, d] or [K, d, d] estimate, {0, 1, -1}, -1 is undirected edge
+            in CPDAG.
         B_true: np.ndarray
-            [d, d] ground truth graph, {0, 1}.
+            [d, d] or [K, d, d] ground truth graph, {0, 1}.
         decimal_num: int
             Result decimal numbers.
 
@@ -91,83 +102,232 @@ class MetricsDAG(object):
                 2*(recall*precision)/(recall+precision)
             gscore: float
                 max(0, (TP-FP))/(TP+FN), A score ranges from 0 to 1
+            each an array of K values for a [K, d, d] B_est.
         """
 
+        batch = B_est.ndim == 3
+        B_est = np.array(B_est, ndmin=3)
+        B_true = np.broadcast_to(np.array(B_true, ndmin=3), B_est.shape).copy()
+        d = B_true.shape[-1]
+        T = lambda a: np.swapaxes(a, -1, -2)
+        total = lambda a: a.sum(axis=(-2, -1))
+
         # trans diagonal element into 0
-        for i in range(len(B_est)):
-            if B_est[i, i] == 1:
-                B_est[i, i] = 0
-            if B_true[i, i] == 1:
-                B_true[i, i] = 0
+        diag = np.eye(d, dtype=bool)
+        B_est[(B_est == 1) & diag] = 0
+        B_true[(B_true == 1) & diag] = 0
 
         # trans cpdag [0, 1] to [-1, 0, 1], -1 is undirected edge in CPDAG
-        for i in range(len(B_est)):
-            for j in range(len(B_est[i])):
-                if B_est[i, j] == B_est[j, i] == 1:
-                    B_est[i, j] = -1
-                    B_est[j, i] = 0
-        
-        if (B_est == -1).any():  # cpdag
-            if not ((B_est == 0) | (B_est == 1) | (B_est == -1)).all():
-                raise ValueError('B_est should take value in {0,1,-1}')
-            if ((B_est == -1) & (B_est.T == -1)).any():
-                raise ValueError('undirected edge should only appear once')
-        else:  # dag
-            if not ((B_est == 0) | (B_est == 1)).all():
-                raise ValueError('B_est should take value in {0,1}')
-            # if not is_dag(B_est):
-            #     raise ValueError('B_est should be a DAG')
-        d = B_true.shape[0]
-        
-        # linear index of nonzeros
-        pred_und = np.flatnonzero(B_est == -1)
-        pred = np.flatnonzero(B_est == 1)
-        cond = np.flatnonzero(B_true)
-        cond_reversed = np.flatnonzero(B_true.T)
-        cond_skeleton = np.concatenate([cond, cond_reversed])
-        # true pos
-        true_pos = np.intersect1d(pred, cond, assume_unique=True)
-        # treat undirected edge favorably
-        true_pos_und = np.intersect1d(pred_und, cond_skeleton, assume_unique=True)
-        true_pos = np.concatenate([true_pos, true_pos_und])
-        # false pos
-        false_pos = np.setdiff1d(pred, cond_skeleton, assume_unique=True)
-        false_pos_und = np.setdiff1d(pred_und, cond_skeleton, assume_unique=True)
-        false_pos = np.concatenate([false_pos, false_pos_und])
-        # reverse
-        extra = np.setdiff1d(pred, cond, assume_unique=True)
-        reverse = np.intersect1d(extra, cond_reversed, assume_unique=True)
-        # compute ratio
-        pred_size = len(pred) + len(pred_und)
-        cond_neg_size = 0.5 * d * (d - 1) - len(cond)
-        fdr = float(len(reverse) + len(false_pos)) / max(pred_size, 1)
-        tpr = float(len(true_pos)) / max(len(cond), 1)
-        fpr = float(len(reverse) + len(false_pos)) / max(cond_neg_size, 1)
+        upper = np.triu(np.ones((d, d), dtype=bool), k=1)
+        symmetric = (B_est == 1) & (T(B_est) == 1)
+        B_est[symmetric & upper] = -1
+        B_est[symmetric & upper.T] = 0
+
+        MetricsDAG._check_estimate(B_est)
+
+        pred_und = B_est == -1
+        pred = B_est == 1
+        cond = B_true != 0
+        cond_reversed = T(cond)
+        cond_skeleton = cond | cond_reversed
         # structural hamming distance
-        pred_lower = np.flatnonzero(np.tril(B_est + B_est.T))
-        cond_lower = np.flatnonzero(np.tril(B_true + B_true.T))
-        extra_lower = np.setdiff1d(pred_lower, cond_lower, assume_unique=True)
-        missing_lower = np.setdiff1d(cond_lower, pred_lower, assume_unique=True)
-        shd = len(extra_lower) + len(missing_lower) + len(reverse)
+        lower = np.tril(np.ones((d, d), dtype=bool))
+        pred_lower = ((B_est + T(B_est)) != 0) & lower
+        cond_lower = ((B_true + T(B_true)) != 0) & lower
+        counts = {
+            # treat undirected edge favorably
+            'true_pos': total(pred & cond) + total(pred_und & cond_skeleton),
+            'false_pos': total(pred_und & ~cond_skeleton)
+                         + total(pred & ~cond_skeleton),
+            'reverse': total(pred & ~cond & cond_reversed),
+            'pred_size': total(pred) + total(pred_und),
+            'cond_size': total(cond),
+            'extra_lower': total(pred_lower & ~cond_lower),
+            'missing_lower': total(cond_lower & ~pred_lower),
+        }
 
         # trans cpdag [-1, 0, 1] to [0, 1], -1 is undirected edge in CPDAG
-        for i in range(len(B_est)):
-            for j in range(len(B_est[i])):
-                if B_est[i, j] == -1:
-                    B_est[i, j] = 1
-                    B_est[j, i] = 1
+        W_p = np.where(pred_und | T(pred_und), 1, B_est)
+
+        gscore = MetricsDAG._cal_gscore(W_p, B_true)
+        precision, recall, F1 = MetricsDAG._cal_precision_recall(W_p, B_true)
+
+        return MetricsDAG._metrics(counts, d, gscore, precision, recall, F1,
+                                   decimal_num, batch)
+
+    @staticmethod
+    def _count_accuracy_sparse(B_est, B_true, decimal_num=4):
+        """
+        Metrics of sparse graphs, from their sorted edge keys i * d + j.
 
-        W_p = pd.DataFrame(B_est)
-        W_true = pd.DataFrame(B_true)
+        Parameters
+        ----------
+        B_est: scipy.sparse matrix or list
+            [d, d] estimate, {0, 1, -1}, -1 is undirected edge in CPDAG, or a
+            list of K estimates.
+        B_true: scipy.sparse matrix, np.ndarray or list
+            [d, d] ground truth graph, {0, 1}, or a list of K graphs.
+        decimal_num: int
+            Result decimal numbers.
+
+        Return
+        ------
+        metrics: dict
+            see ``_count_accuracy``.
+        """
 
-        gscore = MetricsDAG._cal_gscore(W_p, W_true)
-        precision, recall, F1 = MetricsDAG._cal_precision_recall(W_p, W_true)
+        batch = isinstance(B_est, (list, tuple))
+        estimates = list(B_est) if batch else [B_est]
+        if isinstance(B_true, (list, tuple)):
+            truths = list(B_true)
+        else:
+            truths = [B_true] * len(estimates)
+        if len(truths) != len(estimates):
+            raise ValueError(f'Expected {len(estimates)} true graphs, '
+                             f'but got {len(truths)}.')
+        d = estimates[0].shape[0]
+        results = [MetricsDAG._sparse_counts(est, true)
+                   for est, true in zip(estimates, truths)]
+        counts = {name: np.array([r[0][name] for r in results])
+                  for name in results[0][0]}
+        tp, fn_r, num_pred, num_true = map(np.array,
+                                           zip(*[r[1] for r in results]))
+        assert np.all(num_true != 0)
+        gscore = np.maximum(tp - fn_r, 0) / num_true
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = tp / num_pred
+            recall = tp / num_true
+            F1 = 2*(recall*precision)/(recall+precision)
 
-        mt = {'fdr': fdr, 'tpr': tpr, 'fpr': fpr, 'shd': shd, 'nnz': pred_size, 
-              'precision': precision, 'recall': recall, 'F1': F1, 'gscore': gscore}
+        return MetricsDAG._metrics(counts, d, gscore, precision, recall, F1,
+                                   decimal_num, batch)
+
+    @staticmethod
+    def _sparse_counts(B_est, B_true):
+        """
+        Edge counts of one sparse estimate, see ``_count_accuracy``.
+
+        Returns
+        -------
+        out: tuple
+            counts: dict
+                edge counts of ``_metrics``.
+            scores: tuple
+                TP, FP + reverse, number of edges of the estimate with
+                undirected edges in both directions, and of the true graph,
+                as in ``_cal_gscore`` and ``_cal_precision_recall``.
+        """
+
+        d = B_est.shape[0]
+
+        def entries(B):
+            # trans diagonal element into 0
+            B = sp.coo_matrix(B)
+            B.sum_duplicates()
+            B.eliminate_zeros()
+            keep = ~((B.row == B.col) & (B.data == 1))
+            return (B.row[keep].astype(np.int64), B.col[keep].astype(np.int64),
+                    B.data[keep])
+
+        def lower_keys(row, col, data):
+            # nonzero entries of tril(B + B.T)
+            keys, inverse = np.unique(np.maximum(row, col) * d
+                                      + np.minimum(row, col),
+                                      return_inverse=True)
+            sums = np.bincount(inverse, weights=data * (1 + (row == col)),
+                               minlength=len(keys))
+            return keys[sums != 0]
+
+        row, col, data = entries(B_est)
+        true_row, true_col, true_data = entries(B_true)
+        has_und = (data == -1).any()
+        if not np.isin(data, (1, -1)).all():
+            raise ValueError('B_est should take value in {0,1,-1}' if has_und
+                             else 'B_est should take value in {0,1}')
+
+        # trans cpdag [0, 1] to [-1, 0, 1], -1 is undirected edge in CPDAG
+        directed = data == 1
+        pred = row[directed] * d + col[directed]
+        symmetric = np.isin(pred, col[directed] * d + row[directed])
+        upper = row[directed] < col[directed]
+        pred_und = np.union1d(row[~directed] * d + col[~directed],
+                              pred[symmetric & upper])
+        pred = np.unique(pred[~symmetric])
+        transpose = lambda keys: np.sort(keys % d * d + keys // d)
+        pred_und_reversed = transpose(pred_und)
+        if np.isin(pred_und, pred_und_reversed, assume_unique=True).any():
+            raise ValueError('undirected edge should only appear once')
+
+        cond = np.unique(true_row * d + true_col)
+        cond_reversed = transpose(cond)
+        cond_skeleton = np.union1d(cond, cond_reversed)
+        intersect = lambda a, b: np.intersect1d(a, b, assume_unique=True)
+        setdiff = lambda a, b: np.setdiff1d(a, b, assume_unique=True)
+        # structural hamming distance
+        est_row = np.concatenate([pred // d, pred_und // d])
+        est_col = np.concatenate([pred % d, pred_und % d])
+        est_data = np.concatenate([np.ones(len(pred)), -np.ones(len(pred_und))])
+        pred_lower = lower_keys(est_row, est_col, est_data)
+        cond_lower = lower_keys(true_row, true_col, true_data)
+        counts = {
+            # treat undirected edge favorably
+            'true_pos': len(intersect(pred, cond))
+                        + len(intersect(pred_und, cond_skeleton)),
+            'false_pos': len(setdiff(pred_und, cond_skeleton))
+                         + len(setdiff(pred, cond_skeleton)),
+            'reverse': len(intersect(setdiff(pred, cond), cond_reversed)),
+            'pred_size': len(pred) + len(pred_und),
+            'cond_size': len(cond),
+            'extra_lower': len(setdiff(pred_lower, cond_lower)),
+            'missing_lower': len(setdiff(cond_lower, pred_lower)),
+        }
+
+        # trans cpdag [-1, 0, 1] to [0, 1], -1 is undirected edge in CPDAG
+        W_p = np.unique(np.concatenate([pred, pred_und, pred_und_reversed]))
+        true_keys = true_row * d + true_col
+        support = np.union1d(W_p, true_keys)
+        w_p = np.isin(support, W_p, assume_unique=True).astype(float)
+        w_true = np.zeros(len(support))
+        w_true[np.searchsorted(support, true_keys)] = true_data
+        scores = (np.sum(w_p + w_true == 2), np.sum(w_p - w_true == 1),
+                  len(W_p), true_data.sum())
+
+        return counts, scores
+
+    @staticmethod
+    def _check_estimate(B_est):
+        """B_est in {0, 1, -1} with each undirected edge stored once"""
+
+        has_und = (B_est == -1).any(axis=(-2, -1))
+        valid = ((B_est == 0) | (B_est == 1) | (B_est == -1)).all(axis=(-2, -1))
+        if not valid[has_und].all():
+            raise ValueError('B_est should take value in {0,1,-1}')
+        if ((B_est == -1) & (np.swapaxes(B_est, -1, -2) == -1)).any():
+            raise ValueError('undirected edge should only appear once')
+        if not valid[~has_und].all():
+            raise ValueError('B_est should take value in {0,1}')
+
+    @staticmethod
+    def _metrics(counts, d, gscore, precision, recall, F1, decimal_num, batch):
+        """Metrics of the edge counts, arrays of K values if batch."""
+
+        false_pos = counts['reverse'] + counts['false_pos']
+        cond_neg_size = 0.5 * d * (d - 1) - counts['cond_size']
+        mt = {'fdr': false_pos / np.maximum(counts['pred_size'], 1),
+              'tpr': counts['true_pos'] / np.maximum(counts['cond_size'], 1),
+              'fpr': false_pos / np.maximum(cond_neg_size, 1),
+              'shd': counts['extra_lower'] + counts['missing_lower']
+                     + counts['reverse'],
+              'nnz': counts['pred_size'],
+              'precision': precision, 'recall': recall, 'F1': F1,
+              'gscore': gscore}
         for i in mt:
-            mt[i] = round(mt[i], decimal_num)
-        
+            mt[i] = np.round(np.asarray(mt[i], dtype=float), decimal_num)
+            if i in ('shd', 'nnz'):
+                mt[i] = mt[i].astype(int)
+            if not batch:
+                mt[i] = mt[i][0].item()
+
         return mt
 
     @staticmethod
@@ -175,26 +335,28 @@ class MetricsDAG(object):
         """
         Parameters
         ----------
-        W_p: pd.DataDrame
-            [d, d] estimate, {0, 1, -1}, -1 is undirected edge in CPDAG.
-        W_true: pd.DataDrame
-            [d, d] ground truth graph, {0, 1}.
+        W_p: np.ndarray
+            [d, d] or [K, d, d] estimate, {0, 1}, undirected edges in both
+            directions.
+        W_true: np.ndarray
+            [d, d] or [K, d, d] ground truth graph, {0, 1}.
         
         Return
         ------
-        score: float
+        score: float or np.ndarray
             max(0, (TP-FP))/(TP+FN), A score ranges from 0 to 1
         """
-        
-        num_true = W_true.sum(axis=1).sum()
-        assert num_true!=0
-        
+
+        axis = (-2, -1)
+        num_true = W_true.sum(axis=axis)
+        assert np.all(num_true != 0)
+
         # true_positives
-        num_tp =  (W_p + W_true).applymap(lambda elem:1 if elem==2 else 0).sum(axis=1).sum()
+        num_tp = ((W_p + W_true) == 2).sum(axis=axis)
         # False Positives + Reversed Edges
-        num_fn_r = (W_p - W_true).applymap(lambda elem:1 if elem==1 else 0).sum(axis=1).sum()
-        score = np.max((num_tp-num_fn_r,0))/num_true
-        
+        num_fn_r = ((W_p - W_true) == 1).sum(axis=axis)
+        score = np.maximum(num_tp - num_fn_r, 0) / num_true
+
         return score
 
     @staticmethod
@@ -202,27 +364,30 @@ class MetricsDAG(object):
         """
         Parameters
         ----------
-        W_p: pd.DataDrame
-            [d, d] estimate, {0, 1, -1}, -1 is undirected edge in CPDAG.
-        W_true: pd.DataDrame
-            [d, d] ground truth graph, {0, 1}.
+        W_p: np.ndarray
+            [d, d] or [K, d, d] estimate, {0, 1}, undirected edges in both
+            directions.
+        W_true: np.ndarray
+            [d, d] or [K, d, d] ground truth graph, {0, 1}.
         
         Return
         ------
-        precision: float
+        precision: float or np.ndarray
             TP/(TP + FP)
-        recall: float
+        recall: float or np.ndarray
             TP/(TP + FN)
-        F1: float
+        F1: float or np.ndarray
             2*(recall*precision)/(recall+precision)
         """
 
-        assert(W_p.shape==W_true.shape and W_p.shape[0]==W_p.shape[1])
-        TP = (W_p + W_true).applymap(lambda elem:1 if elem==2 else 0).sum(axis=1).sum()
-        TP_FP = W_p.sum(axis=1).sum()
-        TP_FN = W_true.sum(axis=1).sum()
-        precision = TP/TP_FP
-        recall = TP/TP_FN
-        F1 = 2*(recall*precision)/(recall+precision)
-        
+        assert(W_p.shape==W_true.shape and W_p.shape[-2]==W_p.shape[-1])
+        axis = (-2, -1)
+        TP = ((W_p + W_true) == 2).sum(axis=axis)
+        TP_FP = W_p.sum(axis=axis)
+        TP_FN = W_true.sum(axis=axis)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = TP / TP_FP
+            recall = TP / TP_FN
+            F1 = 2*(recall*precision)/(recall+precision)
+
         return precision, recall, F1
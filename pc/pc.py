@@ -0,0 +1,286 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import combinations
+import numpy as np
+
+from castle.common import BaseLearner, Tensor
+from castle.common.independence_tests import (CITest, DiscreteCITester,
+                                               GaussCITester)
+
+
+_WORKER = {}
+# CITest methods of the power divergence family and their statistic
+_DISCRETE_TESTS = {'g2_test': 'log-likelihood',
+                   'chi2_test': 'pearson',
+                   'freeman_tukey': 'freeman-tukey',
+                   'modify_log_likelihood': 'mod-log-likelihood',
+                   'neyman': 'neyman',
+                   'cressie_read': 'cressie-read'}
+
+
+def _init_worker(data, ci_test):
+    """Keep the dataset and the test in each worker process."""
+
+    _WORKER['data'] = data
+    _WORKER['ci_test'] = ci_test
+
+
+def _test_edge(x, y, candidates, level, alpha, data=None, ci_test=None):
+    """
+    Search a separating set of size ``level`` for the edge x - y among
+    subsets of each candidate set, stop at the first independence.
+
+    Returns (x, y, sepset), sepset is None if none was found.
+    """
+
+    if data is None:
+        data, ci_test = _WORKER['data'], _WORKER['ci_test']
+    tested = set()
+    for neighbors in candidates:
+        for z in combinations(neighbors, level):
+            if z in tested:
+                continue
+            tested.add(z)
+            _, _, p_value = ci_test(data, x, y, list(z))
+            if p_value >= alpha:
+                return x, y, z
+
+    return x, y, None
+
+
+def orient(skeleton, sepsets):
+    """
+    Orient a skeleton into a CPDAG with the v-structures found from
+    ``sepsets`` and Meek's rules R1-R3.
+
+    Parameters
+    ----------
+    skeleton: np.ndarray
+        [d, d] symmetric adjacency matrix.
+    sepsets: dict
+        separating set of each removed edge, keyed by (i, j) with i < j.
+
+    Returns
+    -------
+    out: np.ndarray
+        [d, d] CPDAG, G[i, j] = G[j, i] = 1 is the undirected edge i - j and
+        G[i, j] = 1, G[j, i] = 0 is the directed edge i -> j.
+    """
+
+    G = skeleton.astype(int).copy()
+    d = G.shape[0]
+    adjacent = (G + G.T) > 0
+
+    # v-structures x -> z <- y
+    for z in range(d):
+        neighbors = np.flatnonzero(adjacent[z])
+        for x, y in combinations(neighbors, 2):
+            if adjacent[x, y] or z in sepsets.get((x, y), ()):
+                continue
+            if G[x, z] and G[y, z]:  # keep existing orientations
+                G[z, x] = 0
+                G[z, y] = 0
+
+    def undirected(i, j):
+        return G[i, j] == 1 and G[j, i] == 1
+
+    def directed(i, j):
+        return G[i, j] == 1 and G[j, i] == 0
+
+    changed = True
+    while changed:
+        changed = False
+        for a, b in zip(*np.nonzero(np.triu(G & G.T))):
+            for i, j in ((a, b), (b, a)):
+                if not undirected(i, j):
+                    continue
+                others = [k for k in range(d) if k != i and k != j]
+                # R1: k -> i - j and k, j non adjacent
+                r1 = any(directed(k, i) and not adjacent[k, j] for k in others)
+                # R2: i -> k -> j
+                r2 = any(directed(i, k) and directed(k, j) for k in others)
+                # R3: i - k -> j, i - l -> j, k and l non adjacent
+                parents = [k for k in others
+                           if undirected(i, k) and directed(k, j)]
+                r3 = any(not adjacent[k, l]
+                         for k, l in combinations(parents, 2))
+                if r1 or r2 or r3:
+                    G[j, i] = 0
+                    changed = True
+                    break
+
+    return G
+
+
+class PC(BaseLearner):
+    """
+    PC algorithm with a parallel level-wise skeleton search.
+
+    The skeleton is searched by conditioning set size (PC-stable): at each
+    level the adjacencies are frozen and the tests of all remaining edges
+    are scheduled at once on a thread or process pool. The separating sets
+    found are kept in a cache shared by the orientation phase, which adds
+    the v-structures and applies Meek's rules.
+
+    References
+    ----------
+    Spirtes, P., Glymour, C. N., & Scheines, R. (2000). Causation,
+    prediction, and search.
+
+    Colombo, D., & Maathuis, M. H. (2014). Order-independent
+    constraint-based causal structure learning. JMLR, 15, 3741-3782.
+
+    Parameters
+    ----------
+    alpha: float, default: 0.05
+        significance level of the independence tests.
+    ci_test: str or callable, default: 'gauss'
+        name of a ``CITest`` method, e.g. 'gauss', 'g2_test' or 'chi2_test',
+        or a callable with the same interface such as a ``GaussCITester``.
+        'gauss' uses a ``GaussCITester`` and the power divergence tests,
+        e.g. 'g2_test', a ``DiscreteCITester`` built on the data.
+    max_level: int, default: None
+        maximum size of the conditioning sets, None means unbounded.
+    n_jobs: int, default: 1
+        number of workers, 1 runs the tests in the current thread.
+    parallel: str, default: 'thread'
+        'thread' or 'process' pool.
+
+    Attributes
+    ----------
+    skeleton: np.ndarray
+        [d, d] adjacency matrix of the skeleton.
+    sepsets: dict
+        separating set of each removed edge, keyed by (i, j) with i < j.
+    causal_matrix : numpy.ndarray
+        CPDAG in {0, 1, -1}, -1 is an undirected edge, stored once with
+        i < j, as expected by ``MetricsDAG``.
+
+    Examples
+    --------
+    >>> from castle.datasets import load_dataset
+    >>> from castle.metrics import MetricsDAG
+    >>> X, true_dag, _ = load_dataset('IID_Test')
+    >>> n = PC(n_jobs=4)
+    >>> n.learn(X)
+    >>> met = MetricsDAG(n.causal_matrix, true_dag)
+    >>> print(met.metrics)
+    """
+
+    def __init__(self, alpha=0.05, ci_test='gauss', max_level=None, n_jobs=1,
+                 parallel='thread'):
+        super().__init__()
+        if parallel not in ('thread', 'process'):
+            raise ValueError(f"parallel must be one of ['thread', 'process'], "
+                             f"but got {parallel}.")
+        self.alpha = alpha
+        self.ci_test = ci_test
+        self.max_level = max_level
+        self.n_jobs = n_jobs
+        self.parallel = parallel
+        self.skeleton = None
+        self.sepsets = None
+
+    def learn(self, data, columns=None, **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        data: castle.Tensor or numpy.ndarray
+            The castle.Tensor or numpy.ndarray format data you want to learn.
+        columns : Index or array-like
+            Column labels to use for resulting tensor. Will default to
+            RangeIndex (0, 1, 2, ..., n) if no column labels are provided.
+        """
+
+        X = Tensor(data, columns=columns)
+        dataset = np.asarray(X)
+        ci_test = self.ci_test
+        if ci_test == 'gauss':
+            ci_test = GaussCITester(dataset)
+        elif ci_test in _DISCRETE_TESTS:
+            ci_test = DiscreteCITester(dataset,
+                                       lambda_=_DISCRETE_TESTS[ci_test])
+        elif isinstance(ci_test, str):
+            if not hasattr(CITest, ci_test):
+                raise ValueError(f'Invalid ci_test, expected a method of '
+                                 f'CITest, but got {ci_test}.')
+            ci_test = getattr(CITest, ci_test)
+
+        self.skeleton, self.sepsets = self._find_skeleton(dataset, ci_test)
+        cpdag = orient(self.skeleton, self.sepsets)
+        undirected = np.triu(cpdag & cpdag.T, k=1) > 0
+        cpdag[undirected | undirected.T] = 0
+        cpdag[undirected] = -1
+        self.causal_matrix = Tensor(cpdag, index=X.columns, columns=X.columns)
+
+    def _find_skeleton(self, data, ci_test) -> tuple:
+        """Level-wise skeleton search, all edge tests of a level in parallel"""
+
+        d = data.shape[1]
+        skeleton = np.ones((d, d), dtype=int) - np.eye(d, dtype=int)
+        sepsets = {}
+        executor = None
+        if self.n_jobs is not None and self.n_jobs > 1:
+            if self.parallel == 'process':
+                executor = ProcessPoolExecutor(
+                    max_workers=self.n_jobs,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(data, ci_test))
+            else:
+                executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+        try:
+            level = 0
+            while self.max_level is None or level <= self.max_level:
+                tasks = []
+                for x, y in zip(*np.nonzero(np.triu(skeleton, k=1))):
+                    candidates = [tuple(np.flatnonzero(skeleton[i] & (np.arange(d) != j)))
+                                  for i, j in ((x, y), (y, x))]
+                    candidates = [c for c in candidates if len(c) >= level]
+                    if candidates:
+                        tasks.append((int(x), int(y), candidates))
+                if not tasks:
+                    break
+                if executor is None:
+                    results = [_test_edge(x, y, c, level, self.alpha, data,
+                                          ci_test) for x, y, c in tasks]
+                elif self.parallel == 'process':
+                    results = executor.map(
+                        _test_edge, *zip(*tasks), [level] * len(tasks),
+                        [self.alpha] * len(tasks),
+                        chunksize=max(1, len(tasks) // (4 * self.n_jobs)))
+                else:
+                    results = executor.map(
+                        lambda task: _test_edge(*task, level, self.alpha,
+                                                data, ci_test), tasks)
+                removed = 0
+                for x, y, z in results:
+                    if z is not None:
+                        skeleton[x, y] = skeleton[y, x] = 0
+                        sepsets[(x, y)] = z
+                        removed += 1
+                logging.info(f'[level {level}] {len(tasks)} edges tested, '
+                             f'{removed} removed.')
+                level += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return skeleton, sepsets
@@ -0,0 +1,49 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from castle.datasets import storage
+from castle.datasets.builtin_dataset import IID_Test, THP_Test
+
+
+@pytest.mark.parametrize('dataset', [IID_Test, THP_Test])
+def test_simulated_dataset_is_reproducible(dataset, tmp_path):
+    """Two builds into empty cache directories give the same dataset."""
+
+    first, second = dataset(), dataset()
+    first.load(cache_dir=str(tmp_path / 'first'))
+    second.load(cache_dir=str(tmp_path / 'second'))
+
+    np.testing.assert_array_equal(first.true_graph_matrix,
+                                  second.true_graph_matrix)
+    if first.topology_matrix is not None:
+        np.testing.assert_array_equal(first.topology_matrix,
+                                      second.topology_matrix)
+    pd.testing.assert_frame_equal(pd.DataFrame(first.data),
+                                  pd.DataFrame(second.data))
+
+
+def test_cache_version_is_part_of_the_key(tmp_path, monkeypatch):
+    """Entries written by another cache version are not served."""
+
+    IID_Test().load(cache_dir=str(tmp_path))
+    monkeypatch.setattr(storage, 'CACHE_VERSION', storage.CACHE_VERSION + 1)
+    IID_Test().load(cache_dir=str(tmp_path))
+
+    assert len(os.listdir(tmp_path)) == 2
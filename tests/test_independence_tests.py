@@ -0,0 +1,186 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import linalg, stats
+
+from castle.common import independence_tests
+from castle.common.independence_tests import (DiscreteCITester, GaussCITester,
+                                              KCITester, hsic_test)
+
+
+def _fisher_z_reference(data, x, y, z):
+    """Fisher-z p-value from the correlation of least squares residuals"""
+
+    n = data.shape[0]
+    Z = np.column_stack([np.ones(n), data[:, z]])
+    res_x = data[:, x] - Z @ linalg.lstsq(Z, data[:, x])[0]
+    res_y = data[:, y] - Z @ linalg.lstsq(Z, data[:, y])[0]
+    r = stats.pearsonr(res_x, res_y)[0]
+
+    return 2 * stats.norm.sf(np.abs(np.sqrt(n - len(z) - 3) * np.arctanh(r)))
+
+
+@pytest.mark.parametrize('z', [[], [2], [2, 3], [3, 4, 2]])
+def test_gauss_p_value_matches_reference(z):
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((500, 5))
+    data[:, 1] += 0.1 * data[:, 0] + data[:, 2]
+    tester = GaussCITester(data)
+
+    for x, y in ((0, 1), (1, 0), (0, 4)):
+        if x in z or y in z:
+            continue
+        _, _, p_value = tester(data, x, y, z)
+        assert p_value == pytest.approx(_fisher_z_reference(data, x, y, z),
+                                        rel=1e-8, abs=1e-12)
+
+
+def test_gauss_batch_matches_single_queries():
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((300, 6))
+    data[:, 1] += data[:, 0]
+    tester = GaussCITester(data, max_cache_size=2)
+    queries = [(0, 1, (2,)), (0, 3, ()), (1, 4, (2, 5)), (3, 4, (2,)),
+               (0, 5, (1, 2)), (2, 3, (5, 1))]
+
+    expected = [tester(data, x, y, list(z))[2] for x, y, z in queries]
+    np.testing.assert_allclose(tester.batch_queries(queries), expected,
+                               rtol=1e-12)
+
+
+def _power_divergence_reference(data, x, y, z, lambda_):
+    """Sum of ``stats.chi2_contingency`` over the strata of z"""
+
+    data = pd.DataFrame(data)
+    strata = [data] if len(z) == 0 else [df for _, df in data.groupby(z)]
+    chi2, dof = 0., 0
+    for df in strata:
+        table = pd.crosstab(df[x], df[y])
+        c, _, d, _ = stats.chi2_contingency(table, lambda_=lambda_)
+        chi2, dof = chi2 + c, dof + d
+    p_value = stats.chi2.sf(chi2, dof) if dof > 0 else 1.
+
+    return chi2, dof, p_value
+
+
+def _discrete_data(rng):
+    data = rng.integers(0, 3, size=(600, 5))
+    data[:, 1] = (data[:, 1] + data[:, 0] * (rng.random(600) < 0.3)) % 3
+    # binary and sparse integer codes
+    data[:, 3] = rng.integers(0, 2, 600)
+    data[:, 4] = rng.choice([-7, 10 ** 9, 3 * 10 ** 12], 600)
+
+    return data
+
+
+@pytest.mark.parametrize('lambda_', ['pearson', 'log-likelihood',
+                                     'freeman-tukey', 'cressie-read'])
+@pytest.mark.parametrize('x, y, z', [(0, 1, []), (0, 3, []), (0, 1, [2]),
+                                     (3, 4, [0]), (0, 1, [3, 4]),
+                                     (1, 2, [0, 3, 4])])
+def test_discrete_matches_chi2_contingency(lambda_, x, y, z):
+    data = _discrete_data(np.random.default_rng(0))
+    tester = DiscreteCITester(data, lambda_=lambda_)
+    lambda_ = independence_tests._POWER_DIV_LAMBDA[lambda_]
+
+    chi2, dof, p_value = tester(data, x, y, z)
+    ref_chi2, ref_dof, ref_p_value = _power_divergence_reference(
+        data, x, y, z, lambda_)
+    assert dof == ref_dof
+    # nan where scipy gives nan, e.g. Freeman-Tukey on empty cells
+    np.testing.assert_allclose([chi2, p_value], [ref_chi2, ref_p_value],
+                               rtol=1e-8, atol=1e-12)
+
+
+def test_discrete_large_tables_are_counted_per_stratum(monkeypatch):
+    data = _discrete_data(np.random.default_rng(1))
+    tester = DiscreteCITester(data)
+    expected = tester(data, 0, 1, [2, 3, 4])
+    monkeypatch.setattr(independence_tests, '_MAX_TABLE_SIZE', 4)
+
+    np.testing.assert_allclose(tester(data, 0, 1, [2, 3, 4]), expected)
+
+
+def _null_data(n, n_z, nonlinear, rng):
+    """x and y both depend on z, x _||_ y | z"""
+
+    z = rng.standard_normal((n, n_z))
+    a, b = rng.uniform(0.5, 1.5, n_z), rng.uniform(0.5, 1.5, n_z)
+    if nonlinear:
+        x = np.dot(np.sin(z), a) + 0.5 * rng.standard_normal(n)
+        y = np.dot(np.tanh(z), b) + 0.5 * rng.standard_normal(n)
+    else:
+        x = np.dot(z, a) + rng.standard_normal(n)
+        y = np.dot(z, b) + rng.standard_normal(n)
+
+    return np.column_stack([x, y, z])
+
+
+@pytest.mark.parametrize('approx', ['rff', 'nystrom'])
+@pytest.mark.parametrize('n_z', [1, 2, 3])
+def test_kci_false_rejection_rate(approx, n_z):
+    """Under the null the test rejects at about the significance level."""
+
+    alpha, n_trials = 0.05, 40
+    rejections = 0
+    for trial in range(n_trials):
+        rng = np.random.default_rng(100 * n_z + trial)
+        np.random.seed(trial)
+        data = _null_data(2000, n_z, trial % 2 == 1, rng)
+        tester = KCITester(data, approx=approx)
+        _, _, p_value = tester(data, 0, 1, list(range(2, 2 + n_z)))
+        rejections += p_value < alpha
+
+    assert rejections / n_trials <= 3 * alpha
+
+
+@pytest.mark.parametrize('approx', ['rff', 'nystrom'])
+def test_kci_detects_conditional_dependence(approx):
+    rng = np.random.default_rng(0)
+    np.random.seed(0)
+    n = 2000
+    z = rng.standard_normal((n, 2))
+    x = z.sum(axis=1) + rng.standard_normal(n)
+    y = 0.5 * np.sin(2 * x) + z.sum(axis=1) + rng.standard_normal(n)
+    data = np.column_stack([x, y, z])
+    _, _, p_value = KCITester(data, approx=approx)(data, 0, 1, [2, 3])
+
+    assert p_value < 0.01
+
+
+@pytest.mark.parametrize('approx', [None, 'rff', 'nystrom'])
+def test_hsic_false_rejection_rate(approx):
+    alpha, n_trials = 0.05, 40
+    rejections = 0
+    for trial in range(n_trials):
+        rng = np.random.default_rng(trial)
+        np.random.seed(trial)
+        x, y = rng.standard_normal((2, 400, 1))
+        rejections += hsic_test(x, y, alpha=alpha, approx=approx) == 0
+
+    assert rejections / n_trials <= 3 * alpha
+
+
+@pytest.mark.parametrize('approx', [None, 'rff', 'nystrom'])
+def test_hsic_detects_nonlinear_dependence(approx):
+    rng = np.random.default_rng(0)
+    np.random.seed(0)
+    x = rng.standard_normal((400, 1))
+    y = x ** 2 + 0.5 * rng.standard_normal((400, 1))
+
+    assert hsic_test(x, y, approx=approx) == 0
@@ -0,0 +1,95 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from scipy import sparse as sp
+
+from castle.metrics import MetricsDAG
+
+
+def _random_dag(d, rng):
+    B = np.triu(rng.random((d, d)) < 0.3, k=1).astype(int)
+    order = rng.permutation(d)
+
+    return B[np.ix_(order, order)]
+
+
+def _random_cpdag(d, rng):
+    """Directed edges, and undirected ones stored once as -1 with i < j"""
+
+    B = _random_dag(d, rng)
+    undirected = np.triu((B + B.T) > 0, k=1) & (rng.random((d, d)) < 0.3)
+    B[undirected | undirected.T] = 0
+    B[undirected] = -1
+
+    return B
+
+
+@pytest.fixture(scope='module')
+def graphs():
+    rng = np.random.default_rng(0)
+    d, K = 12, 6
+    estimates = np.stack([_random_cpdag(d, rng) for _ in range(K)])
+    truths = np.stack([_random_dag(d, rng) for _ in range(K)])
+
+    return estimates, truths
+
+
+def _assert_batch_equal(batch, singles):
+    for name, values in batch.items():
+        np.testing.assert_allclose(
+            values, [single[name] for single in singles], equal_nan=True,
+            err_msg=name)
+
+
+def test_known_metrics():
+    B_true = np.array([[0, 1, 1], [0, 0, 1], [0, 0, 0]])
+    B_est = np.array([[0, 1, 0], [0, 0, 0], [1, 1, 0]])
+    metrics = MetricsDAG(B_est, B_true).metrics
+
+    assert metrics['shd'] == 2
+    assert metrics['nnz'] == 3
+    assert metrics['tpr'] == pytest.approx(1 / 3, abs=1e-4)
+    assert metrics['fdr'] == pytest.approx(2 / 3, abs=1e-4)
+
+
+def test_batch_matches_single_graphs(graphs):
+    estimates, truths = graphs
+    singles = [MetricsDAG(est, true).metrics
+               for est, true in zip(estimates, truths)]
+
+    _assert_batch_equal(MetricsDAG(estimates, truths).metrics, singles)
+
+
+def test_batch_with_one_true_graph(graphs):
+    estimates, truths = graphs
+    singles = [MetricsDAG(est, truths[0]).metrics for est in estimates]
+
+    _assert_batch_equal(MetricsDAG(estimates, truths[0]).metrics, singles)
+
+
+def test_sparse_matches_dense(graphs):
+    estimates, truths = graphs
+    for est, true in zip(estimates, truths):
+        dense = MetricsDAG(est, true).metrics
+        sparse = MetricsDAG(sp.csr_matrix(est), sp.csr_matrix(true)).metrics
+        assert sparse == pytest.approx(dense, nan_ok=True)
+
+    singles = [MetricsDAG(est, true).metrics
+               for est, true in zip(estimates, truths)]
+    batch = MetricsDAG([sp.csr_matrix(est) for est in estimates],
+                       [sp.coo_matrix(true) for true in truths]).metrics
+    _assert_batch_equal(batch, singles)
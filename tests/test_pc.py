@@ -0,0 +1,55 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from castle.datasets import DAG, IIDSimulation
+from castle.metrics import MetricsDAG
+from castle.pc import PC
+
+
+@pytest.fixture(scope='module')
+def linear_gauss():
+    W = DAG.erdos_renyi(n_nodes=8, n_edges=10, weight_range=(0.5, 2.0),
+                        seed=1)
+    X = IIDSimulation(W, n=5000, method='linear', sem_type='gauss',
+                      seed=1).X
+
+    return X, (W != 0).astype(int)
+
+
+def test_pc_recovers_linear_gauss_dag(linear_gauss):
+    X, B = linear_gauss
+    pc = PC()
+    pc.learn(X)
+
+    np.testing.assert_array_equal(pc.skeleton, ((B + B.T) > 0).astype(int))
+    assert MetricsDAG(np.asarray(pc.causal_matrix), B).metrics['shd'] == 0
+
+
+@pytest.mark.parametrize('n_jobs, parallel',
+                         [(2, 'thread'), (2, 'process')])
+def test_pc_parallel_matches_serial(linear_gauss, n_jobs, parallel):
+    X, _ = linear_gauss
+    serial = PC()
+    serial.learn(X)
+    pc = PC(n_jobs=n_jobs, parallel=parallel)
+    pc.learn(X)
+
+    np.testing.assert_array_equal(pc.skeleton, serial.skeleton)
+    assert pc.sepsets == serial.sepsets
+    np.testing.assert_array_equal(np.asarray(pc.causal_matrix),
+                                  np.asarray(serial.causal_matrix))
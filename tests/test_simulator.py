@@ -0,0 +1,173 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from scipy import sparse as sp
+from scipy.sparse.csgraph import connected_components, shortest_path
+
+from castle.datasets import (DAG, IIDSimulation, Topology, THPSimulation,
+                             load_simulation)
+
+
+@pytest.fixture(scope='module')
+def W():
+    return DAG.erdos_renyi(n_nodes=6, n_edges=9, weight_range=(0.5, 1.5),
+                           seed=3)
+
+
+def test_linear_gauss_covariance(W):
+    scale = np.array([1., 0.5, 2., 1., 1.5, 0.8])
+    X = IIDSimulation(W, n=200000, sem_type='gauss', noise_scale=scale,
+                      seed=0).X
+    inv = np.linalg.inv(np.eye(6) - W)
+    expected = inv.T @ np.diag(scale ** 2) @ inv
+
+    np.testing.assert_allclose(np.cov(X.T), expected, rtol=0.05,
+                               atol=0.02 * np.abs(expected).max())
+    # each variable is its parents' contribution plus its own noise
+    noise = X @ (np.eye(6) - W)
+    np.testing.assert_allclose(noise.std(axis=0), scale, rtol=0.02)
+
+
+@pytest.mark.parametrize('sem_type', ['gauss', 'exp', 'gumbel', 'uniform'])
+def test_linear_chunks_are_identical(W, sem_type, tmp_path):
+    whole = IIDSimulation(W, n=1000, sem_type=sem_type, seed=0).X
+    chunked = IIDSimulation(W, n=1000, sem_type=sem_type, chunk_size=77,
+                            seed=0).X
+    IIDSimulation(W, n=1000, sem_type=sem_type, chunk_size=77,
+                  output_dir=str(tmp_path), seed=0)
+    written, meta = load_simulation(str(tmp_path))
+
+    np.testing.assert_array_equal(chunked, whole)
+    np.testing.assert_array_equal(written, whole)
+    np.testing.assert_array_equal(meta['W'], W)
+
+
+def test_linear_population_covariance(W):
+    X = IIDSimulation(W, n=np.inf, sem_type='gauss').X
+    inv = np.linalg.inv(np.eye(6) - W)
+
+    np.testing.assert_allclose(X.T @ X / 6, inv.T @ inv)
+
+
+def _is_dag(W):
+    """No self-loop and only singleton strongly connected components"""
+
+    n_components, _ = connected_components(W, directed=True,
+                                           connection='strong')
+
+    return W.diagonal().sum() == 0 and n_components == W.shape[0]
+
+
+@pytest.mark.parametrize('graph, params, n_edges', [
+    ('erdos_renyi', {'n_nodes': 5000, 'n_edges': 20000}, None),
+    ('scale_free', {'n_nodes': 5000, 'n_edges': 15000}, 3 * (5000 - 3)),
+    ('bipartite', {'n_nodes': 5000, 'n_edges': 20000}, None),
+])
+def test_sparse_dag(graph, params, n_edges):
+    W = getattr(DAG, graph)(weight_range=(0.5, 2.0), seed=0, sparse=True,
+                            **params)
+    B = sp.csr_matrix(W != 0, dtype=int)
+
+    assert sp.issparse(W) and W.shape == (5000, 5000)
+    assert _is_dag(B)
+    # no pair of nodes linked twice
+    assert (B + B.T).max() == 1
+    if n_edges is None:
+        assert abs(B.nnz - params['n_edges']) < 4 * np.sqrt(params['n_edges'])
+    else:
+        assert B.nnz == n_edges
+    weights = np.abs(W.data)
+    assert weights.min() >= 0.5 and weights.max() <= 2.0
+
+
+def test_sparse_bipartite_edges_cross_the_split():
+    B = DAG.bipartite(n_nodes=1000, n_edges=3000, seed=0, sparse=True)
+    rows, cols = B.nonzero()
+
+    assert np.all((rows < 200) != (cols < 200))
+
+
+@pytest.mark.parametrize('method, sem_type', [
+    ('linear', 'gauss'), ('linear', 'exp'), ('linear', 'logistic'),
+    ('nonlinear', 'mlp'), ('nonlinear', 'gp-add'),
+    ('nonlinear', 'quadratic')])
+def test_sparse_w_simulates_like_dense(W, method, sem_type):
+    dense = IIDSimulation(W.copy(), n=500, method=method, sem_type=sem_type,
+                          seed=0).X
+    sparse = IIDSimulation(sp.csr_matrix(W), n=500, method=method,
+                           sem_type=sem_type, seed=0).X
+
+    np.testing.assert_allclose(sparse, dense, rtol=1e-10, atol=1e-10)
+
+
+def test_thp_k_hop_neighbors():
+    topology = sp.csr_matrix(Topology.erdos_renyi(n_nodes=60, n_edges=80,
+                                                  seed=0))
+    topology = ((topology + topology.T) > 0).astype(int)
+    hops = shortest_path(topology, unweighted=True)
+    neighbors = THPSimulation._get_k_hop_neighbors(topology, 3)
+
+    for k, matrix in enumerate(neighbors):
+        np.testing.assert_array_equal(matrix.toarray(), hops == k)
+
+
+def test_thp_immigrants():
+    """Without causal edges only the immigrants of rate mu are simulated."""
+
+    np.random.seed(0)
+    simulator = THPSimulation(np.zeros((5, 5)),
+                              Topology.erdos_renyi(20, 30, seed=0),
+                              mu_range=(0.01, 0.01))
+    events = simulator.simulate(T=1000, max_hop=2)
+    expected = 0.01 * 1000.5 * 5 * 20
+
+    assert abs(len(events) - expected) < 4 * np.sqrt(expected)
+    assert events.timestamp.min() >= 0 and events.timestamp.max() <= 1001
+
+
+def test_thp_offspring():
+    """
+    Every event of type 0 triggers Poisson(alpha (duration + 0.5)) events
+    of type 1, durations being rounded Exp(beta): alpha (beta + 0.5) each
+    on average.
+    """
+
+    np.random.seed(0)
+    simulator = THPSimulation(np.array([[0, 1], [0, 0]]), np.zeros((1, 1)),
+                              mu_range=(0.05, 0.05), alpha_range=(0.05, 0.05))
+    events = simulator.simulate(T=200000, max_hop=0, beta=10)
+    counts = np.bincount(events.event, minlength=2)
+    offspring = counts[1] - counts[0]
+
+    assert abs(offspring - 0.05 * 10.5 * counts[0]) < 600
+
+
+def test_thp_written_events_match_memory(tmp_path):
+    causal = DAG.erdos_renyi(n_nodes=6, n_edges=8, seed=1)
+    topology = Topology.erdos_renyi(n_nodes=30, n_edges=50, seed=1)
+    np.random.seed(2)
+    events = THPSimulation(causal, topology, mu_range=(1e-3, 2e-3)).simulate(
+        T=20000, max_hop=2)
+    np.random.seed(2)
+    THPSimulation(causal, topology, mu_range=(1e-3, 2e-3)).simulate(
+        T=20000, max_hop=2, output_dir=str(tmp_path))
+    written, meta = load_simulation(str(tmp_path))
+
+    assert np.all(np.diff(events.node.values) >= 0)
+    for name in ('event', 'timestamp', 'node'):
+        np.testing.assert_array_equal(written[name], events[name].values)
+    np.testing.assert_array_equal(meta['causal_matrix'], causal != 0)
@@ -0,0 +1,44 @@
+# coding=utf-8
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import numpy as np
+
+from castle.datasets import simulate_suite, load_simulation
+
+
+GRID = {'graph': ['erdos_renyi'], 'n_nodes': [5], 'n_edges': [5], 'n': [100]}
+
+
+def test_serial_suite_keeps_global_random_state(tmp_path):
+    np.random.seed(5)
+    random.seed(5)
+    expected = np.random.rand(), random.random()
+    np.random.seed(5)
+    random.seed(5)
+    simulate_suite(GRID, n_repeats=2, n_jobs=1, cache_dir=str(tmp_path))
+
+    assert (np.random.rand(), random.random()) == expected
+
+
+def test_suite_is_reproducible(tmp_path):
+    first = simulate_suite(GRID, n_repeats=2, n_jobs=1,
+                           cache_dir=str(tmp_path / 'first'))
+    second = simulate_suite(GRID, n_repeats=2, n_jobs=1,
+                            cache_dir=str(tmp_path / 'second'))
+
+    for a, b in zip(first.path, second.path):
+        np.testing.assert_array_equal(load_simulation(a)[0],
+                                      load_simulation(b)[0])